@@ -0,0 +1,163 @@
+# advisor_prompt.py
+# What shot_advisor sends the model, kept small: every prompt token is paid
+# for in latency and cost on every dose. Compared with dumping the context
+# dicts as JSON, the compact encoding
+#   - sends the history column-wise (names once, then one short array per dose)
+#   - gives each dose as minutes ago instead of a full ISO timestamp
+#   - names each insulin once in "types" and refers to it by index
+#   - drops the patient's name, which the decision does not need
+#   - fits a hard token budget, dropping the oldest doses first
+#
+#   ADVISOR_PROMPT=compact (default) or verbose (the old JSON, for comparison)
+#
+#   python advisor_prompt.py USER_ID [UNITS]   # before/after token counts for a patient
+import os
+import re
+import json
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+# ─── CONFIG ─────────────────────────────────────────────────
+ENCODING = os.environ.get("ADVISOR_PROMPT", "compact")                 # "compact" or "verbose"
+TOKEN_BUDGET = int(os.environ.get("ADVISOR_PROMPT_TOKENS", "600"))     # 12 ordinary rows fit with room for remarks
+NOTE_CHARS = 80  # per-dose remarks are cut to this; the proposed shot's remarks only if nothing else fits
+
+INSTRUCTION = (
+    "Diabetes assistant: should the patient inject the proposed dose now or wait? "
+    "Suggest waiting if similar insulin was taken recently. "
+    "logs: newest first, one row per dose in the order of cols; m = minutes ago, t = index into types. "
+    'Reply ONLY with JSON, keys in this order: {"recommendation":"take_now"|"wait","wait_minutes":int,"reason":"short, patient-friendly"}'
+)
+VERBOSE_INSTRUCTION = (
+    "You are a diabetes assistant. Decide if the user should take an insulin shot RIGHT NOW "
+    "or WAIT for some time. Consider recent dosing history and the proposed units.\n"
+    "If recent similar insulin was taken very recently, suggest waiting.\n"
+    "IMPORTANT: Return ONLY valid JSON with keys: recommendation (take_now|wait), "
+    "wait_minutes (integer), reason (short, patient-friendly).\n"
+)
+COLUMNS = ["m", "t", "u", "purpose", "ctx", "note"]
+
+class Prompt(NamedTuple):
+    text: str
+    tokens: int          # estimated size of text
+    verbose_tokens: int  # estimated size of the same context in the verbose encoding
+    rows: int            # history rows sent
+    dropped: int         # history rows left out to fit TOKEN_BUDGET
+
+_WORDS = re.compile(r"[A-Za-z]+|\d+")
+_PUNCT = re.compile(r"[^\sA-Za-z\d]+")
+
+def estimate_tokens(text: str) -> int:
+    """
+    Offline token estimate: a token per 4 letters or 3 digits and per 2 punctuation
+    marks in a run (JSON's '":"' and '],[' mostly merge). Errs on the high side, the
+    safe side for a budget; model.count_tokens() is exact but a network round trip.
+    """
+    words = sum((len(w) + 3) // 4 if w[0].isalpha() else (len(w) + 2) // 3 for w in _WORDS.findall(text))
+    return words + sum((len(p) + 1) // 2 for p in _PUNCT.findall(text))
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+def _number(x: float):
+    return int(x) if float(x).is_integer() else round(float(x), 2)
+
+def _minutes(now_iso: str) -> str:
+    try:
+        return datetime.fromisoformat(now_iso).isoformat(timespec="minutes")
+    except (TypeError, ValueError):
+        return now_iso
+
+def verbose(patient: dict, history: list[dict], proposed_units: float, remarks: str,
+            now_iso: str, iob_units: float) -> str:
+    """The original prompt: the context dicts as one JSON document."""
+    prompt = {
+        "instruction": VERBOSE_INSTRUCTION,
+        "now_local_iso": now_iso,
+        "patient": patient,
+        "proposed_shot": {"units": proposed_units, "remarks": remarks},
+        "insulin_on_board_units": iob_units,
+        "recent_logs": history,
+    }
+    return f"Analyze this JSON and respond ONLY with JSON:\n{_dumps(prompt)}"
+
+def compact(patient: dict, history: list[dict], proposed_units: float, remarks: str,
+            now_iso: str, iob_units: float, now: datetime | None = None,
+            budget: int = TOKEN_BUDGET) -> tuple[str, int, int]:
+    """
+    (text, rows sent, rows dropped) for the compact encoding, within `budget` estimated
+    tokens. The instruction and the proposed shot always go, even past the budget.
+    """
+    now = now or datetime.now(timezone.utc)
+    types: list[str] = []
+    rows = []
+    for h in history:  # newest first, as _fetch_context returns them
+        ts = datetime.fromisoformat(h["timestamp_utc"])
+        ts = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+        itype = h.get("insulin_type") or ""
+        if itype not in types:
+            types.append(itype)
+        rows.append([max(0, round((now - ts).total_seconds() / 60)), types.index(itype),
+                     _number(h.get("units_taken") or 0), h.get("purpose"), h.get("dose_context"),
+                     (h.get("remarks") or "")[:NOTE_CHARS]])
+
+    doc = {
+        "now": _minutes(now_iso),
+        "patient": {k: v for k, v in (("tz", patient.get("time_zone")), ("basal", patient.get("basal_type")),
+                                      ("bolus", patient.get("bolus_type"))) if v},
+        "shot": {"u": _number(proposed_units), "note": remarks or ""},
+        "iob_u": iob_units,
+        "types": types,
+        "logs": {"cols": COLUMNS, "rows": rows},
+    }
+    total = len(rows)
+
+    def render() -> str:
+        used = sorted({r[1] for r in doc["logs"]["rows"]})
+        body = dict(doc, types=[types[i] for i in used],
+                    logs=dict(cols=COLUMNS, rows=[[r[0], used.index(r[1])] + r[2:] for r in doc["logs"]["rows"]]))
+        return f"{INSTRUCTION}\n{_dumps(body)}"
+
+    text = render()
+    while estimate_tokens(text) > budget and doc["logs"]["rows"]:
+        doc["logs"]["rows"] = doc["logs"]["rows"][:-1]  # oldest goes first
+        text = render()
+    note = remarks or ""
+    while estimate_tokens(text) > budget and note:
+        note = note[:len(note) // 2]  # last resort: the proposed shot's own remarks
+        doc["shot"]["note"] = note + "…" if note else ""
+        text = render()
+    sent = len(doc["logs"]["rows"])
+    return text, sent, total - sent
+
+def build(patient: dict, history: list[dict], proposed_units: float, remarks: str,
+          now_iso: str, iob_units: float, now: datetime | None = None) -> Prompt:
+    """The prompt in the configured ENCODING, with its token count and the verbose one's."""
+    full = verbose(patient, history, proposed_units, remarks, now_iso, iob_units)
+    full_tokens = estimate_tokens(full)
+    if ENCODING == "verbose":
+        return Prompt(full, full_tokens, full_tokens, len(history), 0)
+    text, sent, dropped = compact(patient, history, proposed_units, remarks, now_iso, iob_units, now)
+    return Prompt(text, estimate_tokens(text), full_tokens, sent, dropped)
+
+def main():
+    import sys
+    import iob
+    import shot_advisor
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python advisor_prompt.py USER_ID [UNITS]")
+    uid, units = int(sys.argv[1]), float(sys.argv[2]) if len(sys.argv) > 2 else 4.0
+    ctx = shot_advisor._fetch_context(uid)
+    patient, history = ctx.get("patient") or {}, ctx.get("history") or []
+    now = datetime.now(timezone.utc)
+    args = (patient, history, units, "", now.astimezone().isoformat(), iob.insulin_on_board(history, now))
+    full = verbose(*args)
+    text, sent, dropped = compact(*args, now=now)
+    print(text)
+    print(f"\n📏 verbose {estimate_tokens(full)} tokens ({len(full)} chars) -> "
+          f"compact {estimate_tokens(text)} tokens ({len(text)} chars); "
+          f"{sent} rows sent, {dropped} dropped, budget {TOKEN_BUDGET}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# advisor_response.py
+# What shot_advisor accepts back from the model: one flat JSON object,
+#   {"recommendation": "take_now"|"wait", "wait_minutes": int, "reason": str}
+# checked strictly against SCHEMA (no extra keys, nothing nested), read
+# cautiously where the decision contradicts itself, and parsed incrementally as the response streams, so the caller can stop
+# reading as soon as the decision is known.
+#
+# SCHEMA is also handed to the model as its response_schema where the SDK
+# supports structured output; without it, a ```json fence around the object
+# is tolerated and nothing else is.
+import re
+import json
+import threading
+
+# ─── CONFIG ─────────────────────────────────────────────────
+MAX_WAIT_MINUTES = 24 * 60
+MIN_WAIT_MINUTES = 15  # "wait" with 0 minutes still means wait
+SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "recommendation": {"type": "STRING", "enum": ["take_now", "wait"]},
+        "wait_minutes": {"type": "INTEGER"},
+        "reason": {"type": "STRING"},
+    },
+    "required": ["recommendation", "wait_minutes", "reason"],
+}
+FIELDS = tuple(SCHEMA["properties"])  # also the order the model is asked to emit them in
+DECISION = ("recommendation", "wait_minutes")
+
+_SCALAR = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+_SCALAR_RUN = re.compile(r"[-+.\deEtrufalsn]*")  # characters a number/true/false/null can be made of
+
+class ParseError(ValueError):
+    """The model's answer is unusable; `kind` is invalid_json, schema or incomplete (for the metric)."""
+
+    def __init__(self, kind: str, msg: str):
+        super().__init__(msg)
+        self.kind = kind
+
+def stock_reason(recommendation: str, wait_minutes: int) -> str:
+    """Used when reading stopped before the model's own reason arrived."""
+    if recommendation == "wait":
+        return f"Wait about {wait_minutes} minutes before taking this dose."
+    return "Nothing in your recent doses argues against taking this one now."
+
+def cautious(fields: dict) -> dict:
+    """Resolve a self-contradicting decision towards waiting, never towards taking the dose."""
+    if fields["recommendation"] == "wait" and fields["wait_minutes"] == 0:
+        fields["wait_minutes"] = MIN_WAIT_MINUTES
+    elif fields["recommendation"] == "take_now" and fields["wait_minutes"] > 0:
+        fields["recommendation"] = "wait"
+    return fields
+
+def check(fields: dict, complete: bool = True) -> dict:
+    """Validate against SCHEMA; with complete=False only what has arrived so far is checked."""
+    extra = set(fields) - set(FIELDS)
+    if extra:
+        raise ParseError("schema", f"unexpected keys {sorted(extra)}")
+    missing = [k for k in FIELDS if k not in fields]
+    if complete and missing:
+        raise ParseError("schema", f"missing {missing}")
+    rec, wait = fields.get("recommendation"), fields.get("wait_minutes")
+    if "recommendation" in fields and rec not in ("take_now", "wait"):
+        raise ParseError("schema", f"recommendation {rec!r}")
+    if "wait_minutes" in fields:
+        if not isinstance(wait, int) or isinstance(wait, bool) or not 0 <= wait <= MAX_WAIT_MINUTES:
+            raise ParseError("schema", f"wait_minutes {wait!r}")
+    if "reason" in fields and not (isinstance(fields["reason"], str) and fields["reason"].strip()):
+        raise ParseError("schema", "empty reason")
+    return fields
+
+class StreamParser:
+    """
+    Feed it the response text chunk by chunk. Never raises from feed(): the
+    first problem lands in .error and later chunks are ignored, so a bad
+    answer does not look like a failed call to the circuit breaker.
+    result() may be called from another thread while chunks still arrive.
+    """
+
+    def __init__(self, fenced: bool = True):
+        self.fenced = fenced  # tolerate ```json fences (plain JSON mode)
+        self.fields: dict = {}
+        self.done = False     # closing brace seen
+        self.error: ParseError | None = None
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"  # start → key → colon → value → comma → key ...
+        self._key = None
+        self._lock = threading.Lock()
+
+    @property
+    def decided(self) -> bool:
+        return self.error is None and all(k in self.fields for k in DECISION)
+
+    def feed(self, chunk: str) -> "StreamParser":
+        with self._lock:
+            if self.error is None and not self.done and chunk:
+                self._buf += chunk
+                try:
+                    self._scan()
+                    check(self.fields, complete=False)
+                except ParseError as e:
+                    self.error = e
+        return self
+
+    def _string_end(self, i: int) -> int | None:
+        """Index of the quote closing the string that opens at i, or None if it has not arrived."""
+        j = i + 1
+        while True:
+            j = self._buf.find('"', j)
+            if j < 0:
+                return None
+            k = j - 1
+            while self._buf[k] == "\\":
+                k -= 1
+            if (j - 1 - k) % 2 == 0:  # an even run of backslashes: the quote is not escaped
+                return j
+            j += 1
+
+    def _scan(self):
+        b = self._buf
+        while not self.done:
+            i = self._pos
+            while i < len(b) and b[i].isspace():
+                i += 1
+            if i >= len(b):
+                return
+            c, state = b[i], self._state
+            if state == "start":
+                if self.fenced and b.startswith("`", i):
+                    nl = b.find("\n", i)
+                    if nl < 0:
+                        return
+                    self._pos = nl + 1  # "```json\n"
+                    continue
+                if c != "{":
+                    raise ParseError("invalid_json", f"expected an object, got {b[i:i + 20]!r}")
+                self._pos, self._state = i + 1, "key"
+            elif state == "key":
+                if c == "}" and not self.fields:
+                    self._pos, self.done = i + 1, True
+                elif c != '"':
+                    raise ParseError("invalid_json", f"expected a key at {b[i:i + 20]!r}")
+                else:
+                    end = self._string_end(i)
+                    if end is None:
+                        return
+                    self._key = json.loads(b[i:end + 1])
+                    self._pos, self._state = end + 1, "colon"
+            elif state == "colon":
+                if c != ":":
+                    raise ParseError("invalid_json", f"expected ':' after {self._key!r}")
+                self._pos, self._state = i + 1, "value"
+            elif state == "value":
+                if c == '"':
+                    end = self._string_end(i)
+                    if end is None:
+                        return
+                    raw = b[i:end + 1]
+                elif c in "[{":
+                    raise ParseError("schema", f"unsupported value for {self._key!r}")
+                else:
+                    run = _SCALAR_RUN.match(b, i)
+                    if run.end() >= len(b):
+                        return  # "30." or "tr" may go on in the next chunk
+                    if not _SCALAR.fullmatch(run.group()):
+                        raise ParseError("invalid_json", f"bad value {b[i:run.end() + 1]!r} for {self._key!r}")
+                    end, raw = run.end() - 1, run.group()
+                try:
+                    value = json.loads(raw)
+                except ValueError as e:
+                    raise ParseError("invalid_json", f"{self._key!r}: {e}") from e
+                if self._key in self.fields:
+                    raise ParseError("schema", f"duplicate key {self._key!r}")
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)  # "wait_minutes": 20.0
+                self.fields[self._key] = value
+                self._pos, self._state = end + 1, "comma"
+            elif state == "comma":
+                if c == ",":
+                    self._pos, self._state = i + 1, "key"
+                elif c == "}":
+                    self._pos, self.done = i + 1, True
+                else:
+                    raise ParseError("invalid_json", f"expected ',' or '}}' after {self._key!r}")
+
+    def partial_reason(self) -> str:
+        """As much of the reason as has streamed in, if reading stops inside it."""
+        if self._state != "value" or self._key != "reason":
+            return ""
+        i = self._buf.find('"', self._pos)
+        raw = self._buf[i + 1:] if i >= 0 else ""
+        if (len(raw) - len(raw.rstrip("\\"))) % 2:
+            raw = raw[:-1]  # cut inside an escape
+        try:
+            return json.loads(f'"{raw}"').strip()
+        except ValueError:
+            return ""
+
+    def result(self) -> dict:
+        """The advice, validated. Raises ParseError when unusable."""
+        with self._lock:
+            return self._result()
+
+    def _result(self) -> dict:
+        if self.error is not None:
+            raise self.error
+        if not self.decided:
+            raise ParseError("incomplete", "the answer ended before the decision" if self._buf
+                                           else "empty answer")
+        if self.done:
+            return cautious(dict(check(self.fields)))
+        fields = cautious(dict(self.fields))  # stopped early: the decision is in, the reason may not be
+        partial = self.partial_reason()
+        fields["reason"] = fields.get("reason") or (partial + "…" if partial else
+                                                    stock_reason(fields["recommendation"], fields["wait_minutes"]))
+        return check(fields)
+
+def parse(text: str, fenced: bool = True) -> dict:
+    """Strict parse of a whole answer."""
+    p = StreamParser(fenced).feed(text)
+    if p.error is None and not p.done:
+        raise ParseError("incomplete", "the answer ended before the closing brace")
+    return p.result()
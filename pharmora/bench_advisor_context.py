@@ -0,0 +1,123 @@
+# bench_advisor_context.py
+# DB time per shot-advice call: the old context fetch (patient row, then the
+# last 12 insulin_logs, converted row by row) against shot_advisor's single
+# prepared query. Both run on the same pool, against the same seeded patient.
+#
+#   PGDATABASE=pharmora_load python bench_advisor_context.py --calls 2000 --logs 500
+#
+# Seeds one "loadtest-advisor" patient with --logs insulin logs and deletes it
+# afterwards unless --keep is given. Nothing is sent to the model.
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# ─── CONFIG ─────────────────────────────────────────────────
+WARMUP_CALLS = 50  # per variant, before timing (fills the pool, prepares the statement)
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Compare DB time of the old and new advisor context fetch.")
+    ap.add_argument("--calls", type=int, default=2000, help="timed calls per variant")
+    ap.add_argument("--logs", type=int, default=500, help="insulin logs to seed for the patient")
+    ap.add_argument("--keep", action="store_true", help="leave the seeded rows in place")
+    ap.add_argument("--allow-remote", action="store_true", help="allow a non-local PGHOST")
+    return ap.parse_args()
+
+def seed(cur, n_logs: int) -> int:
+    cur.execute("""
+        INSERT INTO patients (full_name, time_zone, primary_basal_insulin_type, primary_bolus_insulin_type)
+        VALUES ('loadtest-advisor', 'Asia/Kolkata', 'Lantus', 'Humalog')
+        RETURNING user_id
+    """)
+    uid = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO insulin_logs (user_id, timestamp_utc, insulin_type, units_taken, purpose, dose_context, remarks)
+        SELECT %s, %s::timestamptz - make_interval(hours => 4 * g),
+               CASE WHEN g %% 4 = 0 THEN 'Lantus' ELSE 'Humalog' END, 2 + g %% 7,
+               CASE WHEN g %% 4 = 0 THEN 'basal' ELSE 'bolus' END, 'before_meal',
+               CASE WHEN g %% 5 = 0 THEN 'felt low' END
+        FROM generate_series(1, %s) AS g
+    """, (uid, datetime.now(timezone.utc) - timedelta(minutes=5), n_logs))
+    return uid
+
+def legacy_fetch(db, user_id: int) -> dict:
+    """_fetch_context as it was: two statements, then a dict and isoformat() per row."""
+    with db.connection() as c, c.cursor() as cur:
+        cur.execute("""
+            SELECT full_name, time_zone, primary_basal_insulin_type, primary_bolus_insulin_type
+            FROM patients WHERE user_id=%s
+        """, (user_id,))
+        prow = cur.fetchone()
+        cur.execute("""
+            SELECT timestamp_utc, insulin_type, units_taken, purpose, dose_context, COALESCE(remarks,''), id
+            FROM insulin_logs
+            WHERE user_id=%s
+            ORDER BY timestamp_utc DESC
+            LIMIT 12
+        """, (user_id,))
+        logs = cur.fetchall()
+    patient = None
+    if prow:
+        patient = dict(full_name=prow[0], time_zone=prow[1] or "UTC", basal_type=prow[2], bolus_type=prow[3])
+    hist = [dict(timestamp_utc=ts.isoformat(), insulin_type=itype, units_taken=float(units), purpose=purpose,
+                 dose_context=ctx, remarks=rem) for ts, itype, units, purpose, ctx, rem, _ in logs]
+    return dict(patient=patient, history=hist, latest_log_id=max((r[6] for r in logs), default=None))
+
+def same_context(a: dict, b: dict) -> bool:
+    """Equal up to how the timestamps are spelled (Postgres drops trailing zeros in fractions)."""
+    def norm(ctx):
+        hist = [dict(h, timestamp_utc=datetime.fromisoformat(h["timestamp_utc"])) for h in ctx["history"]]
+        return dict(ctx, history=hist)
+    return norm(a) == norm(b)
+
+def run(db, fetch, uid: int, calls: int) -> tuple[list[float], int]:
+    """Per-call milliseconds and statements sent, after a warm-up."""
+    for _ in range(WARMUP_CALLS):
+        fetch(uid)
+    q0 = db.query_count()
+    ms = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        fetch(uid)
+        ms.append((time.perf_counter() - t0) * 1000)
+    return ms, db.query_count() - q0
+
+def main():
+    args = parse_args()
+    import db
+    import shot_advisor
+    from migrations import migrate
+
+    if not (db.is_local() or args.allow_remote):
+        sys.exit(f"refusing to benchmark PGHOST={db.DB['host']!r}; use a local scratch database or --allow-remote")
+
+    migrate()
+    with db.connect() as mc, mc.cursor() as cur:
+        uid = seed(cur, args.logs)
+        mc.commit()
+        print(f"🌱 seeded patient {uid} with {args.logs} insulin logs")
+        try:
+            old, new = legacy_fetch(db, uid), shot_advisor._fetch_context(uid)
+            if not same_context(old, new):
+                sys.exit(f"❌ the two fetches disagree:\n   old {old}\n   new {new}")
+
+            results = {}
+            for name, fetch in (("two queries", lambda u: legacy_fetch(db, u)),
+                                ("one prepared", shot_advisor._fetch_context)):
+                results[name] = run(db, fetch, uid, args.calls)
+
+            print(f"\n📈 {args.calls} context fetches per variant")
+            for name, (ms, queries) in results.items():
+                print(f"   {name:<13}: p50 {db.pct(ms, .5):.3f}ms  p95 {db.pct(ms, .95):.3f}ms  "
+                      f"mean {sum(ms) / len(ms):.3f}ms  {queries / args.calls:.1f} statements/call")  # incl. the pool health check
+            (old_ms, _), (new_ms, _) = results.values()
+            print(f"   speed-up (mean): {sum(old_ms) / sum(new_ms):.2f}x")
+            print(f"   pool     : {db.stats()}")
+        finally:
+            if not args.keep:
+                cur.execute("DELETE FROM patients WHERE user_id = %s", (uid,))  # cascades
+                mc.commit()
+                print(f"🧹 removed loadtest patient {uid}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# channels.py
+# Cheap, fast reminder channels that go out before (or instead of) a voice call.
+# Each patient lists the channels they want, first choice first, in
+# patients.reminder_channels (e.g. {sms,voice}); reminder_worker sends on the
+# first one and escalates to the next when no acknowledgement arrives within
+# REMINDER_ACK_SECONDS (see status_receiver.ACK_PATH). NULL means voice only.
+#
+#   sms      Twilio Messages, one request per message, paced at REMINDER_SMS_PER_SECOND
+#   push     JSON batch POST to REMINDER_PUSH_URL (a push gateway that maps user_id to devices)
+#   webhook  JSON batch POST to REMINDER_WEBHOOK_URL (e.g. a caregiver's system)
+#   voice    not here: telephony.py
+#
+#   MESSAGING=live (default unless TELEPHONY=fake) or fake:
+#   FAKE_MESSAGE_MS FAKE_MESSAGE_FAILURE_RATE FAKE_MESSAGE_BATCH FAKE_ACK_RATE FAKE_ACK_SECONDS
+#
+# The fake "patient" acknowledges a share of messages by POSTing the ref to
+# REMINDER_ACK_URL (when set), so the ack endpoint is exercised end to end.
+import os
+import json
+import heapq
+import itertools
+import random
+import threading
+import time
+import uuid
+from typing import NamedTuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from telephony import TELEPHONY, TWILIO_SID, TWILIO_TOKEN, TWILIO_FROM, TelephonyError, require_twilio
+from rate_limit import TokenBucket
+
+# ─── CONFIG ─────────────────────────────────────────────────
+MESSAGING = os.environ.get("MESSAGING", "fake" if TELEPHONY == "fake" else "live")  # "live" or "fake"
+CHANNELS = ("sms", "push", "webhook", "voice")  # allowed values of patients.reminder_channels
+TWILIO_SMS_FROM = os.environ.get("TWILIO_SMS_FROM", TWILIO_FROM)               # SMS-capable number
+SMS_PER_SECOND = float(os.environ.get("REMINDER_SMS_PER_SECOND", "1"))         # provider MPS; 0 = unlimited
+PUSH_URL = os.environ.get("REMINDER_PUSH_URL", "")
+WEBHOOK_URL = os.environ.get("REMINDER_WEBHOOK_URL", "")
+WEBHOOK_TOKEN = os.environ.get("REMINDER_WEBHOOK_TOKEN", "")  # sent as a Bearer token to both URLs
+WEBHOOK_BATCH = int(os.environ.get("REMINDER_WEBHOOK_BATCH", "100"))  # messages per POST
+ACK_URL = os.environ.get("REMINDER_ACK_URL", "")  # public URL of status_receiver's ACK_PATH
+HTTP_TIMEOUT_SECONDS = 10
+
+class Message(NamedTuple):
+    ref: str      # ack token; also our idempotency key towards the provider
+    user_id: int
+    to: str       # E.164 number for sms, user_id for push/webhook
+    body: str
+
+class Channel:
+    """A message provider. send() must be safe to call from many dispatcher threads."""
+    name = "base"
+    max_batch = 1  # messages one send() call hands to the provider at once
+
+    def send(self, messages: list[Message]) -> list:
+        """Deliver a batch; returns, per message, its provider id or the TelephonyError it failed with."""
+        raise NotImplementedError
+
+class TwilioSmsChannel(Channel):
+    """Twilio has no bulk send for Messages: one request each, on a shared session, paced to the MPS limit."""
+    name = "sms"
+
+    def __init__(self, sid: str = TWILIO_SID, token: str = TWILIO_TOKEN, from_: str = TWILIO_SMS_FROM,
+                 per_second: float = SMS_PER_SECOND):
+        require_twilio(TWILIO_ACCOUNT_SID=sid, TWILIO_AUTH_TOKEN=token, TWILIO_SMS_FROM=from_)
+        from twilio.rest import Client
+        from twilio.base.exceptions import TwilioRestException
+        self._client = Client(sid, token)
+        self._rest_error = TwilioRestException
+        self.from_ = from_
+        self.pace = TokenBucket(per_second) if per_second > 0 else None
+
+    def send(self, messages):
+        out = []
+        for m in messages:
+            if self.pace is not None:
+                time.sleep(self.pace.take(time.monotonic()))
+            try:
+                out.append(self._client.messages.create(to=m.to, from_=self.from_, body=m.body).sid)
+            except self._rest_error as e:
+                if e.status == 429 and self.pace is not None:
+                    self.pace.throttled()
+                out.append(TelephonyError(e.msg, e.status, e.code, retryable=e.status == 429 or e.status >= 500))
+        return out
+
+class WebhookChannel(Channel):
+    """
+    POSTs {"messages": [{ref, user_id, to, body, ack_url}, ...]} as JSON.
+    Any 2xx accepts the whole batch; the reply may carry {"ids": [...]} in the same order.
+    """
+
+    def __init__(self, name: str, url: str, max_batch: int = WEBHOOK_BATCH, token: str = WEBHOOK_TOKEN):
+        if not url:
+            raise ValueError(f"no URL configured for the {name} channel")
+        self.name = name
+        self.url = url
+        self.max_batch = max(1, max_batch)
+        self.token = token
+
+    def send(self, messages):
+        payload = {"messages": [dict(m._asdict(), ack_url=ACK_URL or None) for m in messages]}
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            with urlopen(Request(self.url, data=json.dumps(payload).encode(), headers=headers, method="POST"),
+                         timeout=HTTP_TIMEOUT_SECONDS) as resp:
+                reply = resp.read()
+        except HTTPError as e:
+            err = TelephonyError(f"{self.name}: HTTP {e.code}", e.code, e.code,
+                                 retryable=e.code == 429 or e.code >= 500)
+            return [err] * len(messages)
+        except (URLError, OSError) as e:
+            return [TelephonyError(f"{self.name}: {e}", None, "network")] * len(messages)
+        try:
+            ids = json.loads(reply or b"{}").get("ids") or []
+        except (ValueError, AttributeError):
+            ids = []
+        return [ids[i] if i < len(ids) else m.ref for i, m in enumerate(messages)]
+
+class FakeChannel(Channel):
+    """
+    Accepts batches after a configurable delay (or fails single messages at a
+    configurable rate) and has a share of recipients acknowledge after a
+    while, POSTing the ref to ack_url like someone tapping the link.
+    """
+
+    def __init__(self, name: str, max_batch: int = 100, send_ms: float = 0.0, failure_rate: float = 0.0,
+                 ack_rate: float = 0.7, ack_seconds: float = 5.0, ack_url: str = ACK_URL):
+        self.name = name
+        self.max_batch = max(1, max_batch)
+        self.send_ms = send_ms
+        self.failure_rate = failure_rate
+        self.ack_rate = ack_rate
+        self.ack_seconds = ack_seconds
+        self.ack_url = ack_url
+        self.sent = 0    # messages accepted so far
+        self.failed = 0  # messages failed on purpose so far
+        self.batches = 0
+        self._acks: list = []  # (due_monotonic, seq, ref)
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._thread = None
+
+    def send(self, messages):
+        if self.send_ms > 0:
+            time.sleep(self.send_ms / 1000)
+        out = []
+        with self._cv:
+            self.batches += 1
+            for m in messages:
+                if random.random() < self.failure_rate:
+                    self.failed += 1
+                    out.append(TelephonyError(f"fake {self.name}: undeliverable", 400, "fake-undeliverable",
+                                              retryable=False))
+                    continue
+                self.sent += 1
+                out.append(f"{self.name.upper()[:2]}{uuid.uuid4().hex}")
+                if self.ack_url and random.random() < self.ack_rate:
+                    heapq.heappush(self._acks, (time.monotonic() + self.ack_seconds, next(self._seq), m.ref))
+            if self._acks and self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, name=f"fake-{self.name}", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+        return out
+
+    def _deliver(self):
+        while True:
+            with self._cv:
+                while not self._acks or self._acks[0][0] > time.monotonic():
+                    self._cv.wait(self._acks[0][0] - time.monotonic() if self._acks else None)
+                _, _, ref = heapq.heappop(self._acks)
+            try:
+                urlopen(Request(self.ack_url, data=urlencode({"ref": ref}).encode(), method="POST"),
+                        timeout=5).close()
+            except Exception as e:
+                print(f"   fake {self.name}: ack to {self.ack_url} failed: {e}")
+
+def make_channel(name: str, kind: str | None = None) -> Channel:
+    """Build the channel `name` as a live or fake provider (default: the MESSAGING env var)."""
+    if name not in CHANNELS or name == "voice":
+        raise ValueError(f"unknown message channel {name!r}")
+    kind = kind or MESSAGING
+    if kind == "fake":
+        env = os.environ.get
+        return FakeChannel(
+            name,
+            max_batch=int(env("FAKE_MESSAGE_BATCH", "1" if name == "sms" else str(WEBHOOK_BATCH))),
+            send_ms=float(env("FAKE_MESSAGE_MS", "0")),
+            failure_rate=float(env("FAKE_MESSAGE_FAILURE_RATE", "0")),
+            ack_rate=float(env("FAKE_ACK_RATE", "0.7")),
+            ack_seconds=float(env("FAKE_ACK_SECONDS", "5")),
+        )
+    if kind == "live":
+        if name == "sms":
+            return TwilioSmsChannel()
+        return WebhookChannel(name, PUSH_URL if name == "push" else WEBHOOK_URL)
+    raise ValueError(f"unknown MESSAGING={kind!r} (expected 'live' or 'fake')")
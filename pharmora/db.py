@@ -0,0 +1,174 @@
+# db.py
+# One Postgres connection pool per process, shared by insulinmate (all Streamlit
+# sessions), shot_advisor, reminder_worker, status_receiver and migrations.
+#
+# Configured from the environment (or .env):
+#   PGHOST PGPORT PGDATABASE PGUSER PGPASSWORD PGSSLMODE
+#   DB_POOL_MIN_SIZE DB_POOL_MAX_SIZE DB_POOL_TIMEOUT DB_POOL_MAX_LIFETIME DB_POOL_MAX_IDLE
+#
+# Also home to the few helpers every DB-backed module shares: the reminders
+# NOTIFY channel, log timestamps and percentiles.
+import os
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import psycopg
+from psycopg_pool import ConnectionPool
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# ─── CONFIG ─────────────────────────────────────────────────
+DB = dict(
+    host=os.environ.get("PGHOST", "localhost"),
+    port=int(os.environ.get("PGPORT", "5432")),
+    dbname=os.environ.get("PGDATABASE", "inter"),
+    user=os.environ.get("PGUSER", "postgres"),
+    password=os.environ.get("PGPASSWORD") or None,  # no default: set it, or use ~/.pgpass / trust auth
+    sslmode=os.environ.get("PGSSLMODE", "disable"),
+)
+
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))             # max wait for a free connection
+POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "1800"))  # recycle connections after this
+POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))           # close surplus idle connections
+
+SAMPLES = 1024  # recent checkouts kept for stats()
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")  # PGHOSTs load tests and benchmarks may seed without --allow-remote
+# reminder_worker LISTENs here; writers NOTIFY {"user_id": ...} so it reloads that patient's schedule
+REMINDERS_CHANNEL = "reminders_changed"
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+_wait_ms: deque = deque(maxlen=SAMPLES)  # time spent waiting for a connection
+_held_ms: deque = deque(maxlen=SAMPLES)  # time a connection was checked out
+_queries = 0                             # statements sent through pooled connections
+_queries_lock = threading.Lock()
+
+QUERY_SECONDS = metrics.histogram("db_query_duration_seconds", "Statement execution time on pooled connections")
+
+class CountingCursor(psycopg.Cursor):
+    """Counts and times every statement, so load tests and /metrics can report DB round trips."""
+
+    def execute(self, *args, **kwargs):
+        global _queries
+        with _queries_lock:
+            _queries += 1
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - t0)
+
+def query_count() -> int:
+    return _queries
+
+def configure(min_size: int | None = None, max_size: int | None = None):
+    """Resize the pool, e.g. so the worker has a connection per call slot."""
+    global POOL_MIN_SIZE, POOL_MAX_SIZE
+    POOL_MIN_SIZE = min_size if min_size is not None else POOL_MIN_SIZE
+    POOL_MAX_SIZE = max(max_size if max_size is not None else POOL_MAX_SIZE, POOL_MIN_SIZE)
+    if _pool is not None:
+        _pool.resize(POOL_MIN_SIZE, POOL_MAX_SIZE)
+
+def _check_login():
+    """Fail at startup with the reason, rather than as a pool timeout on the first query."""
+    try:
+        psycopg.connect(**DB).close()
+    except psycopg.OperationalError as e:
+        hint = " (PGPASSWORD is not set)" if not DB["password"] and "password" in str(e) else ""
+        raise RuntimeError(f"cannot connect to Postgres as {DB['user']}@{DB['host']}/{DB['dbname']}{hint}: {e}") from e
+
+def pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _check_login()
+                _pool = ConnectionPool(
+                    kwargs=dict(DB, cursor_factory=CountingCursor),
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    timeout=POOL_TIMEOUT,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    max_idle=POOL_MAX_IDLE,
+                    check=ConnectionPool.check_connection,  # health-check on checkout
+                    name="pharmora",
+                    open=True,
+                )
+    return _pool
+
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection. Commits on a clean exit, rolls back on error,
+    and always goes back to the pool, so `with connection() as c, c.cursor() as cur:`
+    works like the old one-shot psycopg.connect().
+    """
+    t0 = time.perf_counter()
+    with pool().connection() as c:
+        t1 = time.perf_counter()
+        _wait_ms.append((t1 - t0) * 1000)
+        try:
+            yield c
+        finally:
+            _held_ms.append((time.perf_counter() - t1) * 1000)
+
+def connect(**kwargs) -> psycopg.Connection:
+    """A dedicated, unpooled connection for long-lived sessions such as LISTEN."""
+    return psycopg.connect(**DB, **kwargs)
+
+def notify_reminders_changed(cur, uid: int):
+    # delivered when the surrounding transaction commits, never for a rollback
+    cur.execute("SELECT pg_notify(%s, %s)", (REMINDERS_CHANNEL, json.dumps({"user_id": uid})))
+
+def is_local() -> bool:
+    """PGHOST is this machine (a name in LOCAL_HOSTS or a Unix socket directory)."""
+    return DB["host"] in LOCAL_HOSTS or DB["host"].startswith("/")
+
+def stamp() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "Z"
+
+def pct(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def stats() -> dict:
+    """Pool size/usage plus checkout wait and hold times over the last SAMPLES checkouts."""
+    waits, held = list(_wait_ms), list(_held_ms)
+    out = dict(
+        checkout_wait_ms_p50=round(pct(waits, 0.50), 2),
+        checkout_wait_ms_p95=round(pct(waits, 0.95), 2),
+        checkout_wait_ms_max=round(max(waits, default=0.0), 2),
+        held_ms_p50=round(pct(held, 0.50), 2),
+        held_ms_p95=round(pct(held, 0.95), 2),
+        held_ms_max=round(max(held, default=0.0), 2),
+        queries=_queries,
+    )
+    if _pool is not None:
+        out.update(_pool.get_stats())  # pool_size, pool_available, requests_waiting, requests_wait_ms, ...
+    return out
+
+def _pool_gauge() -> dict:
+    if _pool is None:
+        return {}
+    s = _pool.get_stats()
+    return {("open",): s.get("pool_size", 0), ("idle",): s.get("pool_available", 0),
+            ("waiting",): s.get("requests_waiting", 0)}
+
+metrics.gauge("db_pool_connections", "Pool connections (open, idle) and requests waiting for one",
+              ("state",), fn=_pool_gauge)
+
+def close():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
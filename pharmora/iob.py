@@ -0,0 +1,119 @@
+# iob.py
+# Insulin-on-board from insulin_logs, and the cases obvious enough that
+# shot_advisor answers them without asking the LLM:
+#   - take_now: nothing logged for QUIET_HOURS, no long-acting dose in the
+#     last LONG_ACTING_GUARD_HOURS that this one could be a repeat of, and
+#     no bigger than the doses the patient has logged before
+#   - wait:     about the same dose was logged within DUPLICATE_MINUTES
+# Anything else (remarks present, insulin still active, mixed history) is
+# left to the model, which also gets the IOB figure computed here.
+#
+# Activity curves are the exponential model used by Loop/OpenAPS, from each
+# insulin's peak and duration of action; long-acting insulins are treated as
+# flat over their duration.
+import math
+import os
+from datetime import datetime, timezone
+
+# ─── CONFIG ─────────────────────────────────────────────────
+QUIET_HOURS = float(os.environ.get("ADVISOR_QUIET_HOURS", "6"))              # no dose this long: take now
+DUPLICATE_MINUTES = float(os.environ.get("ADVISOR_DUPLICATE_MINUTES", "30"))  # same dose this recently: wait
+LONG_ACTING_GUARD_HOURS = 20  # a basal-sized dose this soon after the last basal is never "obvious"
+SAME_DOSE_TOLERANCE = 0.2     # within 20% of the units counts as "the same dose"
+USUAL_DOSE_FACTOR = 1.2       # take_now only up to this times the largest dose in the history
+WAIT_UNTIL_IOB_FRACTION = 0.5  # suggested wait: until the recent dose is half used up
+MAX_WAIT_MINUTES = 240
+
+# name fragment -> (kind, peak minutes, duration minutes); first match wins
+CURVES = [
+    (("fiasp", "lyumjev", "ultra"), ("rapid", 55, 300)),
+    (("lispro", "humalog", "aspart", "novorapid", "novolog", "glulisine", "apidra", "admelog", "rapid"),
+     ("rapid", 75, 300)),
+    (("regular", "actrapid", "humulin r", "novolin r", "insuman rapid"), ("rapid", 150, 480)),
+    (("nph", "insulatard", "humulin n", "novolin n", "isophane"), ("intermediate", 360, 840)),
+    (("degludec", "tresiba"), ("long", 0, 2520)),
+    (("glargine", "lantus", "basaglar", "toujeo", "semglee", "detemir", "levemir", "long", "basal"),
+     ("long", 0, 1440)),
+]
+DEFAULT_BOLUS = ("rapid", 75, 300)
+DEFAULT_BASAL = ("long", 0, 1440)
+
+def curve_for(insulin_type: str | None, purpose: str | None = None) -> tuple:
+    name = (insulin_type or "").lower()
+    for fragments, curve in CURVES:
+        if any(f in name for f in fragments):
+            return curve
+    return DEFAULT_BASAL if purpose == "basal" else DEFAULT_BOLUS
+
+def remaining_fraction(minutes: float, curve: tuple) -> float:
+    """Share of a dose still active `minutes` after it was taken."""
+    kind, peak, duration = curve
+    if minutes <= 0:
+        return 1.0
+    if minutes >= duration:
+        return 0.0
+    if kind == "long" or peak <= 0 or peak >= duration / 2:
+        return 1.0 - minutes / duration
+    tau = peak * (1 - peak / duration) / (1 - 2 * peak / duration)
+    a = 2 * tau / duration
+    s = 1 / (1 - a + (1 + a) * math.exp(-duration / tau))
+    t = minutes
+    return 1 - s * (1 - a) * ((t * t / (tau * duration * (1 - a)) - t / tau - 1) * math.exp(-t / tau) + 1)
+
+def _when(ts) -> datetime:
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+def doses(history: list[dict], now: datetime) -> list[dict]:
+    """History rows with minutes_ago, curve and active units, newest first."""
+    out = []
+    for h in history:
+        ago = (now - _when(h["timestamp_utc"])).total_seconds() / 60
+        curve = curve_for(h.get("insulin_type"), h.get("purpose"))
+        units = float(h.get("units_taken") or 0)
+        out.append(dict(minutes_ago=ago, curve=curve, units=units,
+                        active=units * remaining_fraction(ago, curve)))
+    return sorted(out, key=lambda d: d["minutes_ago"])
+
+def insulin_on_board(history: list[dict], now: datetime | None = None) -> float:
+    """Units of rapid/intermediate insulin still acting (long-acting basal is left out, as pumps do)."""
+    now = now or datetime.now(timezone.utc)
+    return round(sum(d["active"] for d in doses(history, now) if d["curve"][0] != "long"), 2)
+
+def _same(a: float, b: float) -> bool:
+    return abs(a - b) <= SAME_DOSE_TOLERANCE * max(a, b, 0.5)
+
+def quick_advice(history: list[dict], proposed_units: float, remarks: str = "",
+                 now: datetime | None = None) -> dict | None:
+    """The high-confidence answer for this shot, or None when the model should decide."""
+    now = now or datetime.now(timezone.utc)
+    if (remarks or "").strip() or proposed_units <= 0:
+        return None  # free text can change everything; let the model read it
+    recent = [d for d in doses(history, now) if d["minutes_ago"] >= -5]  # ignore clock-skewed future rows
+
+    for d in recent:
+        if d["minutes_ago"] > DUPLICATE_MINUTES:
+            break
+        if _same(d["units"], proposed_units):
+            left = MAX_WAIT_MINUTES
+            for m in range(int(d["minutes_ago"]), int(d["minutes_ago"]) + MAX_WAIT_MINUTES + 1, 5):
+                if remaining_fraction(m, d["curve"]) <= WAIT_UNTIL_IOB_FRACTION:
+                    left = m - d["minutes_ago"]
+                    break
+            return dict(recommendation="wait", wait_minutes=max(5, int(round(left / 5) * 5)),
+                        reason=f"You logged {d['units']:g} units {d['minutes_ago']:.0f} minutes ago and most of it "
+                               f"is still working. Check that this isn't a repeat before taking more.")
+
+    if recent and recent[0]["minutes_ago"] < QUIET_HOURS * 60:
+        return None
+    if not recent or proposed_units > USUAL_DOSE_FACTOR * max(d["units"] for d in recent):
+        return None  # nothing to compare the size with, or bigger than usual: not obvious
+    for d in recent:
+        if d["minutes_ago"] > LONG_ACTING_GUARD_HOURS * 60:
+            break
+        if d["curve"][0] == "long" and _same(d["units"], proposed_units):
+            return None  # could be a second basal dose; not obvious
+    return dict(recommendation="take_now", wait_minutes=0,
+                reason=f"No insulin logged in the last {recent[0]['minutes_ago'] / 60:.0f} hours; "
+                       f"nothing recent to stack with.")
@@ -0,0 +1,190 @@
+# loadtest_reminders.py
+# Seed a pile of due reminders into a local Postgres, run reminder_worker
+# against them with the in-process FakeTransport, and report:
+#   - claim throughput (reminders leased per second, claim round-trip times)
+#   - end-to-end fire lag percentiles (due time -> call queued and recorded)
+#   - DB statements per fired reminder (counted by db.CountingCursor)
+#
+#   PGDATABASE=pharmora_load python loadtest_reminders.py --reminders 100000 --patients 2000 \
+#       --in-flight 64 --claim-batch 200 --create-ms 40
+#
+# Use a scratch database: the worker fires every due reminder it finds, not
+# just the seeded ones. Seeded patients are named "loadtest-*" and are deleted
+# (with their reminders and call attempts) afterwards unless --keep is given.
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# ─── CONFIG ─────────────────────────────────────────────────
+PROGRESS_SECONDS = 2.0  # how often progress is printed while the worker runs
+
+def say(*args):
+    print(*args, file=sys.__stdout__, flush=True)  # the worker's own chatter may be redirected
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Load-test reminder_worker against seeded reminders.")
+    ap.add_argument("--reminders", type=int, default=100_000, help="reminders to seed")
+    ap.add_argument("--patients", type=int, default=1_000, help="patients to spread them over")
+    ap.add_argument("--spread", type=float, default=0.0,
+                    help="seconds over which due times are spread (0: all due at once)")
+    ap.add_argument("--lead", type=float, default=0.0, help="seconds from now until the first one is due")
+    ap.add_argument("--in-flight", type=int, default=64, help="REMINDER_MAX_IN_FLIGHT for the worker")
+    ap.add_argument("--claim-batch", type=int, default=200, help="REMINDER_CLAIM_BATCH for the worker")
+    ap.add_argument("--create-ms", type=float, default=20.0, help="fake provider: mean create-call latency")
+    ap.add_argument("--create-jitter-ms", type=float, default=10.0, help="fake provider: +/- latency jitter")
+    ap.add_argument("--failure-rate", type=float, default=0.0, help="fake provider: share of creates that fail")
+    ap.add_argument("--provider-cps", type=float, default=0.0,
+                    help="fake provider: answer 429 above this many creates per second (0: no limit)")
+    ap.add_argument("--cps", type=float, default=0.0,
+                    help="worker's own pacing (REMINDER_CALLS_PER_SECOND); 0 leaves it off")
+    ap.add_argument("--callbacks", type=int, default=0, metavar="PORT",
+                    help="run status_receiver on PORT and have the fake post status callbacks to it")
+    ap.add_argument("--timeout", type=float, default=1800, help="give up after this many seconds")
+    ap.add_argument("--keep", action="store_true", help="leave the seeded rows in place")
+    ap.add_argument("--verbose", action="store_true", help="show the worker's per-call log lines")
+    ap.add_argument("--allow-remote", action="store_true", help="allow a non-local PGHOST")
+    return ap.parse_args()
+
+def seed(cur, n_reminders: int, n_patients: int, first_due: datetime, spread: float) -> list[int]:
+    """Insert loadtest patients and one-off reminders, set-based. Returns the patient ids."""
+    cur.execute("""
+        INSERT INTO patients (full_name, time_zone, patient_phone)
+        SELECT 'loadtest-' || g, 'Asia/Kolkata', '+1555' || lpad(g::text, 7, '0')
+        FROM generate_series(1, %s) AS g
+        RETURNING user_id
+    """, (n_patients,))
+    uids = [r[0] for r in cur.fetchall()]
+    cur.execute("""
+        INSERT INTO reminders (user_id, label, repeat_mode, local_date, local_time, next_fire_utc)
+        SELECT (%(uids)s::int[])[1 + g %% %(np)s], 'loadtest ' || g, 'one_off',
+               (t.at AT TIME ZONE 'Asia/Kolkata')::date, (t.at AT TIME ZONE 'Asia/Kolkata')::time, t.at
+        FROM generate_series(0, %(n)s - 1) AS g,
+             LATERAL (SELECT %(first)s::timestamptz + make_interval(secs => %(spread)s * g / %(n)s) AS at) t
+    """, dict(uids=uids, np=n_patients, n=n_reminders, first=first_due, spread=spread))
+    return uids
+
+def progress(cur, uids: list[int]) -> tuple[int, int]:
+    """(reminders still waiting to be fired or claimed, call attempts recorded) for the seeded patients."""
+    cur.execute("""
+        SELECT (SELECT count(*) FROM reminders
+                WHERE user_id = ANY(%(u)s) AND is_active AND (next_fire_utc <= now() OR claimed_by IS NOT NULL)),
+               (SELECT count(*) FROM call_attempts WHERE user_id = ANY(%(u)s))
+    """, dict(u=uids))
+    return cur.fetchone()
+
+def fire_lag(cur, uids: list[int]):
+    cur.execute("""
+        SELECT count(*), COALESCE(sum(covered), 0),
+               percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY lag),
+               max(lag)
+        FROM (SELECT extract(epoch FROM created_at_utc - due_utc) AS lag,
+                     COALESCE(cardinality(reminder_ids), 1) AS covered
+              FROM call_attempts WHERE user_id = ANY(%s) AND due_utc IS NOT NULL) x
+    """, (uids,))
+    return cur.fetchone()
+
+def main():
+    args = parse_args()
+    os.environ["TELEPHONY"] = "fake"
+    os.environ["REMINDER_MAX_IN_FLIGHT"] = str(args.in_flight)
+    os.environ["REMINDER_CLAIM_BATCH"] = str(args.claim_batch)
+    if args.callbacks:
+        os.environ["STATUS_RECEIVER_PORT"] = str(args.callbacks)
+        os.environ["STATUS_CALLBACK_URL"] = f"http://127.0.0.1:{args.callbacks}/twilio/status"
+        os.environ["STATUS_ALLOW_UNSIGNED"] = "1"  # the fake's callbacks are not signed
+
+    # the worker reads its knobs at import time
+    import db
+    import reminder_worker as w
+    from migrations import migrate
+    from telephony import FakeTransport
+    from rate_limit import RateLimitedTransport
+
+    if not (db.is_local() or args.allow_remote):
+        sys.exit(f"refusing to load-test PGHOST={db.DB['host']!r}; use a local scratch database or --allow-remote")
+
+    migrate()
+    fake = FakeTransport(create_ms=args.create_ms, create_jitter_ms=args.create_jitter_ms,
+                         create_failure_rate=args.failure_rate, max_cps=args.provider_cps)
+    paced = None
+    if args.cps > 0:
+        # the seeded patients get many calls each; only the global rate is under test here
+        paced = RateLimitedTransport(fake, calls_per_second=args.cps, per_number_calls=0)
+    w.use_transport(paced or fake)
+
+    # time every claim round trip the worker makes
+    claims: list[tuple[float, float, int]] = []  # (start, seconds, rows)
+    claim_due = w.claim_due
+
+    def timed_claim(limit, ids=None):
+        t0 = time.perf_counter()
+        rows = claim_due(limit, ids)
+        claims.append((t0, time.perf_counter() - t0, len(rows)))
+        return rows
+    w.claim_due = timed_claim
+
+    first_due = datetime.now(timezone.utc) + timedelta(seconds=args.lead)
+    with db.connect() as mc, mc.cursor() as cur:
+        t0 = time.perf_counter()
+        uids = seed(cur, args.reminders, args.patients, first_due, args.spread)
+        mc.commit()
+        seed_s = time.perf_counter() - t0
+        say(f"🌱 seeded {args.reminders} reminders for {len(uids)} patients in {seed_s:.1f}s "
+            f"({args.reminders / seed_s:.0f}/s), due {first_due:%H:%M:%S}Z + {args.spread:.0f}s")
+
+        stop, wake = threading.Event(), threading.Event()
+        q0 = db.query_count()
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        started = time.perf_counter()
+        with quiet:
+            worker = threading.Thread(target=w.main, args=(stop, wake), name="worker", daemon=True)
+            worker.start()
+            try:
+                last_due = first_due + timedelta(seconds=args.spread)
+                while time.perf_counter() - started < args.timeout:
+                    time.sleep(PROGRESS_SECONDS)
+                    pending, attempts = progress(cur, uids)
+                    mc.commit()
+                    say(f"   … {attempts} calls placed, {pending} pending, "
+                        f"{db.query_count() - q0} queries")
+                    if pending == 0 and datetime.now(timezone.utc) > last_due:
+                        break
+                else:
+                    say(f"⚠️ gave up after {args.timeout:.0f}s")
+            finally:
+                elapsed = time.perf_counter() - started
+                stop.set()
+                wake.set()
+                worker.join(timeout=60)
+        queries = db.query_count() - q0
+
+        n, fired, (p50, p95, p99), worst = fire_lag(cur, uids)
+        rows = [c for c in claims if c[2]]
+        claimed = sum(c[2] for c in rows)
+        window = (rows[-1][0] + rows[-1][1] - rows[0][0]) if rows else 0.0
+        claim_ms = [c[1] * 1000 for c in rows]
+        say("")
+        say(f"📈 {n} calls for {fired} reminders placed in {elapsed:.1f}s ({n / elapsed:.0f}/s); "
+            f"fake provider: {fake.created} created, {fake.failed} failed, {fake.rejected} got 429")
+        if paced is not None:
+            say(f"   pacing   : {paced.stats()}")
+        say(f"   claims   : {claimed} reminders in {len(rows)} round trips over {window:.1f}s "
+            f"({claimed / window if window else 0:.0f}/s); "
+            f"p50 {db.pct(claim_ms, .5):.1f}ms p95 {db.pct(claim_ms, .95):.1f}ms, "
+            f"{len(claims) - len(rows)} empty")
+        if n:
+            say(f"   fire lag : p50 {p50:.2f}s  p95 {p95:.2f}s  p99 {p99:.2f}s  max {worst:.2f}s")
+        say(f"   DB       : {queries} statements, {queries / fired if fired else 0:.2f} per reminder fired")
+        say(f"   pool     : {db.stats()}")
+
+        if not args.keep:
+            cur.execute("DELETE FROM patients WHERE user_id = ANY(%s)", (uids,))  # cascades
+            mc.commit()
+            say(f"🧹 removed {len(uids)} loadtest patients")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# metrics.py
+# A tiny Prometheus registry and /metrics endpoint, no client library needed.
+#
+#   REMINDER_METRICS_PORT=9108 python reminder_worker.py
+#   curl -s localhost:9108/metrics
+#
+# Recording is a dict update under a lock; anything that needs the database
+# (e.g. the due backlog) is a callback evaluated only when /metrics is scraped,
+# so the worker's loop pays nothing for it.
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ─── CONFIG ─────────────────────────────────────────────────
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+_metrics: dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt(x: float) -> str:
+    return "+Inf" if x == float("inf") else repr(float(x))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    """Set directly, or give `fn` (returning a number, or {label-tuple: number}) to read it at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[tuple(str(v) for v in label_values)] = value
+
+    def render(self) -> list[str]:
+        if self.fn is not None:
+            try:
+                got = self.fn()
+            except Exception as e:
+                return [f"# {self.name} unavailable: {_escape(e)}"]
+            items = list(got.items()) if isinstance(got, dict) else [((), got)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}"
+                                for k, v in items if v is not None]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values):
+        key = tuple(str(v) for v in label_values)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = [(k, list(s)) for k, s in self._series.items()]
+        out = self.header()
+        for key, s in series:
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-2] + [s[-1]]):
+                running = s[-1] if bound == float("inf") else running + n
+                le = 'le="%s"' % _fmt(bound)
+                out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {running}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, key)} {_fmt(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.label_names, key)} {s[-1]}")
+        return out
+
+def _register(cls, name, *args, **kwargs):
+    """Metrics are process-wide singletons; asking twice for a name returns the first one."""
+    with _registry_lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, *args, **kwargs)
+        return _metrics[name]
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return _register(Counter, name, help, labels)
+
+def gauge(name: str, help: str, labels: tuple = (), fn=None) -> Gauge:
+    g = _register(Gauge, name, help, labels)
+    if fn is not None:
+        g.fn = fn
+    return g
+
+def histogram(name: str, help: str, labels: tuple = (), buckets=LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for m in metrics:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # scraped every few seconds; not worth a log line
+
+def start_in_background(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📊 metrics on {host}:{port}/metrics")
+    return server
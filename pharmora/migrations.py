@@ -0,0 +1,333 @@
+# migrations.py
+# Versioned schema for insulinmate, reminder_worker and status_receiver.
+#
+#   python migrations.py        # apply anything pending and print the version
+#
+# Every process calls migrate() once; after that it is a no-op, so Streamlit
+# reruns no longer replay DDL on every click. Add a new (version, description,
+# statements) entry to MIGRATIONS instead of editing an old one.
+import threading
+from db import REMINDERS_CHANNEL, connection as conn
+
+# ─── CONFIG ─────────────────────────────────────────────────
+LOCK_KEY = 104729  # pg_advisory_xact_lock key (any app-unique constant): one migrator at a time
+
+# ─── SCHEMA ─────────────────────────────────────────────────
+PATIENTS_DDL = """
+CREATE TABLE IF NOT EXISTS patients (
+  user_id                    INTEGER GENERATED ALWAYS AS IDENTITY (START WITH 100000 INCREMENT BY 1) PRIMARY KEY,
+  full_name                  TEXT NOT NULL,
+  age_years                  SMALLINT CHECK (age_years >= 0 AND age_years <= 120),
+  gender                     TEXT CHECK (gender IN ('male','female','nonbinary','other','prefer_not_to_say')),
+  diabetes_type              TEXT CHECK (diabetes_type IN ('T1DM','T2DM','GDM','LADA','MODY','other')),
+  primary_basal_insulin_type TEXT,
+  primary_bolus_insulin_type TEXT,
+  shots_per_day              SMALLINT CHECK (shots_per_day >= 0),
+  tdd_units                  NUMERIC(6,2) CHECK (tdd_units >= 0),
+  target_bg_mgdl             SMALLINT CHECK (target_bg_mgdl BETWEEN 70 AND 200),
+  icr_g_per_unit             NUMERIC(6,2),
+  isf_mgdl_per_unit          NUMERIC(6,2),
+  preferred_units_increment  NUMERIC(3,1),
+  time_zone                  TEXT,
+  scheduled_basal_times      JSONB,
+  patient_phone              TEXT,
+  emergency_contact_name     TEXT,
+  emergency_contact_phone    TEXT,
+  clinician_name             TEXT,
+  clinician_contact          TEXT,
+  created_at_utc             TIMESTAMPTZ DEFAULT now(),
+  updated_at_utc             TIMESTAMPTZ DEFAULT now()
+);
+"""
+
+REMINDERS_DDL = """
+CREATE TABLE IF NOT EXISTS reminders (
+  reminder_id     BIGSERIAL PRIMARY KEY,
+  user_id         INTEGER NOT NULL REFERENCES patients(user_id) ON DELETE CASCADE,
+  label           TEXT NOT NULL,
+  repeat_mode     TEXT NOT NULL CHECK (repeat_mode IN ('everyday','custom','one_off')),
+  days_of_week    JSONB,
+  local_date      DATE,
+  local_time      TIME NOT NULL,
+  next_fire_utc   TIMESTAMPTZ NOT NULL,
+  is_active       BOOLEAN NOT NULL DEFAULT TRUE,
+  last_called_utc TIMESTAMPTZ
+);
+"""
+
+# add a safe create for insulin_logs so ALTER won't fail
+INSULIN_LOGS_DDL = """
+CREATE TABLE IF NOT EXISTS insulin_logs (
+  id               BIGSERIAL PRIMARY KEY,
+  user_id          INTEGER NOT NULL,
+  timestamp_utc    TIMESTAMPTZ NOT NULL,
+  insulin_type     TEXT NOT NULL,
+  prescribed_units NUMERIC(6,2),
+  units_taken      NUMERIC(6,2) NOT NULL,
+  purpose          TEXT NOT NULL CHECK (purpose IN ('basal','bolus','correction')),
+  dose_context     TEXT NOT NULL,
+  current_bg_mgdl  SMALLINT,
+  remarks          TEXT,
+  ai_remark        TEXT,
+  CONSTRAINT chk_units_taken_nonneg      CHECK (units_taken >= 0),
+  CONSTRAINT chk_prescribed_units_nonneg CHECK (prescribed_units IS NULL OR prescribed_units >= 0),
+  CONSTRAINT chk_bg_range                CHECK (current_bg_mgdl IS NULL OR current_bg_mgdl BETWEEN 20 AND 600),
+  CONSTRAINT fk_user
+    FOREIGN KEY (user_id) REFERENCES patients(user_id) ON DELETE CASCADE
+);
+"""
+
+CALL_ATTEMPTS_DDL = """
+CREATE TABLE IF NOT EXISTS call_attempts (
+  call_sid        TEXT PRIMARY KEY,
+  reminder_id     BIGINT,       -- no FK: save_reminders rewrites a patient's reminders wholesale
+  user_id         INTEGER REFERENCES patients(user_id) ON DELETE CASCADE,
+  to_number       TEXT,
+  due_utc         TIMESTAMPTZ,  -- reminders.next_fire_utc at dial time
+  status          TEXT NOT NULL DEFAULT 'queued',
+  error_code      TEXT,
+  created_at_utc  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at_utc  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  ended_at_utc    TIMESTAMPTZ
+);
+"""
+
+# Concrete UTC fire instants of every reminder over a rolling horizon, so the
+# worker finds "next occurrence after X" with an index probe instead of redoing
+# time-zone and day-of-week math. AT TIME ZONE takes care of DST: a local time
+# inside the spring-forward gap lands just after it, like zoneinfo's fold=0.
+FIRE_QUEUE_DDL = """
+CREATE TABLE IF NOT EXISTS fire_queue (
+  reminder_id BIGINT NOT NULL REFERENCES reminders(reminder_id) ON DELETE CASCADE,
+  user_id     INTEGER NOT NULL,
+  fire_utc    TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (reminder_id, fire_utc)
+);
+"""
+
+FIRE_QUEUE_FILL_FN = """
+CREATE OR REPLACE FUNCTION fire_queue_fill(p_reminder_ids BIGINT[], p_user_ids INTEGER[],
+                                           p_from TIMESTAMPTZ, p_until TIMESTAMPTZ)
+RETURNS INTEGER LANGUAGE sql AS $$
+  WITH ins AS (
+    INSERT INTO fire_queue (reminder_id, user_id, fire_utc)
+    SELECT r.reminder_id, r.user_id, f.fire_utc
+    FROM reminders r
+    JOIN patients p ON p.user_id = r.user_id
+    CROSS JOIN LATERAL (SELECT COALESCE(NULLIF(p.time_zone, ''), 'Asia/Kolkata') AS tz) z
+    CROSS JOIN LATERAL (
+      SELECT (r.local_date + r.local_time) AT TIME ZONE z.tz AS fire_utc
+      WHERE r.repeat_mode = 'one_off' AND r.local_date IS NOT NULL
+      UNION ALL
+      SELECT (d::date + r.local_time) AT TIME ZONE z.tz
+      FROM generate_series((p_from AT TIME ZONE z.tz)::date, (p_until AT TIME ZONE z.tz)::date,
+                           interval '1 day') AS d
+      WHERE r.repeat_mode = 'everyday'
+         OR (r.repeat_mode = 'custom'
+             AND (r.days_of_week IS NULL OR jsonb_array_length(r.days_of_week) = 0
+                  OR r.days_of_week ? to_char(d, 'Dy')))
+    ) f
+    WHERE (p_reminder_ids IS NULL OR r.reminder_id = ANY(p_reminder_ids))
+      AND (p_user_ids IS NULL OR r.user_id = ANY(p_user_ids))
+      AND f.fire_utc > p_from AND f.fire_utc <= p_until
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+  )
+  SELECT count(*)::int FROM ins
+$$;
+"""
+
+# Keep the queue in step with schedule edits. The app rewrites reminders with
+# DELETE + INSERT (the FK cascade covers the delete side). A time-zone change
+# re-queues the patient, moves their waiting reminders to the same wall-clock
+# time in the new zone and tells reminder_worker through the usual NOTIFY.
+FIRE_QUEUE_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION fire_queue_on_reminder_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM fire_queue_fill(ARRAY(SELECT reminder_id FROM new_rows), NULL,
+                          now(), now() + TG_ARGV[0]::interval);
+  RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION fire_queue_on_reminder_update() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  DELETE FROM fire_queue WHERE reminder_id = NEW.reminder_id AND fire_utc > now();
+  PERFORM fire_queue_fill(ARRAY[NEW.reminder_id], NULL, now(), now() + TG_ARGV[0]::interval);
+  RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION fire_queue_on_time_zone() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  DELETE FROM fire_queue WHERE user_id = NEW.user_id AND fire_utc > now();
+  PERFORM fire_queue_fill(NULL, ARRAY[NEW.user_id], now(), now() + TG_ARGV[0]::interval);
+  UPDATE reminders r
+  SET next_fire_utc = COALESCE(
+        (SELECT min(q.fire_utc) FROM fire_queue q WHERE q.reminder_id = r.reminder_id AND q.fire_utc > now()),
+        (r.next_fire_utc AT TIME ZONE COALESCE(NULLIF(OLD.time_zone, ''), 'Asia/Kolkata'))
+                         AT TIME ZONE COALESCE(NULLIF(NEW.time_zone, ''), 'Asia/Kolkata'))
+  WHERE r.user_id = NEW.user_id AND r.is_active AND r.claimed_by IS NULL AND r.next_fire_utc > now();
+  PERFORM pg_notify('{REMINDERS_CHANNEL}', json_build_object('user_id', NEW.user_id)::text);
+  RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS fire_queue_reminder_insert ON reminders;
+CREATE TRIGGER fire_queue_reminder_insert AFTER INSERT ON reminders
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fire_queue_on_reminder_insert('24 hours');
+
+DROP TRIGGER IF EXISTS fire_queue_reminder_update ON reminders;
+CREATE TRIGGER fire_queue_reminder_update AFTER UPDATE OF local_time, local_date, days_of_week, repeat_mode ON reminders
+  FOR EACH ROW
+  WHEN (OLD.local_time IS DISTINCT FROM NEW.local_time OR OLD.local_date IS DISTINCT FROM NEW.local_date
+        OR OLD.days_of_week IS DISTINCT FROM NEW.days_of_week OR OLD.repeat_mode IS DISTINCT FROM NEW.repeat_mode)
+  EXECUTE FUNCTION fire_queue_on_reminder_update('24 hours');
+
+DROP TRIGGER IF EXISTS fire_queue_time_zone ON patients;
+CREATE TRIGGER fire_queue_time_zone AFTER UPDATE OF time_zone ON patients
+  FOR EACH ROW
+  WHEN (OLD.time_zone IS DISTINCT FROM NEW.time_zone)
+  EXECUTE FUNCTION fire_queue_on_time_zone('24 hours');
+"""
+
+# One row per SMS/push/webhook message (channels.py). Voice calls stay in
+# call_attempts; a message is "done" once acknowledged, or escalated when the
+# reminder comes due again at its next channel_step.
+REMINDER_NOTIFICATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS reminder_notifications (
+  notification_id BIGSERIAL PRIMARY KEY,
+  ref             TEXT NOT NULL UNIQUE,  -- token in the message; acknowledging it settles the reminders
+  user_id         INTEGER REFERENCES patients(user_id) ON DELETE CASCADE,
+  reminder_ids    BIGINT[] NOT NULL,
+  channel         TEXT NOT NULL,
+  step            SMALLINT NOT NULL,     -- reminders.channel_step it was sent at
+  to_address      TEXT,
+  provider_id     TEXT,
+  error           TEXT,                  -- set if the provider refused it
+  sent_at_utc     TIMESTAMPTZ NOT NULL DEFAULT now(),
+  acked_at_utc    TIMESTAMPTZ
+);
+"""
+
+MIGRATIONS = [
+    (1, "patients, reminders, insulin_logs", [
+        PATIENTS_DDL,
+        REMINDERS_DDL,
+        INSULIN_LOGS_DDL,
+        # keep these for older DBs
+        "ALTER TABLE patients ADD COLUMN IF NOT EXISTS patient_phone TEXT",
+        "ALTER TABLE insulin_logs ADD COLUMN IF NOT EXISTS ai_remark TEXT",
+    ]),
+    (2, "reminder leases", [
+        "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS claimed_by TEXT",          # worker holding the lease
+        "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS lease_expires_utc TIMESTAMPTZ",  # renewed by its heartbeat
+    ]),
+    (3, "call_attempts", [
+        CALL_ATTEMPTS_DDL,
+        "CREATE INDEX IF NOT EXISTS idx_call_attempts_open ON call_attempts (updated_at_utc) WHERE ended_at_utc IS NULL",
+    ]),
+    (4, "hot-path indexes", [
+        # worker: due scan, lookahead load and claim all filter on this
+        "CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders (next_fire_utc) WHERE is_active",
+        # app: fetch_future / save_reminders; worker: per-patient reload after NOTIFY
+        "CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders (user_id)",
+        # shot_advisor context query (exists in backup.sql, missing on fresh DBs)
+        "CREATE INDEX IF NOT EXISTS idx_logs_user_time ON insulin_logs (user_id, timestamp_utc DESC)",
+    ]),
+    (5, "retry attempts and dead letters", [
+        "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS attempt_count SMALLINT NOT NULL DEFAULT 0",
+        """
+        CREATE TABLE IF NOT EXISTS reminder_dead_letters (
+          dead_letter_id BIGSERIAL PRIMARY KEY,
+          reminder_id    BIGINT,
+          user_id        INTEGER REFERENCES patients(user_id) ON DELETE CASCADE,
+          label          TEXT,
+          attempts       SMALLINT NOT NULL,
+          last_status    TEXT,
+          last_error     TEXT,
+          last_call_sid  TEXT,
+          dead_at_utc    TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+    ]),
+    (6, "coalesced calls", [
+        # one call can now cover several reminders; reminder_id stays as the first of them
+        "ALTER TABLE call_attempts ADD COLUMN IF NOT EXISTS reminder_ids BIGINT[]",
+        "UPDATE call_attempts SET reminder_ids = ARRAY[reminder_id] WHERE reminder_ids IS NULL AND reminder_id IS NOT NULL",
+    ]),
+    (7, "fire_queue", [
+        FIRE_QUEUE_DDL,
+        "CREATE INDEX IF NOT EXISTS idx_fire_queue_time ON fire_queue (fire_utc)",
+        FIRE_QUEUE_FILL_FN,
+        FIRE_QUEUE_TRIGGERS,
+        # today's reminders; reminder_worker keeps the horizon rolling from here
+        "SELECT fire_queue_fill(NULL, NULL, now(), now() + interval '24 hours')",
+    ]),
+    (8, "reminder channels and acknowledgements", [
+        # first choice first; NULL = voice only (see channels.py)
+        """
+        ALTER TABLE patients ADD COLUMN IF NOT EXISTS reminder_channels TEXT[]
+          CHECK (reminder_channels <@ ARRAY['sms','push','webhook','voice'])
+        """,
+        # index into reminder_channels of the next attempt; back to 0 once the occurrence is done
+        "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS channel_step SMALLINT NOT NULL DEFAULT 0",
+        REMINDER_NOTIFICATIONS_DDL,
+        "CREATE INDEX IF NOT EXISTS idx_notifications_open ON reminder_notifications (to_address, sent_at_utc) WHERE acked_at_utc IS NULL",
+    ]),
+    (9, "reminders switched off by the patient", [
+        # is_active also goes FALSE between firing and rescheduling; this one only from the app
+        "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS disabled_by_user BOOLEAN NOT NULL DEFAULT FALSE",
+        # until now "switched off" was inferred: inactive and not fired at its current time
+        """
+        UPDATE reminders SET disabled_by_user = TRUE
+        WHERE NOT is_active AND claimed_by IS NULL
+          AND (last_called_utc IS NULL OR last_called_utc < next_fire_utc)
+        """,
+    ]),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+_applied = False
+_lock = threading.Lock()
+
+def current_version(cur) -> int:
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+def migrate() -> int:
+    """Bring the schema up to LATEST. Only the first call per process touches the DB."""
+    global _applied
+    if _applied:
+        return LATEST
+    with _lock:
+        if _applied:
+            return LATEST
+        with conn() as c, c.cursor() as cur:
+            version = current_version(cur)
+            if version < LATEST:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_KEY,))
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                      version        INTEGER PRIMARY KEY,
+                      description    TEXT NOT NULL,
+                      applied_at_utc TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                """)
+                version = current_version(cur)  # another process may have got there first
+                for v, description, statements in MIGRATIONS:
+                    if v <= version:
+                        continue
+                    for stmt in statements:
+                        cur.execute(stmt)
+                    cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                                (v, description))
+                    print(f"🗄 schema migrated to v{v}: {description}")
+            c.commit()
+        _applied = True
+    return LATEST
+
+if __name__ == "__main__":
+    print("schema version", migrate())
@@ -0,0 +1,204 @@
+# rate_limit.py
+# Outbound pacing for the telephony provider. Popular reminder times (08:00,
+# 20:00 IST) make every due call want to go out in the same second; the
+# provider only accepts so many calls per second and answers the rest with
+# 429 / error 20429. RateLimitedTransport wraps any telephony.Transport and
+#   - spaces call creation with a global token bucket (REMINDER_CALLS_PER_SECOND),
+#   - caps calls to any one number (REMINDER_PER_NUMBER_CALLS per REMINDER_PER_NUMBER_WINDOW s),
+#   - paces status fetches on their own bucket (REMINDER_FETCHES_PER_SECOND),
+#   - cuts its rate when the provider pushes back, then creeps back up to
+#     the configured ceiling while calls succeed (AIMD),
+#   - records how long callers queued for a token (stats()).
+import os
+import threading
+import time
+from collections import deque
+
+from telephony import Transport, TelephonyError
+import db
+import metrics
+
+# ─── CONFIG ─────────────────────────────────────────────────
+CALLS_PER_SECOND = float(os.environ.get("REMINDER_CALLS_PER_SECOND", "1"))  # provider CPS; 0 = unlimited
+CALLS_BURST = float(os.environ.get("REMINDER_CALLS_BURST", "1"))            # tokens that may pile up while idle
+FETCHES_PER_SECOND = float(os.environ.get("REMINDER_FETCHES_PER_SECOND", "5"))  # status look-ups; 0 = unlimited
+PER_NUMBER_CALLS = int(os.environ.get("REMINDER_PER_NUMBER_CALLS", "3"))     # calls to one number ...
+PER_NUMBER_WINDOW = float(os.environ.get("REMINDER_PER_NUMBER_WINDOW", "300"))  # ... per this many seconds
+MAX_QUEUE_SECONDS = float(os.environ.get("REMINDER_RATE_MAX_WAIT", "30"))   # longer than this: fail retryable
+THROTTLE_RETRIES = 2         # re-tries of a create that came back 429, after slowing down
+BACKOFF_FACTOR = 0.7         # multiply the rate by this on 429
+RECOVER_FRACTION = 0.05      # add this share of the ceiling back per second without 429s
+MIN_RATE_FRACTION = 0.1      # never drop below this share of the ceiling
+DECREASE_INTERVAL = 1.0      # 429s within this long of the last cut belong to the same burst
+RATE_LIMIT_CODES = {"20429", "429"}  # Twilio "Too Many Requests"
+LOCAL_REFUSAL = "local-rate-limit"  # TelephonyError.code when we turn a call away ourselves (not an attempt)
+
+SAMPLES = 1024  # recent queue waits kept for stats()
+
+QUEUE_WAIT = metrics.histogram("telephony_rate_limit_wait_seconds", "Time spent waiting for a call/fetch token",
+                               buckets=metrics.LAG_BUCKETS)
+THROTTLED = metrics.counter("telephony_throttled_total", "Provider 429 / rate-limit answers")
+
+class TokenBucket:
+    """
+    Reservation-style token bucket: each take() claims the next free slot and
+    says how long to wait for it, so concurrent callers are served in order
+    and never spin. `clock` is injectable for tests.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, clock=time.monotonic):
+        self.ceiling = rate   # configured rate
+        self.rate = rate      # current rate (lowered after 429s)
+        self.burst = max(1.0, burst)
+        self._clock = clock
+        self._tokens = self.burst
+        self._stamp = clock()
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def wait_for(self, now: float) -> float:
+        """Seconds until a token would be available, without taking it."""
+        with self._lock:
+            self._refill(now)
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self, now: float) -> float:
+        """Reserve one token; returns how long the caller must wait before using it."""
+        with self._lock:
+            self._refill(now)
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def throttled(self):
+        """Multiplicative decrease, once per burst of 429s; drops any saved-up burst."""
+        with self._lock:
+            now = self._clock()
+            if now - self._last_cut < DECREASE_INTERVAL:
+                return
+            self._last_cut = now
+            self._refill(now)
+            self.rate = max(self.ceiling * MIN_RATE_FRACTION, self.rate * BACKOFF_FACTOR)
+            self._tokens = min(self._tokens, 0.0)
+
+    def succeeded(self):
+        """Additive increase back towards the ceiling: RECOVER_FRACTION of it per second of successes."""
+        if self.rate < self.ceiling:
+            with self._lock:
+                self._refill(self._clock())
+                self.rate = min(self.ceiling, self.rate + self.ceiling * RECOVER_FRACTION / self.rate)
+
+class NumberCap:
+    """At most `calls` per `window` seconds to any one destination (sliding window)."""
+
+    def __init__(self, calls: int = PER_NUMBER_CALLS, window: float = PER_NUMBER_WINDOW):
+        self.calls = calls
+        self.window = window
+        self._recent: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def wait_for(self, number: str, now: float) -> float:
+        with self._lock:
+            q = self._recent.get(number)
+            while q and now - q[0] >= self.window:
+                q.popleft()
+            if not q:
+                self._recent.pop(number, None)
+                return 0.0
+            return 0.0 if len(q) < self.calls else q[0] + self.window - now
+
+    def record(self, number: str, now: float):
+        with self._lock:
+            self._recent.setdefault(number, deque()).append(now)
+
+class RateLimitedTransport(Transport):
+    """A Transport that paces another one; see the module comment. `clock`/`sleep` are injectable for tests."""
+
+    def __init__(self, inner: Transport, calls_per_second: float = CALLS_PER_SECOND,
+                 burst: float = CALLS_BURST, fetches_per_second: float = FETCHES_PER_SECOND,
+                 per_number_calls: int = PER_NUMBER_CALLS, per_number_window: float = PER_NUMBER_WINDOW,
+                 max_wait: float = MAX_QUEUE_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.inner = inner
+        self.name = inner.name
+        self.calls = TokenBucket(calls_per_second, burst, clock) if calls_per_second > 0 else None
+        self.fetches = TokenBucket(fetches_per_second, clock=clock) if fetches_per_second > 0 else None
+        self.numbers = NumberCap(per_number_calls, per_number_window) if per_number_calls > 0 else None
+        self.max_wait = max_wait
+        self.throttled = 0  # 429s seen from the provider
+        self.refused = 0    # calls turned away because the wait would exceed max_wait
+        self._waits: deque = deque(maxlen=SAMPLES)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _acquire(self, bucket: TokenBucket | None, number: str | None = None):
+        now = self._clock()
+        wait = self.numbers.wait_for(number, now) if number and self.numbers else 0.0
+        if bucket is not None and wait <= self.max_wait:
+            wait = max(wait, bucket.wait_for(now))
+        if wait > self.max_wait:
+            with self._lock:
+                self.refused += 1
+            # hand the reminder back to retry_queue instead of parking a call slot for minutes
+            raise TelephonyError(f"rate limited locally ({wait:.0f}s queue)", status=429,
+                                 code=LOCAL_REFUSAL, retryable=True, retry_after=wait)
+        if bucket is not None:
+            wait = max(wait, bucket.take(now))
+        if wait > 0:
+            self._sleep(wait)
+        self._waits.append(wait * 1000)
+        QUEUE_WAIT.observe(wait)
+
+    @staticmethod
+    def _is_throttle(e: TelephonyError) -> bool:
+        return e.status == 429 or str(e.code) in RATE_LIMIT_CODES
+
+    def create_call(self, to, twiml, status_callback=None, callback_events=None):
+        for attempt in range(THROTTLE_RETRIES + 1):
+            self._acquire(self.calls, to)
+            try:
+                sid = self.inner.create_call(to, twiml, status_callback, callback_events)
+            except TelephonyError as e:
+                if not self._is_throttle(e):
+                    raise
+                with self._lock:
+                    self.throttled += 1
+                THROTTLED.inc()
+                if self.calls is not None:
+                    self.calls.throttled()
+                if attempt == THROTTLE_RETRIES:
+                    raise
+                continue
+            if self.numbers is not None:
+                self.numbers.record(to, self._clock())
+            if self.calls is not None:
+                self.calls.succeeded()
+            return sid
+
+    def fetch_status(self, sid):
+        self._acquire(self.fetches)
+        try:
+            return self.inner.fetch_status(sid)
+        except TelephonyError as e:
+            if self._is_throttle(e) and self.fetches is not None:
+                self.fetches.throttled()
+            raise
+
+    def close(self):
+        self.inner.close()
+
+    def stats(self) -> dict:
+        """Queue waits over the last SAMPLES acquisitions, current rate and pushback counters."""
+        waits = list(self._waits)
+        return dict(
+            queue_wait_ms_p50=round(db.pct(waits, 0.50), 1),
+            queue_wait_ms_p95=round(db.pct(waits, 0.95), 1),
+            queue_wait_ms_max=round(max(waits, default=0.0), 1),
+            calls_per_second=round(self.calls.rate, 3) if self.calls else None,
+            calls_per_second_ceiling=self.calls.ceiling if self.calls else None,
+            throttled=self.throttled,
+            refused=self.refused,
+        )
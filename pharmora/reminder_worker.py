@@ -1,101 +1,106 @@
-# # reminder_worker.py
-# import time
-# import psycopg
-# from datetime import datetime
-# from twilio.rest import Client
-# from twilio.base.exceptions import TwilioRestException
-
-# # ─── CONFIG ─────────────────────────────────────────────────
-# DB = dict(host="localhost", port=5432, dbname="inter",
-#           user="postgres", password="ashu5995", sslmode="disable")
-
-# SID  = "ACf299618a4c2123587d2b494ab1ca1291"
-# TOK  = "0b25f046692caa9ddad057d90427ed97"
-# FROM = "+19377350308"
-
-# POLL_SECONDS = 30
-
-# def conn():
-#     return psycopg.connect(**DB)
-
-# client = Client(SID, TOK)
-
-# def to_e164(num: str) -> str:
-#     return num if num.startswith("+") else "+91" + num
-
-# print("🩺 reminder_worker running — polling every", POLL_SECONDS, "seconds")
-# while True:
-#     try:
-#         # 1) Fetch all due reminders across all users
-#         with conn() as c, c.cursor() as cur:
-#             cur.execute("""
-#                 SELECT r.reminder_id, r.user_id, r.label, p.patient_phone
-#                 FROM reminders r
-#                 JOIN patients  p USING (user_id)
-#                 WHERE r.is_active = TRUE
-#                   AND r.next_fire_utc <= now()
-#             """)
-#             due = cur.fetchall()
-
-#         for rid, uid, label, phone in due:
-#             # 2) Claim it atomically (turn off BEFORE dialing)
-#             claimed = False
-#             with conn() as c, c.cursor() as cur:
-#                 cur.execute("""
-#                     UPDATE reminders
-#                     SET is_active = FALSE, last_called_utc = now()
-#                     WHERE reminder_id = %s
-#                       AND is_active = TRUE
-#                       AND next_fire_utc <= now()
-#                     RETURNING reminder_id
-#                 """, (rid,))
-#                 claimed = cur.fetchone() is not None
-#                 c.commit()
-
-#             if not claimed:
-#                 # Another worker/thread grabbed it
-#                 continue
-
-#             # 3) Dial
-#             try:
-#                 phone_e164 = to_e164(phone)
-#                 twiml = f'<Response><Say voice="alice">Reminder. {label}. Take your insulin.</Say></Response>'
-#                 client.calls.create(to=phone_e164, from_=FROM, twiml=twiml)
-#                 print(f"{datetime.utcnow().isoformat()}Z  ✓ called {phone_e164}  ({label})  reminder_id={rid}")
-#             except TwilioRestException as e:
-#                 # We already deactivated the reminder; just log the error.
-#                 print(f"{datetime.utcnow().isoformat()}Z  ✗ Twilio error {e.code}: {e.msg} (rid={rid})")
-#             except Exception as e:
-#                 print(f"{datetime.utcnow().isoformat()}Z  ✗ Unexpected error: {e} (rid={rid})")
-
-#     except Exception as loop_err:
-#         print("⚠️ worker top-level error:", loop_err)
-
-#     time.sleep(POLL_SECONDS)
-
+# reminder_worker.py
+# Calls (or messages) patients when their insulin reminders fall due. A lookahead
+# heap fed by LISTEN/NOTIFY says when to claim; rows are claimed with SKIP LOCKED
+# and a lease, so several workers can run side by side (see supervisor.py).
+#
+#   python reminder_worker.py
+import os
+import json
 import time
 import re
-import psycopg
-from datetime import datetime, timedelta
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
+import heapq
+import secrets
+import signal
+import socket
+import threading
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import status_receiver
+from status_receiver import handle_status, TERMINAL_STATUSES
+import retry_queue
+from migrations import migrate
+from telephony import Transport, TelephonyError, make_transport
+from rate_limit import LOCAL_REFUSAL, RateLimitedTransport
+from channels import Channel, Message, make_channel, ACK_URL
+import metrics
+import db
+from db import REMINDERS_CHANNEL, connection as conn, notify_reminders_changed, stamp
 
 # ─── CONFIG ─────────────────────────────────────────────────
-DB = dict(host="localhost", port=5432, dbname="inter",
-          user="postgres", password="ashu5995", sslmode="disable")
+POLL_SECONDS = 300           # safety-net claim; NOTIFY + the lookahead heap do the real work
+LOOKAHEAD_MINUTES = int(os.environ.get("REMINDER_LOOKAHEAD_MINUTES", "10"))  # how far ahead the heap is loaded
+STATUS_WAIT_SECONDS = 75     # silence after which we ask Twilio for a call's status ourselves
+RECONCILE_SECONDS = 60       # how often to look for calls whose callbacks never arrived
+RESCHEDULE_SECONDS = 300     # roll recurring reminders forward at least this often (sooner after we fire)
+STATS_SECONDS = 300          # how often DB pool stats are logged
+FIRE_QUEUE_HORIZON_HOURS = int(os.environ.get("FIRE_QUEUE_HORIZON_HOURS", "24"))  # fire_queue look-ahead
+FIRE_QUEUE_EXTEND_SECONDS = 900  # how often the fire_queue horizon is rolled forward
+DEFAULT_TZ = "Asia/Kolkata"  # same fallback insulinmate.fetch_patient uses
+
+STATUS_CALLBACK_URL = os.environ.get("STATUS_CALLBACK_URL", "")     # public URL of status_receiver
+STATUS_RECEIVER_PORT = int(os.environ.get("STATUS_RECEIVER_PORT", "0"))  # >0: run the receiver in-process
+CALLBACK_EVENTS = ["initiated", "ringing", "answered", "completed"]
+MAX_IN_FLIGHT_CALLS = int(os.environ.get("REMINDER_MAX_IN_FLIGHT", "16"))  # calls dialed/tracked at once
+CLAIM_BATCH_SIZE = int(os.environ.get("REMINDER_CLAIM_BATCH", "50"))     # max reminders claimed per round trip
+COALESCE_SECONDS = int(os.environ.get("REMINDER_COALESCE_SECONDS", "120"))  # fold a patient's reminders due this close into one call
+COALESCE_MAX = int(os.environ.get("REMINDER_COALESCE_MAX", "4"))          # most reminders read out in one call
+LEASE_SECONDS = int(os.environ.get("REMINDER_LEASE_SECONDS", "90"))       # claim lifetime unless renewed
+HEARTBEAT_SECONDS = int(os.environ.get("REMINDER_HEARTBEAT_SECONDS", "20"))  # how often leases are renewed
+SWEEP_SECONDS = 30           # how often expired leases are put back in the queue
+ERROR_BACKOFF_SECONDS = 5    # pause after a failed loop iteration (e.g. DB unreachable)
+LISTEN_TIMEOUT_SECONDS = 5   # how often the listener checks whether it should stop
+METRICS_PORT = int(os.environ.get("REMINDER_METRICS_PORT", "0"))  # >0: serve /metrics on this port
+ACK_SECONDS = int(os.environ.get("REMINDER_ACK_SECONDS", "300"))  # unacknowledged message: escalate after this
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# ─── METRICS ────────────────────────────────────────────────
+FIRE_LAG = metrics.histogram("reminder_fire_lag_seconds", "Dial time minus next_fire_utc, per reminder",
+                             buckets=metrics.LAG_BUCKETS)
+CLAIM_SECONDS = metrics.histogram("reminder_claim_duration_seconds", "claim_due round trip")
+DIAL_SECONDS = metrics.histogram("reminder_dial_duration_seconds", "Time to get a call queued, rate-limit wait included")
+CALL_OUTCOMES = status_receiver.CALL_OUTCOMES
+MESSAGES = metrics.counter("reminder_messages_total", "SMS/push/webhook messages by channel and result",
+                           ("channel", "result"))
 
-SID  = "AC167fcc1960fe1f6b9119c02388f4c7e1"
-TOK  = "203ee862ddc358209bd4c8c1d0ebf44e"
-FROM = "+17178768103"  # Must be a Twilio voice-enabled number or verified caller ID
+_transport: Transport | None = None
 
-POLL_SECONDS = 30            # how often to poll DB for due reminders
-STATUS_WAIT_SECONDS = 75     # how long to wait for call to reach a terminal status
-STATUS_POLL_INTERVAL = 3     # how often to poll Twilio for status
+def transport() -> Transport:
+    """The process-wide telephony transport (see telephony.py), paced by rate_limit, built on first use."""
+    global _transport
+    if _transport is None:
+        _transport = RateLimitedTransport(make_transport(pool_size=MAX_IN_FLIGHT_CALLS))
+    return _transport
 
-def conn():
-    return psycopg.connect(**DB)
+def use_transport(t: Transport):
+    """Swap in another transport, e.g. a FakeTransport for load tests. It is used as given (no pacing)."""
+    global _transport
+    _transport = t
 
-client = Client(SID, TOK)
+_channels: dict[str, Channel] = {}
+_channels_lock = threading.Lock()
+
+def channel(name: str) -> Channel:
+    """The process-wide message channel `name` (see channels.py), built on first use."""
+    with _channels_lock:
+        if name not in _channels:
+            _channels[name] = make_channel(name)
+        return _channels[name]
+
+def use_channel(name: str, ch: Channel):
+    """Swap in another channel, e.g. a FakeChannel for load tests."""
+    with _channels_lock:
+        _channels[name] = ch
+
+def channel_batch_size(name: str) -> int:
+    try:
+        return channel(name).max_batch
+    except Exception:
+        return CLAIM_BATCH_SIZE  # send_messages reports the misconfiguration once per batch
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 def to_e164(num: str) -> str:
     """Normalize to E.164; assume India (+91) if 10 digits; pass-through if already +..."""
@@ -113,94 +118,874 @@ def to_e164(num: str) -> str:
         return "+" + s
     raise ValueError(f"Unrecognized phone format: {num}")
 
-def place_call_and_wait(phone_e164: str, label: str):
-    """
-    Queue a call, then poll Twilio for real status.
-    Returns (final_status, error_code_or_None, sid)
-    """
-    twiml = f'<Response><Say voice="alice">Reminder. {label}. Take your insulin.</Say></Response>'
-    call = client.calls.create(to=phone_e164, from_=FROM, twiml=twiml)
-    print(f"{datetime.utcnow().isoformat()}Z  ↪ queued Call SID={call.sid} to {phone_e164} ({label})")
-
-    deadline = time.time() + STATUS_WAIT_SECONDS
-    last_status = None
-    error_code = None
-    while time.time() < deadline:
-        cur = client.calls(call.sid).fetch()
-        if cur.status != last_status:
-            print(f"   • status: {cur.status}"
-                  + (f"  err={cur.error_code}" if getattr(cur, 'error_code', None) else ""))
-            last_status = cur.status
-        if cur.status in ("completed", "failed", "busy", "no-answer", "canceled"):
-            error_code = getattr(cur, "error_code", None)
-            return cur.status, error_code, call.sid
-        time.sleep(STATUS_POLL_INTERVAL)
-
-    # Timed out waiting — return whatever we last saw
-    cur = client.calls(call.sid).fetch()
-    error_code = getattr(cur, "error_code", None)
-    return cur.status, error_code, call.sid
-
-print("🩺 reminder_worker running — polling every", POLL_SECONDS, "seconds")
-while True:
-    try:
-        # 1) Fetch all due reminders across all users
-        with conn() as c, c.cursor() as cur:
-            cur.execute("""
-                SELECT r.reminder_id, r.user_id, r.label, p.patient_phone
+def build_twiml(labels: list[str]) -> str:
+    said = ". ".join(escape(label) for label in labels)
+    return f'<Response><Say voice="alice">Reminder. {said}. Take your insulin.</Say></Response>'
+
+def build_message(labels: list[str], ref: str) -> str:
+    text = f"Reminder: {', '.join(labels)}. Take your insulin. Reply OK when done."
+    return text + (f" Or confirm here: {ACK_URL}?ref={ref}" if ACK_URL else "")
+
+def place_call(phone_e164: str, labels: list[str], due_utc: datetime | None = None) -> str:
+    """
+    Queue one call reading out every label and return its SID without waiting
+    for it to be answered. Status arrives later on STATUS_CALLBACK_URL (see status_receiver.py).
+    """
+    twiml = build_twiml(labels)
+    t0 = time.perf_counter()
+    sid = transport().create_call(phone_e164, twiml, STATUS_CALLBACK_URL or None, CALLBACK_EVENTS)
+    create_ms = (time.perf_counter() - t0) * 1000
+    DIAL_SECONDS.observe(create_ms / 1000)
+    lag = f"  lag={(utcnow() - due_utc).total_seconds():.1f}s" if due_utc else ""
+    print(f"{stamp()}  ↪ queued Call SID={sid} to {phone_e164} ({' + '.join(labels)})"
+          f"  create={create_ms:.0f}ms{lag}")
+    return sid
+
+# ─── DB ─────────────────────────────────────────────────────
+def claim_due(limit: int, ids: list[int] | None = None):
+    """
+    Lease up to `limit` due reminders to this worker in one round trip.
+    SKIP LOCKED lets several workers split the backlog without waiting on each other.
+    The lease lapses after LEASE_SECONDS unless the heartbeat renews it.
+    `ids` narrows the claim to reminders the lookahead heap says are due.
+    The same patient's other reminders due within COALESCE_SECONDS of the
+    first are leased along with them (up to COALESCE_MAX per patient), so
+    coalesce() can read them out in the same call.
+    `channel` is the patient's reminder_channels entry for the reminder's
+    channel_step: the first choice, or the next one after an unacknowledged message.
+    Returns [(reminder_id, user_id, label, patient_phone, next_fire_utc, channel, channel_step), ...]
+    oldest first.
+    """
+    if limit <= 0:
+        return []
+    only_ids = "AND reminder_id = ANY(%(ids)s)" if ids is not None else ""
+    t0 = time.perf_counter()
+    with conn() as c, c.cursor() as cur:
+        cur.execute(f"""
+            WITH due AS (
+                SELECT reminder_id, user_id, next_fire_utc
+                FROM reminders
+                WHERE is_active = TRUE
+                  AND claimed_by IS NULL
+                  AND next_fire_utc <= now()
+                  {only_ids}
+                ORDER BY next_fire_utc
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ), patients_due AS (
+                SELECT user_id, min(next_fire_utc) AS first_due, count(*) AS n
+                FROM due
+                GROUP BY user_id
+            ), nearby AS (
+                SELECT r.reminder_id, r.user_id, r.next_fire_utc
                 FROM reminders r
-                JOIN patients  p USING (user_id)
+                JOIN patients_due pd ON pd.user_id = r.user_id
                 WHERE r.is_active = TRUE
-                  AND r.next_fire_utc <= now()
-            """)
-            due = cur.fetchall()
-
-        for rid, uid, label, phone in due:
-            # 2) Claim it atomically (turn off BEFORE dialing)
-            with conn() as c, c.cursor() as cur:
-                cur.execute("""
-                    UPDATE reminders
-                    SET is_active = FALSE, last_called_utc = now()
-                    WHERE reminder_id = %s
-                      AND is_active = TRUE
-                      AND next_fire_utc <= now()
-                    RETURNING reminder_id
-                """, (rid,))
-                claimed = cur.fetchone() is not None
-                c.commit()
-
-            if not claimed:
-                continue  # another worker grabbed it
-
-            # 3) Dial + poll status
-            try:
-                phone_e164 = to_e164(phone)
-                final_status, err_code, sid = place_call_and_wait(phone_e164, label)
-                print(f"{datetime.utcnow().isoformat()}Z  ⇢ final status for {sid}: {final_status}"
-                      + (f" (error_code={err_code})" if err_code else ""))
-
-                # Optional retry logic if it failed/no-answer/busy — uncomment if you want retries:
-                # if final_status in ("failed", "no-answer", "busy", "canceled"):
-                #     with conn() as c, c.cursor() as cur:
-                #         cur.execute("""
-                #             UPDATE reminders
-                #             SET is_active = TRUE, next_fire_utc = now() + interval '5 minutes'
-                #             WHERE reminder_id = %s
-                #         """, (rid,))
-                #         c.commit()
-
-            except ValueError as ve:
-                print(f"{datetime.utcnow().isoformat()}Z  ✗ Phone formatting error for rid={rid}: {ve}")
-            except TwilioRestException as e:
-                print(f"{datetime.utcnow().isoformat()}Z  ✗ Twilio REST error for rid={rid}: {e.code} {e.msg}")
-            except Exception as e:
-                print(f"{datetime.utcnow().isoformat()}Z  ✗ Unexpected error for rid={rid}: {e}")
-
-    except Exception as loop_err:
-        print("⚠️ worker top-level error:", loop_err)
+                  AND r.claimed_by IS NULL
+                  AND r.next_fire_utc <= pd.first_due + make_interval(secs => %(window)s)
+                  AND r.reminder_id NOT IN (SELECT reminder_id FROM due)
+                FOR UPDATE OF r SKIP LOCKED
+            ), picked AS (
+                SELECT reminder_id FROM due
+                UNION ALL
+                SELECT reminder_id
+                FROM (
+                    SELECT nb.reminder_id, pd.n,
+                           row_number() OVER (PARTITION BY nb.user_id ORDER BY nb.next_fire_utc) AS rank
+                    FROM nearby nb
+                    JOIN patients_due pd ON pd.user_id = nb.user_id
+                ) ranked
+                WHERE rank <= %(most)s - n
+            )
+            UPDATE reminders r
+            SET claimed_by = %(worker)s,
+                lease_expires_utc = now() + make_interval(secs => %(lease)s)
+            FROM picked, patients p
+            WHERE r.reminder_id = picked.reminder_id
+              AND p.user_id = r.user_id
+            RETURNING r.reminder_id, r.user_id, r.label, p.patient_phone, r.next_fire_utc,
+                      COALESCE(p.reminder_channels[r.channel_step + 1], 'voice'), r.channel_step
+        """, dict(limit=limit, ids=ids, worker=WORKER_ID, lease=LEASE_SECONDS,
+                  window=COALESCE_SECONDS, most=COALESCE_MAX))
+        rows = cur.fetchall()
+        c.commit()
+    CLAIM_SECONDS.observe(time.perf_counter() - t0)
+    return sorted(rows, key=lambda r: r[4])
+
+def due_backlog() -> int:
+    """Due reminders nobody has claimed yet, across all workers (read at scrape time only)."""
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            SELECT count(*)
+            FROM reminders
+            WHERE is_active = TRUE
+              AND claimed_by IS NULL
+              AND next_fire_utc <= now()
+        """)
+        return cur.fetchone()[0]
+
+def coalesce(rows: list) -> list[list]:
+    """
+    Group claimed rows by patient, phone and channel into calls (or messages)
+    of at most COALESCE_MAX reminders each, earliest-due first.
+    """
+    groups: dict[tuple, list] = {}
+    for row in rows:  # already oldest first
+        groups.setdefault((row[1], row[3], row[5]), []).append(row)
+    calls = []
+    for group in groups.values():
+        calls += [group[i:i + COALESCE_MAX] for i in range(0, len(group), COALESCE_MAX)]
+    return sorted(calls, key=lambda g: g[0][4])
+
+def load_upcoming(since: datetime | None, until: datetime, user_ids: list[int] | None = None):
+    """
+    Unclaimed reminders firing in (since, until]; since=None also returns overdue ones.
+    `user_ids` restricts the load to patients whose reminders just changed.
+    """
+    after = "AND next_fire_utc > %(since)s" if since is not None else ""
+    only_users = "AND user_id = ANY(%(uids)s)" if user_ids is not None else ""
+    with conn() as c, c.cursor() as cur:
+        cur.execute(f"""
+            SELECT reminder_id, user_id, next_fire_utc
+            FROM reminders
+            WHERE is_active = TRUE
+              AND claimed_by IS NULL
+              AND next_fire_utc <= %(until)s
+              {after}
+              {only_users}
+        """, dict(since=since, until=until, uids=user_ids))
+        return cur.fetchall()
+
+def record_attempt(sid: str, rids: list[int], uid: int, phone_e164: str, due_utc: datetime):
+    """
+    Tie a queued call to its reminders. A status callback may already have
+    created the row — even a terminal one — in which case we settle it here.
+    """
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            INSERT INTO call_attempts (call_sid, reminder_id, reminder_ids, user_id, to_number, due_utc)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (call_sid) DO UPDATE
+            SET reminder_id  = EXCLUDED.reminder_id,
+                reminder_ids = EXCLUDED.reminder_ids,
+                user_id      = EXCLUDED.user_id,
+                to_number    = EXCLUDED.to_number,
+                due_utc      = EXCLUDED.due_utc
+            RETURNING status, error_code
+        """, (sid, rids[0], rids, uid, phone_e164, due_utc))
+        status, err = cur.fetchone()
+        c.commit()
+    return status, err
+
+def stale_attempts(limit: int = 50) -> list[str]:
+    """Calls with no status news for STATUS_WAIT_SECONDS — probably a lost callback."""
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            SELECT call_sid
+            FROM call_attempts
+            WHERE ended_at_utc IS NULL
+              AND updated_at_utc < now() - make_interval(secs => %s)
+            ORDER BY updated_at_utc
+            LIMIT %s
+        """, (STATUS_WAIT_SECONDS, limit))
+        return [r[0] for r in cur.fetchall()]
+
+def touch_attempt(sid: str):
+    with conn() as c, c.cursor() as cur:
+        cur.execute("UPDATE call_attempts SET updated_at_utc = now() WHERE call_sid = %s", (sid,))
+        c.commit()
+
+def complete(rids: list[int], delivered: bool = False):
+    """
+    The call is queued (or could not be): retire the reminders and drop our leases.
+    One read out ahead of time in a coalesced call counts as called at its due
+    time, so reschedule_fired moves past that occurrence rather than repeating it.
+    delivered=True (a message accepted on the last channel) also clears
+    attempt_count; a queued call still waits for its "completed" status.
+    A reminder the patient switched off meanwhile only loses the lease: it is
+    not stamped as called, so reschedule_fired leaves it off.
+    """
+    if not rids:
+        return
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            UPDATE reminders
+            SET is_active = FALSE,
+                last_called_utc = CASE WHEN disabled_by_user THEN last_called_utc
+                                       ELSE GREATEST(now(), next_fire_utc) END,
+                claimed_by = NULL, lease_expires_utc = NULL, channel_step = 0,
+                attempt_count = CASE WHEN %s THEN 0 ELSE attempt_count END
+            WHERE reminder_id = ANY(%s)
+              AND claimed_by = %s
+        """, (delivered, rids, WORKER_ID))
+        if cur.rowcount < len(rids):
+            print(f"{stamp()}  ⚠ lease on {len(rids) - cur.rowcount} of rids={rids} was lost before completion")
+        c.commit()
+
+def escalate(rids: list[int], delay_seconds: float) -> list[int]:
+    """
+    A message went out (or could not): re-arm each reminder that has a later
+    channel in its patient's list to fire again on that channel after
+    `delay_seconds`, unless acknowledged first. Returns the rids with no channel
+    left; the caller completes or retries those.
+    """
+    if not rids:
+        return []
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            UPDATE reminders r
+            SET channel_step = r.channel_step + 1,
+                next_fire_utc = now() + make_interval(secs => %s),
+                claimed_by = NULL, lease_expires_utc = NULL
+            FROM patients p
+            WHERE p.user_id = r.user_id
+              AND r.reminder_id = ANY(%s)
+              AND r.claimed_by = %s
+              AND cardinality(p.reminder_channels) > r.channel_step + 1
+            RETURNING r.reminder_id, r.user_id
+        """, (delay_seconds, rids, WORKER_ID))
+        rows = cur.fetchall()
+        for uid in {uid for _, uid in rows}:
+            # the re-armed time goes through the lookahead like any edit
+            notify_reminders_changed(cur, uid)
+        c.commit()
+    escalated = {rid for rid, _ in rows}
+    return [rid for rid in rids if rid not in escalated]
+
+def record_notifications(rows: list[tuple]):
+    """
+    Log a batch of sent messages: (ref, user_id, reminder_ids, channel, step,
+    to, provider_id, error) each. psycopg pipelines executemany, so this is one round trip.
+    """
+    if not rows:
+        return
+    with conn() as c, c.cursor() as cur:
+        cur.executemany("""
+            INSERT INTO reminder_notifications
+              (ref, user_id, reminder_ids, channel, step, to_address, provider_id, error)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+        c.commit()
+
+def reschedule_fired():
+    """
+    Roll every fired everyday/custom reminder forward to its next local
+    occurrence in one set-based statement. The next occurrence comes from
+    fire_queue (an index probe); only reminders with nothing queued inside its
+    horizon — e.g. a custom reminder for a single weekday — fall back to the
+    SQL twin of insulinmate.next_occurrence_utc. "Fired" means complete()
+    stamped last_called_utc at or past next_fire_utc; rows switched off from
+    the app (disabled_by_user) are never fired, whatever their times. Notifies for every patient
+    rolled forward, so the other workers' lookaheads see the new times too.
+    Returns [(reminder_id, user_id, next_fire_utc), ...].
+    """
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            WITH fired AS (
+                SELECT reminder_id, last_called_utc
+                FROM reminders
+                WHERE repeat_mode IN ('everyday', 'custom')
+                  AND is_active = FALSE
+                  AND NOT disabled_by_user
+                  AND claimed_by IS NULL
+                  AND last_called_utc >= next_fire_utc
+                FOR UPDATE SKIP LOCKED
+            ), queued AS (
+                SELECT f.reminder_id, q.fire_utc
+                FROM fired f
+                CROSS JOIN LATERAL (
+                    SELECT min(fire_utc) AS fire_utc
+                    FROM fire_queue
+                    WHERE reminder_id = f.reminder_id
+                      AND fire_utc > GREATEST(now(), f.last_called_utc)
+                ) q
+            ), computed AS (
+                SELECT r.reminder_id,
+                       MIN((day.d + r.local_time) AT TIME ZONE z.tz) AS fire_utc
+                FROM queued qd
+                JOIN reminders r ON r.reminder_id = qd.reminder_id
+                JOIN patients  p ON p.user_id = r.user_id
+                CROSS JOIN LATERAL (SELECT COALESCE(NULLIF(p.time_zone, ''), %s) AS tz) z
+                CROSS JOIN LATERAL (
+                    SELECT (GREATEST(now(), r.last_called_utc) AT TIME ZONE z.tz)::date + i AS d
+                    FROM generate_series(0, 7) AS i
+                ) day
+                WHERE (day.d + r.local_time) AT TIME ZONE z.tz > GREATEST(now(), r.last_called_utc)
+                  AND (r.repeat_mode = 'everyday'
+                       OR r.days_of_week IS NULL
+                       OR jsonb_array_length(r.days_of_week) = 0
+                       OR r.days_of_week ? to_char(day.d, 'Dy'))
+                  AND qd.fire_utc IS NULL
+                GROUP BY r.reminder_id
+            ), nxt AS (
+                SELECT reminder_id, fire_utc FROM queued WHERE fire_utc IS NOT NULL
+                UNION ALL
+                SELECT reminder_id, fire_utc FROM computed
+            )
+            UPDATE reminders r
+            SET next_fire_utc = nxt.fire_utc, is_active = TRUE
+            FROM nxt
+            WHERE r.reminder_id = nxt.reminder_id
+            RETURNING r.reminder_id, r.user_id, r.next_fire_utc
+        """, (DEFAULT_TZ,))
+        rows = cur.fetchall()
+        for uid in {uid for _, uid, _ in rows}:
+            notify_reminders_changed(cur, uid)
+        c.commit()
+    return rows
+
+def release(rids: list[int] | None = None) -> int:
+    """
+    Hand leases back without firing: the given reminders, or (None) every
+    lease this worker still holds. Used when a claimed call could not get a
+    slot and when draining on shutdown, so nothing waits out LEASE_SECONDS.
+    Notifies, so every worker's lookahead (ours included) picks them up again.
+    """
+    only = "AND reminder_id = ANY(%(rids)s)" if rids is not None else ""
+    with conn() as c, c.cursor() as cur:
+        cur.execute(f"""
+            UPDATE reminders
+            SET claimed_by = NULL, lease_expires_utc = NULL
+            WHERE claimed_by = %(worker)s
+              {only}
+            RETURNING user_id
+        """, dict(worker=WORKER_ID, rids=rids))
+        uids = [r[0] for r in cur.fetchall()]
+        for uid in set(uids):
+            notify_reminders_changed(cur, uid)
+        released = len(uids)
+        c.commit()
+    return released
+
+def extend_fire_queue() -> tuple[int, int]:
+    """
+    Keep fire_queue FIRE_QUEUE_HORIZON_HOURS ahead and drop instants that have
+    long passed. Safe to run from several workers at once.
+    Returns (instants added, instants dropped).
+    """
+    with conn() as c, c.cursor() as cur:
+        cur.execute("SELECT fire_queue_fill(NULL, NULL, now(), now() + make_interval(hours => %s))",
+                    (FIRE_QUEUE_HORIZON_HOURS,))
+        added = cur.fetchone()[0]
+        cur.execute("DELETE FROM fire_queue WHERE fire_utc < now() - make_interval(hours => %s)",
+                    (FIRE_QUEUE_HORIZON_HOURS,))
+        dropped = cur.rowcount
+        c.commit()
+    return added, dropped
+
+def renew_leases(rids: list[int]) -> int:
+    """Heartbeat: push lease expiry out for every reminder we are still working on."""
+    if not rids:
+        return 0
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            UPDATE reminders
+            SET lease_expires_utc = now() + make_interval(secs => %s)
+            WHERE claimed_by = %s
+              AND reminder_id = ANY(%s)
+        """, (LEASE_SECONDS, WORKER_ID, rids))
+        renewed = cur.rowcount
+        c.commit()
+    return renewed
+
+def requeue_expired_leases():
+    """Put back reminders whose worker stopped heartbeating (crashed, killed, partitioned)."""
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            WITH expired AS (
+                SELECT reminder_id, user_id, claimed_by
+                FROM reminders
+                WHERE claimed_by IS NOT NULL
+                  AND lease_expires_utc < now()
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE reminders r
+            SET claimed_by = NULL, lease_expires_utc = NULL
+            FROM expired e
+            WHERE r.reminder_id = e.reminder_id
+            RETURNING r.reminder_id, r.user_id, e.claimed_by
+        """)
+        rows = cur.fetchall()
+        c.commit()
+    return rows
+
+# ─── DISPATCH ───────────────────────────────────────────────
+def fire_call(group: list):
+    """
+    Dial one call for a group of already-claimed reminders of one patient (see
+    coalesce()). Runs on a dispatcher thread; returns once the call is queued.
+    """
+    rids = [row[0] for row in group]
+    uid, phone, due_utc = group[0][1], group[0][3], group[0][4]
+    failure = None  # (status, error, retryable, provider error code) if the call never got queued
+    try:
+        phone_e164 = to_e164(phone)
+        sid = place_call(phone_e164, [row[2] for row in group], due_utc)
+        dialed = utcnow()
+        for row in group:
+            FIRE_LAG.observe(max(0.0, (dialed - row[4]).total_seconds()))  # early companions count as on time
+        status, err = record_attempt(sid, rids, uid, phone_e164, due_utc)
+        if status in TERMINAL_STATUSES:
+            # the callback beat us here and could not settle it without the reminder ids
+            complete(rids)
+            for rid in rids:
+                retry_queue.on_call_finished(rid, status, err, sid)
+            return
+
+    except ValueError as ve:
+        print(f"{stamp()}  ✗ Phone formatting error for rids={rids}: {ve}")
+        failure = ("bad-phone", str(ve), False, "")  # retrying will not fix the number
+    except TelephonyError as e:
+        if e.code == LOCAL_REFUSAL:
+            # our own pacing held it back: nothing was attempted, so nothing is counted
+            delay = e.retry_after or retry_queue.BACKOFF_BASE_SECONDS
+            for rid in rids:
+                print(f"{stamp()}  ⏸ rid={rid} held back {delay:.0f}s by local rate limit → "
+                      f"{retry_queue.defer(rid, delay)}")
+            return
+        print(f"{stamp()}  ✗ {transport().name} error for rids={rids}: {e.code} {e.msg}")
+        failure = ("create-error", str(e.code), e.retryable, str(e.code or ""))
+    except Exception as e:
+        print(f"{stamp()}  ✗ Unexpected error for rids={rids}: {e}")
+        failure = ("create-error", str(e), True, "")  # network trouble and the like
+
+    if failure is None:
+        complete(rids)
+        return
+    status, err, retryable, code = failure
+    CALL_OUTCOMES.inc(status, code)
+    for rid in rids:
+        outcome = retry_queue.schedule_retry(rid, status, err, retryable=retryable)
+        if outcome != "retry":
+            complete([rid])  # dead-lettered: retire it like a fired reminder
+        print(f"{stamp()}  ↻ rid={rid} {status} → {outcome}")
+
+def send_messages(name: str, groups: list[list]):
+    """
+    Send one message per group (see coalesce()) on channel `name`, as a single
+    provider batch. Sent reminders wait ACK_SECONDS for an acknowledgement
+    before their next channel; failed ones move on straight away. Reminders
+    with no channel left are completed, or retried if their message failed.
+    """
+    ch_error = None
+    try:
+        ch = channel(name)
+    except Exception as e:  # e.g. no URL configured for this channel
+        ch, ch_error = None, TelephonyError(str(e), code="unconfigured", retryable=False)
+    messages, failures = [], {}  # failures: ref -> TelephonyError or ValueError
+    for group in groups:
+        ref = secrets.token_urlsafe(12)
+        try:
+            to = to_e164(group[0][3]) if name == "sms" else str(group[0][1])
+        except ValueError as ve:
+            to, failures[ref] = group[0][3], ve
+        messages.append(Message(ref, group[0][1], to, build_message([row[2] for row in group], ref)))
+
+    to_send = [m for m in messages if m.ref not in failures]
+    results = dict.fromkeys((m.ref for m in to_send), ch_error)
+    if ch is not None and to_send:
+        t0 = time.perf_counter()
+        try:
+            results = dict(zip((m.ref for m in to_send), ch.send(to_send)))
+        except Exception as e:
+            err = TelephonyError(str(e), code="send-error")
+            results = dict.fromkeys((m.ref for m in to_send), err)
+        DIAL_SECONDS.observe(time.perf_counter() - t0)
+    failures.update((ref, r) for ref, r in results.items() if isinstance(r, Exception))
+
+    sent_at = utcnow()
+    logged, sent, failed = [], [], []
+    for group, m in zip(groups, messages):
+        rids = [row[0] for row in group]
+        err = failures.get(m.ref)
+        logged.append((m.ref, m.user_id, rids, name, group[0][6], m.to,
+                       None if err else results[m.ref], str(err) if err else None))
+        MESSAGES.inc(name, "failed" if err else "sent")
+        if err is None:
+            sent += rids
+            for row in group:
+                FIRE_LAG.observe(max(0.0, (sent_at - row[4]).total_seconds()))
+        else:
+            failed.append((rids, err))
+            print(f"{stamp()}  ✗ {name} to {m.to} failed for rids={rids}: {err}")
+    record_notifications(logged)
+    print(f"{stamp()}  ✉ {name}: {len(sent)} reminder(s) in {len(messages) - len(failed)} message(s)"
+          + (f", {len(failed)} failed" if failed else ""))
+
+    complete(escalate(sent, ACK_SECONDS), delivered=True)  # last channel on the list: the message is the reminder
+    for rids, err in failed:
+        for rid in escalate(rids, 0):
+            retryable = isinstance(err, TelephonyError) and err.retryable
+            outcome = retry_queue.schedule_retry(rid, f"{name}-error", str(err), retryable=retryable)
+            if outcome != "retry":
+                complete([rid])
+            print(f"{stamp()}  ↻ rid={rid} {name}-error → {outcome}")
+
+def reconcile_stale_calls() -> int:
+    """Ask the provider directly about calls whose callbacks never showed up."""
+    n = 0
+    for sid in stale_attempts():
+        try:
+            status, err = transport().fetch_status(sid)
+            if handle_status(sid, status, err):
+                print(f"{stamp()}  ⇢ reconciled {sid}: {status}")
+            if status not in TERMINAL_STATUSES:
+                touch_attempt(sid)  # still ringing/talking; look again after another wait
+            n += 1
+        except TelephonyError as e:
+            print(f"{stamp()}  ✗ {transport().name} error reconciling {sid}: {e.code} {e.msg}")
+    return n
+
+class Dispatcher:
+    """
+    Bounded pool of call slots. Each slot dials one call for a group of claimed
+    reminders, or sends one batch of messages; the call's progress is tracked
+    by status_receiver, so a slot is held only while queuing.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_CALLS, wake: threading.Event | None = None):
+        self.max_in_flight = max_in_flight
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="dial")
+        self._lock = threading.Lock()
+        self._in_flight: dict[int, list[int]] = {}  # first rid of each call -> all its rids
+        self._wake = wake  # set whenever a slot frees up
+        self.completed = 0  # reminders fired so far; the housekeeper reschedules after new ones
+
+    def free_slots(self) -> int:
+        with self._lock:
+            return self.max_in_flight - len(self._in_flight)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+    def in_flight_ids(self) -> list[int]:
+        with self._lock:
+            return [rid for rids in self._in_flight.values() for rid in rids]
+
+    def submit(self, group: list, job=None) -> bool:
+        """
+        Hand one call's claimed rows to a free slot; `job` runs instead of
+        fire_call(group) when the rows go out some other way (a message batch).
+        False if it is already running or no slot is free.
+        """
+        rid = group[0][0]
+        with self._lock:
+            if rid in self._in_flight or len(self._in_flight) >= self.max_in_flight:
+                return False
+            self._in_flight[rid] = [row[0] for row in group]
+        self._pool.submit(self._run, group, job)
+        return True
+
+    def _run(self, group: list, job=None):
+        rid = group[0][0]
+        t0 = time.perf_counter()
+        try:
+            job() if job is not None else fire_call(group)
+        finally:
+            with self._lock:
+                self._in_flight.pop(rid, None)
+                self.completed += len(group)
+            if self._wake is not None:
+                self._wake.set()
+            print(f"{stamp()}  ⌛ rid={rid} (+{len(group) - 1}) slot held {time.perf_counter() - t0:.2f}s")
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+class LookaheadSchedule:
+    """
+    In-process min-heap of reminders firing within the next LOOKAHEAD_MINUTES,
+    keyed by next_fire_utc. The loop sleeps until the earliest deadline and only
+    touches the DB to claim what is actually due or to extend the window.
+    """
+
+    def __init__(self, lookahead: timedelta = timedelta(minutes=LOOKAHEAD_MINUTES)):
+        self.lookahead = lookahead
+        self.loaded_until: datetime | None = None
+        self._heap: list[tuple[datetime, int]] = []
+        self._fire: dict[int, datetime] = {}  # rid -> live fire time; heap entries that disagree are stale
+        self._by_user: dict[int, set[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._fire)
 
+    def add(self, rid: int, uid: int, fire_utc: datetime):
+        with self._lock:
+            self._add(rid, uid, fire_utc)
+
+    def _add(self, rid: int, uid: int, fire_utc: datetime):
+        if self._fire.get(rid) == fire_utc:
+            return
+        self._fire[rid] = fire_utc
+        self._by_user.setdefault(uid, set()).add(rid)
+        heapq.heappush(self._heap, (fire_utc, rid))
+
+    def reset(self):
+        """Forget everything; the next refresh reloads the whole window."""
+        with self._lock:
+            self._heap.clear()
+            self._fire.clear()
+            self._by_user.clear()
+            self.loaded_until = None
+
+    def discard(self, rids: list[int]):
+        """Forget reminders claimed ahead of their slot (coalesced into an earlier call)."""
+        with self._lock:
+            for rid in rids:
+                self._fire.pop(rid, None)  # its heap entry is now stale
+
+    def reload_users(self, uids: set[int]) -> int:
+        """Replace the heap entries of patients whose reminders were added, moved or cancelled."""
+        until = self.loaded_until
+        if until is None or not uids:
+            return 0  # a full load is pending anyway
+        rows = load_upcoming(None, until, sorted(uids))
+        with self._lock:
+            for uid in uids:
+                for rid in self._by_user.pop(uid, ()):
+                    self._fire.pop(rid, None)
+            for rid, uid, fire_utc in rows:
+                self._add(rid, uid, fire_utc)
+        return len(rows)
+
+    def refresh_due_at(self) -> datetime:
+        """Extend the window once half of it has been used up."""
+        if self.loaded_until is None:
+            return utcnow()
+        return self.loaded_until - self.lookahead / 2
+
+    def refresh(self, now: datetime) -> int:
+        """Load only the slice between the old horizon and the new one."""
+        until = now + self.lookahead
+        rows = load_upcoming(self.loaded_until, until)
+        for rid, uid, fire_utc in rows:
+            self.add(rid, uid, fire_utc)
+        self.loaded_until = until
+        return len(rows)
+
+    def _drop_stale(self):
+        while self._heap and self._fire.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> datetime | None:
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime, limit: int) -> dict[int, int]:
+        """
+        Remove up to `limit` reminders whose fire time has arrived and return them
+        as {reminder_id: user_id}; hand back the ones claim_due did not get with
+        reload_users().
+        """
+        out = {}
+        with self._lock:
+            while len(out) < limit:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, rid = heapq.heappop(self._heap)
+                del self._fire[rid]
+                out[rid] = None
+            for uid, rids in self._by_user.items():
+                for rid in rids.intersection(out):
+                    out[rid] = uid
+                rids.difference_update(out)
+        return out
+
+def housekeeper(dispatcher: Dispatcher, schedule: LookaheadSchedule,
+                wake: threading.Event, stop: threading.Event):
+    """
+    Background thread: renew our leases, re-queue anyone else's that expired,
+    roll fired recurring reminders forward, keep fire_queue's horizon ahead,
+    and chase calls whose status callbacks went missing.
+    """
+    last_sweep = last_reconcile = last_reschedule = last_extend = 0.0
+    last_stats = time.monotonic()
+    rescheduled_upto = -1  # dispatcher.completed at the last reschedule pass
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            renew_leases(dispatcher.in_flight_ids())
+            if time.monotonic() - last_sweep >= SWEEP_SECONDS:
+                last_sweep = time.monotonic()
+                requeued = requeue_expired_leases()
+                for rid, uid, owner in requeued:
+                    print(f"{stamp()}  ↺ re-queued rid={rid} (lease from {owner} expired)")
+                    schedule.add(rid, uid, utcnow())
+                if requeued:
+                    wake.set()
+            completed = dispatcher.completed
+            if completed != rescheduled_upto or time.monotonic() - last_reschedule >= RESCHEDULE_SECONDS:
+                last_reschedule, rescheduled_upto = time.monotonic(), completed
+                rolled = reschedule_fired()
+                if rolled:
+                    print(f"{stamp()}  ⟳ rescheduled {len(rolled)} recurring reminder(s)")
+                for rid, uid, fire_utc in rolled:
+                    if schedule.loaded_until is not None and fire_utc <= schedule.loaded_until:
+                        schedule.add(rid, uid, fire_utc)
+            if time.monotonic() - last_extend >= FIRE_QUEUE_EXTEND_SECONDS:
+                last_extend = time.monotonic()
+                added, dropped = extend_fire_queue()
+                if added or dropped:
+                    print(f"{stamp()}  🗓 fire_queue +{added} / -{dropped} instants")
+            if time.monotonic() - last_reconcile >= RECONCILE_SECONDS:
+                last_reconcile = time.monotonic()
+                reconcile_stale_calls()
+            if time.monotonic() - last_stats >= STATS_SECONDS:
+                last_stats = time.monotonic()
+                print(f"{stamp()}  🗄 db pool: {db.stats()}")
+                if isinstance(transport(), RateLimitedTransport):
+                    print(f"{stamp()}  🚦 call pacing: {transport().stats()}")
+        except Exception as e:
+            print("⚠️ housekeeper error:", e)
+
+def listen_for_changes(schedule: LookaheadSchedule, wake: threading.Event, stop: threading.Event):
+    """
+    Background thread on its own connection: LISTEN for reminder writes and
+    reload just the affected patients, so edits take effect without a poll.
+    """
+    while not stop.is_set():
+        try:
+            with db.connect(autocommit=True) as lc:
+                lc.execute(f"LISTEN {REMINDERS_CHANNEL}")
+                # we may have missed notifications while disconnected: reload the window
+                schedule.reset()
+                wake.set()
+                print(f"{stamp()}  👂 listening on {REMINDERS_CHANNEL}")
+                while not stop.is_set():
+                    batch = list(lc.notifies(timeout=LISTEN_TIMEOUT_SECONDS, stop_after=1))
+                    if not batch:
+                        continue
+                    batch += lc.notifies(timeout=0)  # drain the rest of a burst
+                    uids = set()
+                    for n in batch:
+                        try:
+                            uids.add(int(json.loads(n.payload)["user_id"]))
+                        except (ValueError, KeyError, TypeError):
+                            schedule.reset()  # unknown payload: fall back to a full reload
+                    schedule.reload_users(uids)
+                    wake.set()
+        except Exception as e:
+            print("⚠️ listener error:", e)
+            stop.wait(ERROR_BACKOFF_SECONDS)
+
+def main(stop: threading.Event | None = None, wake: threading.Event | None = None):
+    """
+    Run until interrupted, or until `stop` is set (set `wake` too so the loop
+    notices straight away); both are optional and exist for embedding, e.g.
+    loadtest_reminders.py.
+    """
+    # a connection per call slot plus main loop, housekeeper and status receiver
+    db.configure(max_size=max(db.POOL_MAX_SIZE, MAX_IN_FLIGHT_CALLS + 4))
+    migrate()
+    wake = wake or threading.Event()
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        def drain(signum, frame):
+            print(f"⏹ {signal.Signals(signum).name}: draining")
+            stop.set()
+            wake.set()
+        signal.signal(signal.SIGTERM, drain)  # supervisor.py scales down with SIGTERM
+        signal.signal(signal.SIGINT, drain)   # Ctrl-C drains too instead of dropping calls mid-dial
+    dispatcher = Dispatcher(wake=wake)
+    schedule = LookaheadSchedule()
+    threading.Thread(target=housekeeper, args=(dispatcher, schedule, wake, stop),
+                     name="housekeeper", daemon=True).start()
+    threading.Thread(target=listen_for_changes, args=(schedule, wake, stop),
+                     name="listener", daemon=True).start()
+    if STATUS_RECEIVER_PORT:
+        status_receiver.start_in_background(STATUS_RECEIVER_PORT)
+    if METRICS_PORT:
+        metrics.gauge("reminder_due_backlog", "Due reminders not yet claimed by any worker", fn=due_backlog)
+        metrics.gauge("reminder_calls_in_flight", "Call slots in use", fn=dispatcher.in_flight)
+        metrics.gauge("reminder_lookahead_size", "Reminders loaded in the lookahead heap", fn=schedule.__len__)
+        metrics.start_in_background(METRICS_PORT)
+    if not STATUS_CALLBACK_URL:
+        print("⚠️ STATUS_CALLBACK_URL not set — call status will only be learned by reconciliation")
+    print("🩺 reminder_worker", WORKER_ID, "running —", transport().name, "telephony,",
+          LOOKAHEAD_MINUTES, "min lookahead,",
+          "safety poll every", POLL_SECONDS, "seconds,", dispatcher.max_in_flight, "calls in flight max")
+    next_poll = 0.0
+    while not stop.is_set():
+        wake.clear()
+        backlog = False
+        try:
+            now = utcnow()
+
+            # 1) Keep the heap loaded LOOKAHEAD_MINUTES ahead
+            if now >= schedule.refresh_due_at():
+                schedule.refresh(now)
+
+            # 2) Claim what the heap says is due, as many as we have free slots
+            limit = min(dispatcher.free_slots(), CLAIM_BATCH_SIZE)
+            due = schedule.pop_due(now, limit)
+            claimed = claim_due(len(due), list(due)) if due else []
+            # skipped (row locked by another worker or an edit) or changed meanwhile: reload what is
+            # still pending rather than lose it until the safety poll
+            missed = due.keys() - {row[0] for row in claimed}
+            if missed:
+                schedule.reload_users({due[rid] for rid in missed})
+
+            # 3) Safety net: sweep for due rows the heap never saw
+            room = limit - len(claimed)
+            if room > 0 and time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + POLL_SECONDS
+                extra = claim_due(room)
+                backlog = len(extra) == room
+                claimed += extra
+
+            # 4) One call per patient, dialed in parallel; messages go out a provider batch per slot
+            schedule.discard([row[0] for row in claimed])
+            batches: dict[str, list] = {}
+            for group in coalesce(claimed):
+                if group[0][5] != "voice":
+                    batches.setdefault(group[0][5], []).append(group)
+                elif not dispatcher.submit(group):
+                    release([row[0] for row in group])
+            for name, groups in batches.items():
+                size = channel_batch_size(name)
+                for i in range(0, len(groups), size):
+                    batch = groups[i:i + size]
+                    rows = [row for group in batch for row in group]
+                    if not dispatcher.submit(rows, lambda name=name, batch=batch: send_messages(name, batch)):
+                        release([row[0] for row in rows])
+
+            deadline = schedule.next_deadline()
+            backlog = backlog or (deadline is not None and deadline <= now)
+            failed = False
+
+        except Exception as loop_err:
+            print("⚠️ worker top-level error:", loop_err)
+            failed = True
+
+        try:
+            # Sleep exactly until the next thing to do; a NOTIFY, freed slot or re-queued lease wakes us early
+            if failed:
+                wake.wait(ERROR_BACKOFF_SECONDS)
+                continue
+            waits = [(schedule.refresh_due_at() - utcnow()).total_seconds()]
+            if dispatcher.free_slots() > 0:
+                waits.append(next_poll - time.monotonic())
+                if backlog:
+                    waits.append(0)
+                elif deadline is not None:
+                    waits.append((deadline - utcnow()).total_seconds())
+            wake.wait(max(0.0, min(waits)))
+        except KeyboardInterrupt:
+            print("⏹ worker stopped by user")
+            stop.set()
+    print("⏹ waiting for", dispatcher.in_flight(), "calls in flight")
+    dispatcher.shutdown(wait=True)
+    stop.set()
     try:
-        time.sleep(POLL_SECONDS)
-    except KeyboardInterrupt:
-        print("⏹ worker stopped by user")
-        break
+        released = release()
+        if released:
+            print(f"⏹ released {released} unstarted lease(s)")
+    except Exception as e:
+        print("⚠️ could not release leases (they will expire):", e)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# retry_queue.py
+# Failed reminder calls are retried through the normal claim path: the reminder
+# is simply re-armed with next_fire_utc = now + backoff, so retries are claimed
+# in batches with SKIP LOCKED and bounded by free call slots like any other
+# reminder. After MAX_ATTEMPTS the failure is parked in reminder_dead_letters.
+import os
+import random
+from db import connection as conn, notify_reminders_changed
+
+# ─── CONFIG ─────────────────────────────────────────────────
+RETRY_STATUSES = ("busy", "no-answer", "failed")  # terminal call statuses worth another try
+MAX_ATTEMPTS = int(os.environ.get("REMINDER_MAX_ATTEMPTS", "4"))            # first call + 3 retries
+BACKOFF_BASE_SECONDS = int(os.environ.get("REMINDER_BACKOFF_BASE", "120"))   # delay before the 1st retry
+BACKOFF_MAX_SECONDS = int(os.environ.get("REMINDER_BACKOFF_MAX", "1800"))    # cap for later retries
+
+def backoff_seconds(attempt: int) -> float:
+    """
+    Exponential backoff with "equal jitter": somewhere in the upper half of
+    base * 2^(attempt-1), capped. After a telephony outage the failed calls
+    come back spread over minutes instead of all at once.
+    """
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+def schedule_retry(rid: int, status: str, error: str | None = None,
+                   call_sid: str | None = None, retryable: bool = True) -> str:
+    """
+    Count a failed attempt. Returns "retry" if the reminder was re-armed,
+    "dead" if it went to the dead-letter table, "gone" if it was deleted, or
+    "off" if the patient switched it off meanwhile (left as it is).
+    Re-arming also drops any lease, so the caller may still be holding one.
+    """
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            SELECT attempt_count, user_id, label, disabled_by_user
+            FROM reminders
+            WHERE reminder_id = %s
+            FOR UPDATE
+        """, (rid,))
+        row = cur.fetchone()
+        if row is None:
+            return "gone"  # the patient rewrote their reminders meanwhile
+        if row[3]:
+            return "off"   # never ring again for a reminder switched off mid-call
+        attempts, uid, label = row[0] + 1, row[1], row[2]
+
+        if retryable and attempts < MAX_ATTEMPTS:
+            # keep a real occurrence that is due sooner than the retry would be
+            cur.execute("""
+                UPDATE reminders
+                SET attempt_count = %(n)s,
+                    next_fire_utc = CASE
+                        WHEN is_active AND claimed_by IS NULL
+                             AND next_fire_utc BETWEEN now() AND now() + make_interval(secs => %(delay)s)
+                        THEN next_fire_utc
+                        ELSE now() + make_interval(secs => %(delay)s)
+                    END,
+                    is_active = TRUE,
+                    claimed_by = NULL,
+                    lease_expires_utc = NULL
+                WHERE reminder_id = %(rid)s
+            """, dict(n=attempts, delay=backoff_seconds(attempts), rid=rid))
+            outcome = "retry"
+        else:
+            cur.execute("""
+                INSERT INTO reminder_dead_letters
+                  (reminder_id, user_id, label, attempts, last_status, last_error, last_call_sid)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (rid, uid, label, attempts, status, error, call_sid))
+            # recurring reminders carry on at their next occurrence with a clean slate
+            cur.execute("UPDATE reminders SET attempt_count = 0 WHERE reminder_id = %s", (rid,))
+            outcome = "dead"
+
+        notify_reminders_changed(cur, uid)
+        c.commit()
+    return outcome
+
+def defer(rid: int, delay_seconds: float) -> str:
+    """
+    Re-arm a reminder we held back ourselves (local rate limit) without counting
+    an attempt: nothing reached the provider, so it must not creep towards the
+    dead-letter table. Returns "deferred", "gone" if it was deleted, or "off"
+    if the patient switched it off meanwhile (only the lease is dropped).
+    """
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            UPDATE reminders
+            SET next_fire_utc = CASE
+                    WHEN is_active AND claimed_by IS NULL
+                         AND next_fire_utc BETWEEN now() AND now() + make_interval(secs => %(delay)s)
+                    THEN next_fire_utc
+                    ELSE now() + make_interval(secs => %(delay)s)
+                END,
+                is_active = NOT disabled_by_user,
+                claimed_by = NULL,
+                lease_expires_utc = NULL
+            WHERE reminder_id = %(rid)s
+            RETURNING user_id, disabled_by_user
+        """, dict(delay=delay_seconds, rid=rid))
+        row = cur.fetchone()
+        if row is not None:
+            notify_reminders_changed(cur, row[0])
+        c.commit()
+    if row is None:
+        return "gone"
+    return "off" if row[1] else "deferred"
+
+def reset_attempts(rid: int):
+    with conn() as c, c.cursor() as cur:
+        cur.execute("UPDATE reminders SET attempt_count = 0 WHERE reminder_id = %s AND attempt_count <> 0", (rid,))
+        c.commit()
+
+def on_call_finished(rid: int, status: str, error: str | None, call_sid: str) -> str | None:
+    """Called once per call when its terminal status and its reminder are both known."""
+    if status == "completed":
+        reset_attempts(rid)
+        return None
+    if status in RETRY_STATUSES:
+        return schedule_retry(rid, status, error, call_sid)
+    return None  # canceled: we hung it up ourselves
@@ -1,136 +1,555 @@
+# shot_advisor.py
+# "Take it now or wait?" advice for a proposed insulin shot, from Gemini.
+#
+# One model client per process, shared by every Streamlit session: the
+# google.generativeai import, genai.configure() and the GenerativeModel are
+# built on first use (or by warm_up() at app start, off the render thread),
+# never per call. Each call reports where its time went in "timings_ms", in
+# the advisor_*_seconds histograms and, as recent medians, in stats().
+#
+# The model call runs on a small thread pool so the Streamlit render thread
+# never waits longer than ADVISOR_DEADLINE_SECONDS: past that, or while the
+# circuit breaker is open after repeated failures, the advice is the usual
+# take_now fallback. A request still unanswered at the recent p95 latency is
+# hedged with a second, identical one; whichever answers first wins.
+#
+# Answers are cached per dosing state (user, their latest insulin_logs.id,
+# proposed units to the nearest ADVISOR_CACHE_UNITS_STEP, remarks, and a
+# ADVISOR_CACHE_BUCKET_SECONDS wall-clock bucket) for ADVISOR_CACHE_TTL
+# seconds, so reruns and cancel-and-retry reuse the last answer.
+# insulinmate.insert_insulin_log calls invalidate() for the patient.
+#
+# Before any of that, iob.quick_advice answers the obvious cases (nothing
+# logged for hours and no bigger than usual, the same dose logged minutes ago)
+# locally.
+#
+# The prompt itself comes from advisor_prompt (compact, token-budgeted).
+# The answer is asked for as schema-constrained JSON where the SDK allows it,
+# streamed, and checked strictly by advisor_response; rejected answers are
+# counted in advisor_parse_failures_total and come back as "undetermined".
+#
+# insulinmate calls prefetch() with the patient's typical dose as soon as the
+# shot form opens, so by the time they press "Save" the answer is usually in
+# the cache already (or on its way, and joined rather than asked again).
 import os
-import json
-from datetime import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-import psycopg
 from dotenv import load_dotenv
 
+import advisor_prompt
+import advisor_response
+import db
+import iob
+import metrics
+
 # Load .env (must contain GEMINI_API_KEY=...)
 load_dotenv()
 
-# Gemini
-try:
-    import google.generativeai as genai
-except Exception:  # library missing
-    genai = None
+# ─── CONFIG ─────────────────────────────────────────────────
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")  # fast/light model; swap if you prefer
+WARMUP_PING = os.environ.get("ADVISOR_WARMUP_PING", "1") == "1"    # warm_up() also opens the API connection
+DEADLINE_SECONDS = float(os.environ.get("ADVISOR_DEADLINE_SECONDS", "6"))  # whole advice call, DB included
+HEDGE = os.environ.get("ADVISOR_HEDGE", "1") == "1"                    # second request past the p95 latency
+BREAKER_FAILURES = int(os.environ.get("ADVISOR_BREAKER_FAILURES", "3"))    # consecutive failures that open it
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("ADVISOR_BREAKER_COOLDOWN", "60"))  # then one trial call
+CACHE_TTL_SECONDS = float(os.environ.get("ADVISOR_CACHE_TTL", "300"))       # 0 turns the cache off
+CACHE_SIZE = int(os.environ.get("ADVISOR_CACHE_SIZE", "1024"))               # entries kept (LRU beyond that)
+CACHE_UNITS_STEP = float(os.environ.get("ADVISOR_CACHE_UNITS_STEP", "0.5"))  # 4.0 and 4.2 units share an answer
+CACHE_BUCKET_SECONDS = int(os.environ.get("ADVISOR_CACHE_BUCKET_SECONDS", "300"))  # advice ages with the clock
+HEDGE_MIN_SAMPLES = 20       # latencies needed before the p95 is trusted
+HEDGE_FLOOR_SECONDS = 1.0    # never hedge sooner than this
+LATENCY_SAMPLES = 200        # recent successful generate times kept for the p95
+POOL_SIZE = 8                # concurrent model calls (timed-out ones keep a thread until they return)
+STRUCTURED = os.environ.get("ADVISOR_STRUCTURED", "1") == "1"   # JSON/schema-constrained output where the SDK has it
+STREAM = os.environ.get("ADVISOR_STREAM", "1") == "1"           # parse the answer as it streams in
+STOP_AT_DECISION = os.environ.get("ADVISOR_STOP_AT_DECISION", "1") == "1"  # stop reading once the decision is in
+PREFETCH_WORKERS = 4         # speculative requests running at once (see prefetch())
+
+SETUP_SECONDS = metrics.histogram("advisor_setup_duration_seconds", "Getting the model client (import + configure on a cold start)")
+CONTEXT_SECONDS = metrics.histogram("advisor_context_duration_seconds", "Loading patient and recent logs")
+GENERATE_SECONDS = metrics.histogram("advisor_generate_duration_seconds", "generate_content round trip")
+CALLS = metrics.counter("advisor_calls_total", "Advice calls by outcome (ok, timeout, error, parse_error, "
+                        "breaker_open, unavailable)",
+                        ("outcome",))
+FAST_PATH = metrics.counter("advisor_fast_path_total", "Advice requests by who answered (take_now/wait: "
+                            "local IOB rules, model: everything else)", ("result",))
+CACHE_LOOKUPS = metrics.counter("advisor_cache_total", "Advice cache lookups by result (hit, miss)", ("result",))
+PROMPT_TOKENS = metrics.histogram("advisor_prompt_tokens", "Estimated prompt size per model call, as sent "
+                                  "and as the verbose encoding would have been", ("encoding",),
+                                  buckets=(100, 200, 300, 400, 600, 800, 1200, 1600, 2400))
+PARSE_FAILURES = metrics.counter("advisor_parse_failures_total", "Model answers rejected by the strict parser, "
+                                 "by kind (invalid_json, schema, incomplete)", ("kind",))
+PREFETCHES = metrics.counter("advisor_prefetch_total", "Speculative advice requests (started) and "
+                             "saves that joined one still in flight (joined)", ("result",))
+HEDGES = metrics.counter("advisor_hedges_total", "Hedged second requests, by which request answered first",
+                         ("winner",))
 
-# ── DB config (match insulinmate.py) ─────────────────────────────
-DB = dict(
-    host="localhost", port=5432, dbname="inter",
-    user="postgres", password="ashu5995", sslmode="disable",
-)
+_client = None        # (api_key, GenerativeModel) once built
+_client_lock = threading.Lock()
+_warmup_thread: threading.Thread | None = None
+_genai = None         # google.generativeai, imported on first use
+_genai_missing = False
+_output_mode = "text"  # what the model is asked for: "schema", "json" or free "text"
+_flights: dict = {}    # (user_id, units bucket, remarks hash) -> Future of a prefetch() still running
+_flights_lock = threading.Lock()
 
 def _conn():
-    return psycopg.connect(**DB)
+    return db.connection()  # pooled; see db.py
+
+class AdviceCache:
+    """Size-bounded LRU of advice dicts with a TTL; entries for one user can be dropped at once."""
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_monotonic, advice)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc("miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc("hit")
+            return dict(entry[1])
+
+    def put(self, key: tuple, advice: dict):
+        if self.ttl <= 0 or self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(advice))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> int:
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == user_id]
+            for k in stale:
+                del self._entries[k]
+        return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = self.hits + self.misses
+            return dict(entries=len(self._entries), hits=self.hits, misses=self.misses,
+                        hit_rate=round(self.hits / n, 3) if n else None)
+
+cache = AdviceCache()
+
+def _bucket(proposed_units: float, remarks: str) -> tuple:
+    """(units to the nearest CACHE_UNITS_STEP, hash of the normalised remarks): doses that share an answer."""
+    units = round(round(float(proposed_units) / CACHE_UNITS_STEP) * CACHE_UNITS_STEP, 2) if CACHE_UNITS_STEP else proposed_units
+    note = hashlib.sha1(" ".join((remarks or "").lower().split()).encode()).hexdigest()[:16]
+    return units, note
+
+def cache_key(user_id: int, latest_log_id: int | None, proposed_units: float, remarks: str) -> tuple:
+    return (user_id, latest_log_id, *_bucket(proposed_units, remarks), int(time.time() // CACHE_BUCKET_SECONDS))
+
+def invalidate(user_id: int) -> int:
+    """Forget cached and in-flight advice for a patient; call after logging a shot for them."""
+    with _flights_lock:
+        for k in [k for k in _flights if k[0] == user_id]:
+            del _flights[k]
+    return cache.invalidate(user_id)
+
+# patient + last 12 logs in one round trip; the history arrives as ready-made JSON
+# (timestamps already ISO 8601), so nothing is converted row by row in Python
+CONTEXT_SQL = """
+    SELECT p.full_name, COALESCE(p.time_zone, 'UTC'), p.primary_basal_insulin_type,
+           p.primary_bolus_insulin_type, h.logs, h.latest_log_id
+    FROM (SELECT %s::int AS user_id) u
+    LEFT JOIN patients p ON p.user_id = u.user_id
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(json_agg(json_build_object(
+                   'timestamp_utc', l.timestamp_utc, 'insulin_type', l.insulin_type,
+                   'units_taken', l.units_taken::float8, 'purpose', l.purpose,
+                   'dose_context', l.dose_context, 'remarks', COALESCE(l.remarks, ''))
+                   ORDER BY l.timestamp_utc DESC), '[]') AS logs,
+               max(l.id) AS latest_log_id
+        FROM (SELECT * FROM insulin_logs
+              WHERE user_id = u.user_id
+              ORDER BY timestamp_utc DESC
+              LIMIT 12) l
+    ) h
+"""
 
 def _fetch_context(user_id: int) -> dict:
     """Grab patient & last few logs to give the model context."""
     with _conn() as c, c.cursor() as cur:
-        cur.execute("""
-            SELECT full_name, time_zone, primary_basal_insulin_type, primary_bolus_insulin_type
-            FROM patients WHERE user_id=%s
-        """, (user_id,))
-        prow = cur.fetchone()
-
-        cur.execute("""
-            SELECT timestamp_utc, insulin_type, units_taken, purpose, dose_context, COALESCE(remarks,'')
-            FROM insulin_logs
-            WHERE user_id=%s
-            ORDER BY timestamp_utc DESC
-            LIMIT 12
-        """, (user_id,))
-        logs = cur.fetchall()
+        cur.execute(CONTEXT_SQL, (user_id,), prepare=True)  # planned once per pooled connection
+        name, tz, basal, bolus, logs, latest_log_id = cur.fetchone()
 
     patient = None
-    if prow:
-        patient = dict(
-            full_name=prow[0],
-            time_zone=prow[1] or "UTC",
-            basal_type=prow[2],
-            bolus_type=prow[3],
-        )
-
-    hist = []
-    for ts, itype, units, purpose, ctx, rem in logs:
-        hist.append(dict(
-            timestamp_utc=ts.isoformat(),
-            insulin_type=itype,
-            units_taken=float(units),
-            purpose=purpose,
-            dose_context=ctx,
-            remarks=rem,
-        ))
-    return dict(patient=patient, history=hist)
+    if name is not None:
+        patient = dict(full_name=name, time_zone=tz, basal_type=basal, bolus_type=bolus)
+    return dict(patient=patient, history=logs, latest_log_id=latest_log_id)
+
+def _import_genai():
+    """google.generativeai pulls in grpc and protobuf; only pay for that when advice is first needed."""
+    global _genai, _genai_missing
+    if _genai is None and not _genai_missing:
+        try:
+            import google.generativeai as genai
+            _genai = genai
+        except Exception:  # library missing
+            _genai_missing = True
+    return _genai
+
+def _generation_config(genai) -> dict | None:
+    """Structured output, as far as the installed SDK supports it (older ones lack response_schema)."""
+    global _output_mode
+    fields = getattr(getattr(genai, "GenerationConfig", None), "__dataclass_fields__", {})
+    if not STRUCTURED or "response_mime_type" not in fields:
+        _output_mode = "text"
+        return None
+    if "response_schema" not in fields:
+        _output_mode = "json"
+        return dict(response_mime_type="application/json")
+    _output_mode = "schema"
+    schema = advisor_response.SCHEMA
+    try:
+        if "property_ordering" in genai.protos.Schema.meta.fields:
+            # decision first, so STOP_AT_DECISION can stop before the reason streams
+            schema = dict(schema, property_ordering=list(advisor_response.FIELDS))
+    except AttributeError:
+        pass  # without it the service orders keys alphabetically: reason, then the decision
+    return dict(response_mime_type="application/json", response_schema=schema)
 
 def _model():
+    """The shared GenerativeModel, configured once; rebuilt only if GEMINI_API_KEY changes. None if unavailable."""
+    global _client
     api_key = os.environ.get("GEMINI_API_KEY", "")
-    if not api_key or genai is None:
+    if not api_key:
         return None
-    genai.configure(api_key=api_key)
-    # Fast/light model; swap if you prefer
-    return genai.GenerativeModel("gemini-2.5-flash")
+    client = _client
+    if client is not None and client[0] == api_key:
+        return client[1]
+    with _client_lock:  # several sessions may click "Save" on a cold process at once
+        if _client is None or _client[0] != api_key:
+            genai = _import_genai()
+            if genai is None:
+                return None
+            genai.configure(api_key=api_key)
+            _client = (api_key, genai.GenerativeModel(GEMINI_MODEL, generation_config=_generation_config(genai)))
+        return _client[1]
+
+def _warm_up():
+    t0 = time.perf_counter()
+    model = _model()
+    if model is not None and WARMUP_PING:
+        try:
+            model.count_tokens("ping")  # opens the connection the first generate_content would otherwise pay for
+        except Exception as e:
+            print("⚠️ advisor warm-up ping failed:", e)
+    print(f"🧠 advisor warm ({GEMINI_MODEL}, {(time.perf_counter() - t0) * 1000:.0f} ms)"
+          if model is not None else "🧠 advisor unavailable (no GEMINI_API_KEY or google-generativeai)")
+
+def warm_up() -> threading.Thread:
+    """Build the client on a background thread; safe to call on every Streamlit rerun."""
+    global _warmup_thread
+    with _client_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warm_up, name="advisor-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+class AdvisorUnavailable(Exception):
+    """The model call was skipped or abandoned; `outcome` says why (timeout, breaker_open)."""
+
+    def __init__(self, outcome: str, msg: str):
+        super().__init__(msg)
+        self.outcome = outcome
+
+class CircuitBreaker:
+    """
+    closed → (BREAKER_FAILURES failures in a row) → open → (cooldown) →
+    half-open: one trial call closes it again or re-opens it.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._streak = 0
+        self._opened_at: float | None = None
+        self._trial = False  # a half-open trial call is out
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._streak, self._opened_at, self._trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self._streak += 1
+            if self._trial or self._streak >= self.failures:
+                if self._opened_at is None or self._trial:
+                    print(f"⚠️ advisor circuit open after {self._streak} failure(s); retrying in {self.cooldown:.0f}s")
+                self._opened_at, self._trial = time.monotonic(), False
+
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._trial or time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+breaker = CircuitBreaker()
+_pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="advisor")
+_latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+_answered = {"rules": 0, "model": 0}  # requests short-circuited by iob.quick_advice vs. passed on
+_parsed = {"ok": 0, "failed": 0}      # model answers accepted / rejected by advisor_response
+_counts_lock = threading.Lock()       # both are bumped from the app's sessions and the prefetch pool
+_timings: deque = deque(maxlen=LATENCY_SAMPLES)  # timings_ms of recent get_insulin_timing_advice calls
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="advisor-prefetch")
+
+metrics.gauge("advisor_breaker_open", "1 while the advisor circuit breaker skips the model",
+              fn=lambda: 0 if breaker.state() == "closed" else 1)
+
+def hedge_after() -> float | None:
+    """Seconds after which a second request is sent: the recent p95, or None until there is enough history."""
+    samples = list(_latencies)
+    if not HEDGE or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_FLOOR_SECONDS, db.pct(samples, 0.95))
+
+def _count(counts: dict, key: str):
+    with _counts_lock:
+        counts[key] += 1
+
+def stats() -> dict:
+    """Breaker state, hedging threshold and where recent calls spent their time, for the app or a health check."""
+    p95 = hedge_after()
+    with _counts_lock:
+        answered, parsed = dict(_answered), dict(_parsed)
+    total = answered["rules"] + answered["model"]
+    answers = parsed["ok"] + parsed["failed"]
+    recent = list(_timings)
+    stages = sorted({k for t in recent for k in t})
+    return dict(breaker=breaker.state(), hedge_after_s=round(p95, 2) if p95 else None,
+                latency_samples=len(_latencies), cache=cache.stats(), prefetches_in_flight=len(_flights),
+                fast_path_share=round(answered["rules"] / total, 3) if total else None,
+                output_mode=_output_mode,
+                parse_failure_rate=round(parsed["failed"] / answers, 3) if answers else None,
+                timings_ms_p50={k: db.pct([t[k] for t in recent if k in t], 0.5) for k in stages})
+
+def _chunks(model, text: str, timeout: float):
+    if not STREAM:
+        yield model.generate_content(text, request_options={"timeout": timeout}).text
+        return
+    for chunk in model.generate_content(text, stream=True, request_options={"timeout": timeout}):
+        try:
+            part = chunk.text
+        except ValueError:  # a chunk without text, e.g. only the finish reason
+            continue
+        yield part
+
+def _timed_generate(model, text: str, timeout: float, parser: advisor_response.StreamParser):
+    """Read the answer into parser; stop once it is complete, broken, or (STOP_AT_DECISION) decided."""
+    t0 = time.perf_counter()
+    for part in _chunks(model, text, timeout):
+        parser.feed(part)
+        if parser.done or parser.error is not None or (STOP_AT_DECISION and parser.decided):
+            break
+    elapsed = time.perf_counter() - t0
+    _latencies.append(elapsed)
+    GENERATE_SECONDS.observe(elapsed)
+    return parser
+
+def _generate(model, text: str, deadline: float):
+    """
+    generate_content with a hard deadline (a time.monotonic() instant),
+    hedged past the p95 and guarded by the breaker. Returns the answer's
+    StreamParser; raises AdvisorUnavailable. An answer whose decision is in
+    when the deadline hits is used even if its reason is still streaming.
+    """
+    if not breaker.allow():
+        raise AdvisorUnavailable("breaker_open", "AI temporarily skipped after repeated failures")
+    parsers = {}
+
+    def submit():
+        parser = advisor_response.StreamParser(fenced=_output_mode != "schema")
+        f = _pool.submit(_timed_generate, model, text, max(0.1, deadline - time.monotonic()), parser)
+        parsers[f] = parser
+        return f
+
+    remaining = deadline - time.monotonic()
+    first = submit()
+    done, pending, hedged = set(), {first}, False
+    hedge = hedge_after()
+    if hedge is not None and hedge < remaining:
+        done, pending = wait_futures(pending, timeout=hedge)
+        if not done:
+            pending.add(submit())
+            hedged = True
+    errors = []
+    while True:
+        for f in done:
+            if f.exception() is None:
+                breaker.success()
+                if hedged:
+                    HEDGES.inc("first" if f is first else "hedge")
+                return f.result()
+            errors.append(f.exception())
+        if not pending:
+            break
+        done, pending = wait_futures(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                     return_when=FIRST_COMPLETED)
+        if not done:
+            decided = [p for p in parsers.values() if p.decided]
+            if decided:
+                breaker.success()
+                return decided[0]
+            breaker.failure()
+            raise AdvisorUnavailable("timeout", f"AI took longer than {DEADLINE_SECONDS:.0f}s")
+    breaker.failure()
+    raise errors[-1]
+
+def prefetch(user_id: int, proposed_units: float, remarks: str, now_iso: str):
+    """
+    Start advice for a dose the patient is likely to enter, in the background
+    (e.g. their typical dose, as the shot form opens). A later
+    get_insulin_timing_advice for the same bucket joins it while it runs and
+    finds its answer in the cache afterwards. One request per bucket at a time.
+    """
+    key = (user_id, *_bucket(proposed_units, remarks))
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight
+        flight = _flights[key] = _prefetch_pool.submit(_advise, user_id, proposed_units, remarks, now_iso)
+    PREFETCHES.inc("started")
+
+    def land(f):
+        with _flights_lock:
+            if _flights.get(key) is f:
+                del _flights[key]
+    flight.add_done_callback(land)
+    return flight
 
 def get_insulin_timing_advice(user_id: int, proposed_units: float, remarks: str, now_iso: str) -> dict:
     """
     Returns dict like:
-      {"recommendation":"take_now"|"wait",
+      {"recommendation":"take_now"|"wait"|"undetermined" (model answer unreadable),
        "wait_minutes": 0|int,
        "reason":"short explanation"}
-    Falls back to 'take_now' if model unavailable.
+    Falls back to 'take_now' if model unavailable, slow (past DEADLINE_SECONDS) or failing.
+    Also carries "timings_ms": {"context", "setup", "generate"} (or {"joined"}) for this call;
+    stats() reports their recent medians.
     """
+    flight = _flights.get((user_id, *_bucket(proposed_units, remarks)))
+    if flight is not None:
+        t0 = time.perf_counter()
+        try:
+            advice = flight.result(timeout=DEADLINE_SECONDS)  # it started earlier, so it ends sooner
+        except Exception:
+            advice = None
+        if advice is not None:
+            PREFETCHES.inc("joined")
+            timings = dict(joined=round((time.perf_counter() - t0) * 1000, 1))
+            _timings.append(timings)
+            return dict(advice, prefetched=True, timings_ms=timings)
+    advice = _advise(user_id, proposed_units, remarks, now_iso)
+    _timings.append(advice.get("timings_ms") or {})
+    return advice
+
+def _advise(user_id: int, proposed_units: float, remarks: str, now_iso: str) -> dict:
+    timings = {}
+    deadline = time.monotonic() + DEADLINE_SECONDS
+    t0 = time.perf_counter()
     ctx = _fetch_context(user_id)
     patient = ctx.get("patient") or {}
     history = ctx.get("history") or []
-
+    t1 = time.perf_counter()
+    CONTEXT_SECONDS.observe(t1 - t0)
+    now = datetime.now(timezone.utc)
+    quick = iob.quick_advice(history, proposed_units, remarks, now)
+    _count(_answered, "rules" if quick else "model")
+    FAST_PATH.inc(quick["recommendation"] if quick else "model")
+    if quick is not None:
+        quick.update(source="rules", timings_ms=dict(context=round((t1 - t0) * 1000, 1)))
+        return quick
+    key = cache_key(user_id, ctx.get("latest_log_id"), proposed_units, remarks)
+    cached = cache.get(key)
+    if cached is not None:
+        cached.update(cached=True, timings_ms=dict(context=round((t1 - t0) * 1000, 1)))
+        return cached
     model = _model()
+    t2 = time.perf_counter()
+    timings.update(context=round((t1 - t0) * 1000, 1), setup=round((t2 - t1) * 1000, 1))
+    SETUP_SECONDS.observe(t2 - t1)
     if model is None:
+        CALLS.inc("unavailable")
         return {
             "recommendation": "take_now",
             "wait_minutes": 0,
             "reason": "AI unavailable; defaulting to proceed.",
+            "timings_ms": timings,
         }
 
-    prompt = {
-        "instruction": (
-            "You are a diabetes assistant. Decide if the user should take an insulin shot RIGHT NOW "
-            "or WAIT for some time. Consider recent dosing history and the proposed units.\n"
-            "If recent similar insulin was taken very recently, suggest waiting.\n"
-            "IMPORTANT: Return ONLY valid JSON with keys: recommendation (take_now|wait), "
-            "wait_minutes (integer), reason (short, patient-friendly).\n"
-        ),
-        "now_local_iso": now_iso,
-        "patient": patient,
-        "proposed_shot": {
-            "units": proposed_units,
-            "remarks": remarks,
-        },
-        "recent_logs": history,
-    }
+    prompt = advisor_prompt.build(patient, history, proposed_units, remarks, now_iso,
+                                  iob.insulin_on_board(history, now), now)
+    PROMPT_TOKENS.observe(prompt.tokens, advisor_prompt.ENCODING)
+    PROMPT_TOKENS.observe(prompt.verbose_tokens, "verbose_equivalent")
 
     try:
-        resp = model.generate_content(
-            f"Analyze this JSON and respond ONLY with JSON:\n{json.dumps(prompt, separators=(',',':'))}"
-        )
-        text = resp.text.strip()
-
-        # Model may wrap code fences; strip them
-        if text.startswith("```"):
-            text = text.strip("` \n")
-            if text.lower().startswith("json"):
-                text = text[4:].strip()
-
-        data = json.loads(text)
-
-        rec = str(data.get("recommendation", "take_now")).lower()
-        if rec not in ("take_now", "wait"):
-            rec = "take_now"
-        wait = int(data.get("wait_minutes", 0) or 0)
-        reason = str(data.get("reason", "") or "").strip() or "No details."
-
-        return {"recommendation": rec, "wait_minutes": wait, "reason": reason}
+        t3 = time.perf_counter()
+        try:
+            answer = _generate(model, prompt.text, deadline)
+        finally:
+            timings["generate"] = round((time.perf_counter() - t3) * 1000, 1)
+        advice = answer.result()  # strict: advisor_response.SCHEMA
+        _count(_parsed, "ok")
+        CALLS.inc("ok")
+        cache.put(key, advice)  # only real answers; a fallback should not outlive the outage
+        return dict(advice, timings_ms=timings)
+    except advisor_response.ParseError as e:
+        _count(_parsed, "failed")
+        PARSE_FAILURES.inc(e.kind)
+        CALLS.inc("parse_error")
+        print(f"⚠️ advisor answer rejected ({e.kind}): {e}")
+        return {  # the model did answer, we just can't read it: never turn that into "take it now"
+            "recommendation": "undetermined",
+            "wait_minutes": 0,
+            "reason": "AI answer could not be read; check your recent doses before taking this one.",
+            "timings_ms": timings,
+        }
+    except AdvisorUnavailable as e:
+        CALLS.inc(e.outcome)
+        return {
+            "recommendation": "take_now",
+            "wait_minutes": 0,
+            "reason": f"{e}; defaulting to proceed.",
+            "timings_ms": timings,
+        }
     except Exception as e:
+        CALLS.inc("error")
+        print(f"⚠️ advisor call failed: {e!r}")
         return {
             "recommendation": "take_now",
             "wait_minutes": 0,
-            "reason": f"AI parsing error; proceeding. ({e})",
+            "reason": "AI error; defaulting to proceed.",
+            "timings_ms": timings,
         }
@@ -0,0 +1,235 @@
+# status_receiver.py
+# Twilio posts call progress here (StatusCallback); we record it in call_attempts.
+#
+#   STATUS_RECEIVER_PORT=8090 python status_receiver.py
+#
+# reminder_worker passes STATUS_CALLBACK_URL (the public URL of this endpoint)
+# on every call it places, so dialing no longer waits for the call to finish.
+#
+# ACK_PATH takes acknowledgements of SMS/push/webhook reminders (channels.py):
+# a GET/POST with ?ref=<token> from the link in the message, or Twilio's
+# incoming-SMS webhook when the patient replies "OK".
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlsplit
+from db import connection as conn, notify_reminders_changed, stamp
+import metrics
+import retry_queue
+from telephony import TELEPHONY, TWILIO_TOKEN
+
+# ─── CONFIG ─────────────────────────────────────────────────
+STATUS_PATH = "/twilio/status"
+STATUS_CALLBACK_URL = os.environ.get("STATUS_CALLBACK_URL", "")  # public URL Twilio signs requests for
+# Twilio's X-Twilio-Signature is checked with TWILIO_AUTH_TOKEN (as telephony.py reads it); without a token
+# every signed-only request is refused. STATUS_ALLOW_UNSIGNED=1 skips the check, and only with TELEPHONY=fake,
+# whose callbacks are unsigned.
+ALLOW_UNSIGNED = os.environ.get("STATUS_ALLOW_UNSIGNED", "0") == "1" and TELEPHONY == "fake"
+ACK_PATH = "/reminders/ack"
+ACK_URL = os.environ.get("REMINDER_ACK_URL", "")  # public URL of ACK_PATH (also the incoming-SMS webhook)
+ACK_WORDS = {"ok", "okay", "yes", "y", "done", "taken", "1"}  # SMS replies that count as "I took it"
+SMS_REPLY_WINDOW_SECONDS = 12 * 3600  # a reply acknowledges SMS reminders sent to that number this recently
+
+# Non-terminal statuses in the order a call moves through them; late or
+# out-of-order callbacks never move a call backwards.
+PROGRESS = ["queued", "initiated", "ringing", "in-progress"]
+TERMINAL_STATUSES = ("completed", "failed", "busy", "no-answer", "canceled")
+
+CALL_OUTCOMES = metrics.counter("reminder_call_outcomes_total",
+                                "Finished calls by terminal status and provider error code",
+                                ("status", "error_code"))
+ACKS = metrics.counter("reminder_acks_total", "Acknowledged SMS/push/webhook reminders by channel", ("channel",))
+
+def record_status(call_sid: str, status: str, error_code: str | None = None):
+    """
+    Upsert one status event. The callback can beat the worker's own insert,
+    so either side may create the row.
+    Returns (applied, reminder_ids); applied is False if the event was stale.
+    """
+    terminal = status in TERMINAL_STATUSES
+    rank = len(PROGRESS) + 1 if terminal else (PROGRESS.index(status) + 1 if status in PROGRESS else 0)
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            INSERT INTO call_attempts AS a (call_sid, status, error_code, ended_at_utc)
+            VALUES (%(sid)s, %(status)s, %(err)s, CASE WHEN %(terminal)s THEN now() END)
+            ON CONFLICT (call_sid) DO UPDATE
+            SET status = EXCLUDED.status,
+                error_code = COALESCE(EXCLUDED.error_code, a.error_code),
+                ended_at_utc = EXCLUDED.ended_at_utc,
+                updated_at_utc = now()
+            WHERE a.ended_at_utc IS NULL
+              AND COALESCE(array_position(%(progress)s::text[], a.status), 0) <= %(rank)s
+            RETURNING reminder_ids
+        """, dict(sid=call_sid, status=status, err=error_code or None,
+                  terminal=terminal, progress=PROGRESS, rank=rank))
+        row = cur.fetchone()
+        c.commit()
+    return row is not None, ((row[0] or []) if row else [])
+
+def handle_status(call_sid: str, status: str, error_code: str | None = None) -> bool:
+    """
+    Record an event and, once a call has ended, settle its reminders (retry,
+    dead-letter or reset). If the worker has not linked the call to its
+    reminders yet, reminder_worker.record_attempt settles them instead.
+    """
+    applied, rids = record_status(call_sid, status, error_code)
+    if applied and status in TERMINAL_STATUSES:
+        CALL_OUTCOMES.inc(status, error_code or "")
+        for rid in rids:
+            outcome = retry_queue.on_call_finished(rid, status, error_code, call_sid)
+            if outcome:
+                print(f"{stamp()}  ↻ rid={rid} {status} → {outcome}")
+    return applied
+
+def acknowledge(ref: str | None = None, from_number: str | None = None) -> list[int]:
+    """
+    Settle the reminders behind an acknowledged message (by its ref), or behind
+    every recent SMS to `from_number` when the patient replied instead. A
+    reminder already escalated to its next channel (claimed, or re-armed past
+    this message's step) is left alone. Returns the reminder ids settled.
+    """
+    with conn() as c, c.cursor() as cur:
+        cur.execute("""
+            WITH n AS (
+                UPDATE reminder_notifications
+                SET acked_at_utc = now()
+                WHERE acked_at_utc IS NULL
+                  AND error IS NULL
+                  AND (ref = %(ref)s
+                       OR (%(ref)s::text IS NULL AND channel = 'sms' AND to_address = %(from)s
+                           AND sent_at_utc > now() - make_interval(secs => %(window)s)))
+                RETURNING channel, reminder_ids, step
+            ), settled AS (
+                UPDATE reminders r
+                SET is_active = FALSE, last_called_utc = GREATEST(now(), r.next_fire_utc),
+                    channel_step = 0, attempt_count = 0
+                FROM n
+                WHERE r.reminder_id = ANY(n.reminder_ids)
+                  AND r.channel_step = n.step + 1
+                  AND r.is_active
+                  AND r.claimed_by IS NULL
+                RETURNING r.reminder_id, r.user_id
+            )
+            SELECT (SELECT array_agg(channel) FROM n),
+                   (SELECT array_agg(reminder_id) FROM settled),
+                   (SELECT array_agg(DISTINCT user_id) FROM settled)
+        """, {"ref": ref, "from": from_number, "window": SMS_REPLY_WINDOW_SECONDS})
+        channels, rids, uids = cur.fetchone()
+        for uid in uids or []:
+            # workers drop the pending escalation from their lookahead
+            notify_reminders_changed(cur, uid)
+        c.commit()
+    for channel in channels or []:
+        ACKS.inc(channel)
+    return rids or []
+
+def _signature_ok(handler: BaseHTTPRequestHandler, params: dict, public_url: str = STATUS_CALLBACK_URL) -> bool:
+    if ALLOW_UNSIGNED:
+        return True
+    if not TWILIO_TOKEN:
+        return False  # fail closed: an unsigned "completed" or "OK" would silence a reminder
+    from twilio.request_validator import RequestValidator
+    url = public_url or f"http://{handler.headers.get('Host', '')}{handler.path}"
+    return RequestValidator(TWILIO_TOKEN).validate(
+        url, params, handler.headers.get("X-Twilio-Signature", ""))
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def _reply(self, code: int, body: str = "", content_type: str = "text/plain; charset=utf-8"):
+        data = body.encode()
+        self.send_response(code)
+        if data:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _ack(self, params: dict):
+        ref = params.get("ref")
+        if not ref:
+            # Twilio incoming SMS: only a signed "OK"-style reply counts
+            if not params.get("From") or not _signature_ok(self, params, ACK_URL):
+                self._reply(403 if params.get("From") else 400)
+                return
+            if params.get("Body", "").strip().lower().rstrip(".!") not in ACK_WORDS:
+                self._reply(200, "<Response/>", "text/xml")
+                return
+        try:
+            rids = acknowledge(ref, None if ref else params["From"])
+        except Exception as e:
+            print(f"{stamp()}  ✗ could not record ack {ref or params.get('From')}: {e}")
+            self._reply(500)
+            return
+        print(f"{stamp()}  ✔ ack {ref or params['From']}: settled rids={rids}")
+        if ref:
+            self._reply(200, "Thanks, your reminder is confirmed.\n")
+        else:
+            self._reply(200, "<Response/>", "text/xml")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != ACK_PATH:
+            self._reply(404)
+            return
+        self._ack({k: v[0] for k, v in parse_qs(url.query).items()})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path not in (STATUS_PATH, ACK_PATH):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        params = {k: v[0] for k, v in parse_qs(body).items()}
+        if url.path == ACK_PATH:
+            self._ack({**{k: v[0] for k, v in parse_qs(url.query).items()}, **params})
+            return
+        if not _signature_ok(self, params):
+            self.send_response(403)
+            self.end_headers()
+            return
+
+        sid, status = params.get("CallSid"), params.get("CallStatus")
+        if not sid or not status:
+            self.send_response(400)
+            self.end_headers()
+            return
+        err = params.get("ErrorCode")
+        try:
+            if handle_status(sid, status, err):
+                print(f"{stamp()}  • {sid} status: {status}" + (f"  err={err}" if err else ""))
+            self.send_response(204)
+        except Exception as e:
+            print(f"{stamp()}  ✗ could not record {sid} {status}: {e}")
+            self.send_response(500)  # Twilio retries on 5xx
+        self.end_headers()
+
+    def log_message(self, fmt, *args):
+        pass  # one line per event above is enough
+
+def _check_config():
+    if ALLOW_UNSIGNED:
+        print("⚠️ status receiver: signatures NOT checked (STATUS_ALLOW_UNSIGNED with fake telephony)")
+    elif os.environ.get("STATUS_ALLOW_UNSIGNED", "0") == "1":
+        print("⚠️ status receiver: STATUS_ALLOW_UNSIGNED ignored — it only applies with TELEPHONY=fake")
+    if not ALLOW_UNSIGNED and not TWILIO_TOKEN:
+        print("⚠️ status receiver: no TWILIO_AUTH_TOKEN — Twilio callbacks and SMS replies will be refused (403)")
+
+def start_in_background(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Run the receiver on a daemon thread inside another process (e.g. the worker)."""
+    _check_config()
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    Thread(target=server.serve_forever, name="status-receiver", daemon=True).start()
+    print(f"📞 status receiver on {host}:{port}{STATUS_PATH}")
+    return server
+
+if __name__ == "__main__":
+    from migrations import migrate
+    migrate()
+    port = int(os.environ.get("STATUS_RECEIVER_PORT", "8090"))
+    _check_config()
+    server = ThreadingHTTPServer(("0.0.0.0", port), StatusHandler)
+    print(f"📞 status receiver on :{port}{STATUS_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("⏹ status receiver stopped by user")
@@ -0,0 +1,171 @@
+# supervisor.py
+# Runs reminder_worker.py as N child processes and scales N between
+# SUPERVISOR_MIN_WORKERS and SUPERVISOR_MAX_WORKERS from what the database says:
+#   - backlog:  due reminders nobody has claimed yet
+#   - lag:      how long the oldest of those has been waiting
+#   - upcoming: reminders due in the next SUPERVISOR_PEAK_MINUTES (e.g. the 08:00 IST wave)
+# Workers are claim-safe to run side by side (SKIP LOCKED + leases). Scaling
+# down sends SIGTERM, which makes a worker stop claiming, finish the calls it
+# is queuing and hand back any lease it never started.
+#
+#   python supervisor.py                 # real telephony
+#   python supervisor.py --dry-run       # children use telephony.FakeTransport
+#
+# SIGTERM/Ctrl-C on the supervisor drains every child the same way.
+import argparse
+import math
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import db
+from db import stamp
+from migrations import migrate
+
+# ─── CONFIG ─────────────────────────────────────────────────
+MIN_WORKERS = int(os.environ.get("SUPERVISOR_MIN_WORKERS", "1"))
+MAX_WORKERS = int(os.environ.get("SUPERVISOR_MAX_WORKERS", "4"))
+BACKLOG_PER_WORKER = int(os.environ.get("SUPERVISOR_BACKLOG_PER_WORKER", "200"))  # due rows one worker should absorb
+UPCOMING_PER_WORKER = int(os.environ.get("SUPERVISOR_UPCOMING_PER_WORKER", "1000"))  # rows due soon per worker
+PEAK_MINUTES = int(os.environ.get("SUPERVISOR_PEAK_MINUTES", "5"))         # how far ahead to look for a wave
+LAG_SCALE_UP_SECONDS = float(os.environ.get("SUPERVISOR_LAG_SECONDS", "30"))  # oldest due row older than this: add one
+ACCOUNT_CPS = float(os.environ.get("SUPERVISOR_ACCOUNT_CPS", "0"))        # provider CPS shared by all workers; 0 = leave as is
+CHECK_SECONDS = 10           # how often the backlog is sampled
+SCALE_DOWN_AFTER = 300       # a lower target must hold this long before a worker is retired
+DRAIN_SECONDS = 120          # SIGTERM grace before a child is killed
+RESTART_BACKOFF_SECONDS = 5  # pause before replacing a worker that died on its own
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reminder_worker.py")
+
+def sample() -> tuple[int, float, int]:
+    """(due backlog, age in seconds of the oldest due row, rows due within PEAK_MINUTES) in one round trip."""
+    with db.connection() as c, c.cursor() as cur:
+        cur.execute("""
+            SELECT count(*) FILTER (WHERE next_fire_utc <= now()),
+                   COALESCE(extract(epoch FROM now() - min(next_fire_utc)), 0),
+                   count(*) FILTER (WHERE next_fire_utc > now())
+            FROM reminders
+            WHERE is_active = TRUE
+              AND claimed_by IS NULL
+              AND next_fire_utc <= now() + make_interval(mins => %s)
+        """, (PEAK_MINUTES,))
+        backlog, oldest, upcoming = cur.fetchone()
+    return backlog, max(0.0, float(oldest)) if backlog else 0.0, upcoming
+
+def desired_workers(backlog: int, lag: float, upcoming: int, running: int,
+                    lo: int = MIN_WORKERS, hi: int = MAX_WORKERS) -> int:
+    want = max(math.ceil(backlog / BACKLOG_PER_WORKER), math.ceil(upcoming / UPCOMING_PER_WORKER))
+    if lag > LAG_SCALE_UP_SECONDS:
+        want = max(want, running + 1)  # falling behind whatever the counts say
+    return max(lo, min(hi, want))
+
+class Supervisor:
+    def __init__(self, lo: int = MIN_WORKERS, hi: int = MAX_WORKERS, dry_run: bool = False):
+        self.lo, self.hi = lo, max(lo, hi)
+        self.dry_run = dry_run
+        self.workers: list[subprocess.Popen] = []
+        self.draining: list[tuple[subprocess.Popen, float]] = []  # (process, kill deadline)
+        self.stop = threading.Event()
+        self._low_since: float | None = None  # when the target first dropped below the worker count
+
+    def _child_env(self) -> dict:
+        env = dict(os.environ)
+        if self.dry_run:
+            env["TELEPHONY"] = "fake"
+            env["STATUS_ALLOW_UNSIGNED"] = "1"  # the fake's callbacks are not signed
+        if ACCOUNT_CPS > 0:
+            # every worker paces itself; keep the sum under the account limit at full scale
+            env["REMINDER_CALLS_PER_SECOND"] = str(ACCOUNT_CPS / self.hi)
+        env.pop("REMINDER_METRICS_PORT", None)  # children would fight over one port
+        return env
+
+    def spawn(self):
+        # own session: a Ctrl-C on the terminal reaches only us, and we drain the workers one by one
+        p = subprocess.Popen([sys.executable, WORKER_SCRIPT], env=self._child_env(), start_new_session=True)
+        self.workers.append(p)
+        print(f"{stamp()}  ＋ worker pid={p.pid} ({len(self.workers)} running)")
+
+    def retire(self):
+        p = self.workers.pop()  # newest first
+        p.send_signal(signal.SIGTERM)
+        self.draining.append((p, time.monotonic() + DRAIN_SECONDS))
+        print(f"{stamp()}  － draining worker pid={p.pid} ({len(self.workers)} running)")
+
+    def reap(self):
+        for p in list(self.workers):
+            if p.poll() is not None:
+                self.workers.remove(p)
+                print(f"{stamp()}  ✗ worker pid={p.pid} exited with {p.returncode}; replacing")
+                self.stop.wait(RESTART_BACKOFF_SECONDS)
+        still = []
+        for p, deadline in self.draining:
+            if p.poll() is not None:
+                print(f"{stamp()}  ✓ worker pid={p.pid} drained")
+            elif time.monotonic() > deadline:
+                print(f"{stamp()}  ⚠ worker pid={p.pid} did not drain in {DRAIN_SECONDS}s; killing")
+                p.kill()
+            else:
+                still.append((p, deadline))
+        self.draining = still
+
+    def scale(self, target: int):
+        while len(self.workers) < target:
+            self.spawn()
+            self._low_since = None
+        if target < len(self.workers):
+            # scale down slowly, one worker per step, once the lull has lasted
+            self._low_since = self._low_since or time.monotonic()
+            if time.monotonic() - self._low_since >= SCALE_DOWN_AFTER:
+                self.retire()
+                self._low_since = None
+        else:
+            self._low_since = None
+
+    def run(self):
+        migrate()  # once here, so children find the schema ready
+        print(f"🧭 supervisor: {self.lo}..{self.hi} workers" + (" (dry run, fake telephony)" if self.dry_run else ""))
+        for _ in range(self.lo):
+            self.spawn()
+        while not self.stop.is_set():
+            try:
+                self.reap()
+                backlog, lag, upcoming = sample()
+                target = desired_workers(backlog, lag, upcoming, len(self.workers), self.lo, self.hi)
+                if target != len(self.workers):
+                    print(f"{stamp()}  📈 backlog={backlog} lag={lag:.0f}s next {PEAK_MINUTES}min={upcoming}"
+                          f" → {target} worker(s)")
+                self.scale(target)
+            except Exception as e:
+                print("⚠️ supervisor error:", e)
+            self.stop.wait(CHECK_SECONDS)
+        self.shutdown()
+
+    def shutdown(self):
+        print(f"⏹ supervisor: draining {len(self.workers)} worker(s)")
+        while self.workers:
+            self.retire()
+        while self.draining:
+            self.reap()
+            time.sleep(0.5)
+
+def main():
+    ap = argparse.ArgumentParser(description="Run and autoscale reminder_worker processes.")
+    ap.add_argument("--min", type=int, default=MIN_WORKERS, help="fewest workers to keep running")
+    ap.add_argument("--max", type=int, default=MAX_WORKERS, help="most workers to run at a peak")
+    ap.add_argument("--dry-run", action="store_true", help="children use the fake telephony transport")
+    args = ap.parse_args()
+
+    sup = Supervisor(args.min, args.max, args.dry_run)
+
+    def on_signal(signum, frame):
+        print(f"⏹ supervisor got {signal.Signals(signum).name}")
+        sup.stop.set()
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    sup.run()
+
+if __name__ == "__main__":
+    main()
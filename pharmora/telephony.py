@@ -0,0 +1,229 @@
+# telephony.py
+# What reminder_worker needs from a voice provider, behind one small interface:
+# place a call, ask for its status. TwilioTransport is the real thing;
+# FakeTransport runs entirely in-process so the worker can be exercised
+# offline or load-tested without dialing anyone.
+#
+#   TELEPHONY=twilio  (default) TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN / TWILIO_FROM_NUMBER, all required
+#   TELEPHONY=fake    FAKE_CREATE_MS FAKE_CREATE_JITTER_MS FAKE_CREATE_FAILURE_RATE FAKE_MAX_CPS
+#                     FAKE_RING_SECONDS FAKE_TALK_SECONDS FAKE_OUTCOMES (e.g. "completed=.9,busy=.1")
+#
+# With the fake, status callbacks are still POSTed to status_callback (when
+# given), so status_receiver is exercised end to end:
+#
+#   TELEPHONY=fake STATUS_RECEIVER_PORT=8090 STATUS_ALLOW_UNSIGNED=1 \
+#   STATUS_CALLBACK_URL=http://127.0.0.1:8090/twilio/status python reminder_worker.py
+import os
+import heapq
+import itertools
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+# ─── CONFIG ─────────────────────────────────────────────────
+TELEPHONY = os.environ.get("TELEPHONY", "twilio")  # "twilio" or "fake"
+TWILIO_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
+TWILIO_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
+TWILIO_FROM = os.environ.get("TWILIO_FROM_NUMBER", "")  # voice-enabled number or verified caller ID
+
+# fake: final status -> share of calls; error codes mirror what Twilio reports for them
+OUTCOMES = {"completed": 0.85, "no-answer": 0.08, "busy": 0.04, "failed": 0.03}
+ERROR_CODES = {"failed": "31005"}
+RING_SECONDS = 2.0   # initiated -> ringing -> answer/give up
+TALK_SECONDS = 4.0   # in-progress -> completed
+
+class TelephonyError(Exception):
+    """A call could not be placed or looked up. `retryable` says whether trying later may help."""
+
+    def __init__(self, msg: str, status: int | None = None, code=None, retryable: bool = True,
+                 retry_after: float | None = None):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status  # HTTP status from the provider, if any
+        self.code = code      # provider error code, if any
+        self.retryable = retryable
+        self.retry_after = retry_after  # seconds until trying again makes sense, if known
+
+def require_twilio(**settings: str):
+    """Refuse to start a live Twilio client with any of its settings (env var name=value) missing."""
+    missing = [name for name, value in settings.items() if not value]
+    if missing:
+        raise ValueError(f"{', '.join(missing)} not set; live Twilio needs them (TELEPHONY=fake / MESSAGING=fake run without)")
+
+class Transport:
+    """A voice provider. Implementations must be safe to call from many dispatcher threads."""
+    name = "base"
+
+    def create_call(self, to: str, twiml: str, status_callback: str | None = None,
+                    callback_events: list[str] | None = None) -> str:
+        """Queue a call and return its SID; progress is reported to status_callback."""
+        raise NotImplementedError
+
+    def fetch_status(self, sid: str) -> tuple[str, str | None]:
+        """Current (status, error_code) of a call, for callbacks that never arrived."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class TwilioTransport(Transport):
+    name = "twilio"
+
+    def __init__(self, sid: str = TWILIO_SID, token: str = TWILIO_TOKEN, from_: str = TWILIO_FROM,
+                 pool_size: int = 16):
+        require_twilio(TWILIO_ACCOUNT_SID=sid, TWILIO_AUTH_TOKEN=token, TWILIO_FROM_NUMBER=from_)
+        from requests.adapters import HTTPAdapter
+        from twilio.rest import Client
+        from twilio.http.http_client import TwilioHttpClient
+        from twilio.base.exceptions import TwilioRestException
+
+        # one client per process; every dispatcher thread shares its HTTP session.
+        # requests keeps 10 keep-alive sockets per host by default; size it to the dispatcher
+        http = TwilioHttpClient(pool_connections=True)
+        http.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._client = Client(sid, token, http_client=http)
+        self._rest_error = TwilioRestException
+        self.from_ = from_
+
+    def _error(self, e) -> TelephonyError:
+        return TelephonyError(e.msg, e.status, e.code, retryable=e.status == 429 or e.status >= 500)
+
+    def create_call(self, to, twiml, status_callback=None, callback_events=None):
+        callback = {}
+        if status_callback:
+            callback = dict(status_callback=status_callback, status_callback_method="POST",
+                            status_callback_event=callback_events or ["completed"])
+        try:
+            return self._client.calls.create(to=to, from_=self.from_, twiml=twiml, **callback).sid
+        except self._rest_error as e:
+            raise self._error(e) from e
+
+    def fetch_status(self, sid):
+        try:
+            call = self._client.calls(sid).fetch()
+        except self._rest_error as e:
+            raise self._error(e) from e
+        return call.status, (str(call.error_code) if call.error_code else None)
+
+class FakeTransport(Transport):
+    """
+    Accepts calls after a configurable delay (or fails them at a configurable
+    rate) and plays each through initiated → ringing → its final status,
+    posting Twilio-style form callbacks if a status_callback was given.
+    With max_cps set, creates beyond that many per second get a 429 / 20429
+    like Twilio's calls-per-second limit.
+    """
+    name = "fake"
+
+    def __init__(self, create_ms: float = 0.0, create_jitter_ms: float = 0.0,
+                 create_failure_rate: float = 0.0, max_cps: float = 0.0, outcomes: dict | None = None,
+                 ring_seconds: float = RING_SECONDS, talk_seconds: float = TALK_SECONDS,
+                 from_: str = TWILIO_FROM):
+        self.create_ms = create_ms
+        self.create_jitter_ms = create_jitter_ms
+        self.create_failure_rate = create_failure_rate
+        self.max_cps = max_cps
+        self.outcomes = outcomes or OUTCOMES
+        self.ring_seconds = ring_seconds
+        self.talk_seconds = talk_seconds
+        self.from_ = from_
+        self.created = 0  # calls accepted so far
+        self.failed = 0   # create_call failures injected so far
+        self.rejected = 0  # creates turned away with 429 for exceeding max_cps
+        self._recent: deque = deque()  # monotonic times of creates in the last second
+        self._status: dict[str, tuple[str, str | None]] = {}
+        self._events: list = []  # (due_monotonic, seq, sid, status, url)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._cv = threading.Condition(self._lock)
+        self._thread = None
+
+    def create_call(self, to, twiml, status_callback=None, callback_events=None):
+        delay = self.create_ms + random.uniform(-self.create_jitter_ms, self.create_jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < self.create_failure_rate:
+            with self._lock:
+                self.failed += 1
+            raise TelephonyError("fake: service unavailable", status=503, code=20503)
+        if self.max_cps > 0:
+            with self._lock:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] >= 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.max_cps:
+                    self.rejected += 1
+                    raise TelephonyError("fake: too many requests", status=429, code=20429)
+                self._recent.append(now)
+
+        sid = "CA" + uuid.uuid4().hex
+        final = random.choices(list(self.outcomes), weights=list(self.outcomes.values()))[0]
+        now = time.monotonic()
+        steps = [(0.05, "initiated"), (0.5, "ringing")]
+        if final == "completed":
+            steps += [(self.ring_seconds, "in-progress"), (self.ring_seconds + self.talk_seconds, "completed")]
+        else:
+            steps += [(self.ring_seconds, final)]
+        with self._cv:
+            self.created += 1
+            self._status[sid] = ("queued", None)
+            for delay_s, status in steps:
+                heapq.heappush(self._events, (now + delay_s, next(self._seq), sid, status, status_callback))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, name="fake-telephony", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+        return sid
+
+    def fetch_status(self, sid):
+        with self._lock:
+            if sid not in self._status:
+                raise TelephonyError(f"fake: no call {sid}", status=404, code=20404, retryable=False)
+            return self._status[sid]
+
+    def _deliver(self):
+        while True:
+            with self._cv:
+                while not self._events or self._events[0][0] > time.monotonic():
+                    self._cv.wait(self._events[0][0] - time.monotonic() if self._events else None)
+                _, _, sid, status, url = heapq.heappop(self._events)
+                self._status[sid] = (status, ERROR_CODES.get(status))
+            if url:
+                self._post(url, sid, status)
+
+    def _post(self, url: str, sid: str, status: str):
+        form = {"CallSid": sid, "CallStatus": status, "From": self.from_}
+        if status in ERROR_CODES:
+            form["ErrorCode"] = ERROR_CODES[status]
+        try:
+            urlopen(Request(url, data=urlencode(form).encode(), method="POST"), timeout=5).close()
+        except Exception as e:
+            print(f"   fake telephony: callback to {url} failed: {e}")
+
+def _parse_outcomes(spec: str) -> dict | None:
+    """"completed=.9,busy=.1" -> {"completed": 0.9, "busy": 0.1}"""
+    if not spec:
+        return None
+    return {k.strip(): float(v) for k, v in (part.split("=") for part in spec.split(","))}
+
+def make_transport(kind: str | None = None, pool_size: int = 16) -> Transport:
+    """Build the transport named by `kind` (default: the TELEPHONY env var)."""
+    kind = kind or TELEPHONY
+    if kind == "fake":
+        env = os.environ.get
+        return FakeTransport(
+            create_ms=float(env("FAKE_CREATE_MS", "0")),
+            create_jitter_ms=float(env("FAKE_CREATE_JITTER_MS", "0")),
+            create_failure_rate=float(env("FAKE_CREATE_FAILURE_RATE", "0")),
+            max_cps=float(env("FAKE_MAX_CPS", "0")),
+            outcomes=_parse_outcomes(env("FAKE_OUTCOMES", "")),
+            ring_seconds=float(env("FAKE_RING_SECONDS", str(RING_SECONDS))),
+            talk_seconds=float(env("FAKE_TALK_SECONDS", str(TALK_SECONDS))),
+        )
+    if kind == "twilio":
+        return TwilioTransport(pool_size=pool_size)
+    raise ValueError(f"unknown TELEPHONY={kind!r} (expected 'twilio' or 'fake')")
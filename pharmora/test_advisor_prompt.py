@@ -0,0 +1,94 @@
+# test_advisor_prompt.py
+# The compact prompt: what the token budget cuts, and that it tells the model
+# the same things as the verbose JSON.
+#
+#   python -m pytest -q test_advisor_prompt.py
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import advisor_prompt
+from advisor_prompt import COLUMNS, compact, estimate_tokens, verbose
+
+NOW = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+PATIENT = {"name": "Jane Example", "time_zone": "Europe/Berlin", "basal_type": "Lantus", "bolus_type": "Humalog"}
+
+def dose(minutes_ago: int, units: float, insulin_type: str = "Humalog", purpose: str = "bolus",
+         dose_context: str | None = "meal", remarks: str = "") -> dict:
+    return dict(timestamp_utc=(NOW - timedelta(minutes=minutes_ago)).isoformat(), insulin_type=insulin_type,
+                units_taken=units, purpose=purpose, dose_context=dose_context, remarks=remarks)
+
+# newest first, as shot_advisor._fetch_context returns them
+HISTORY = [dose(45, 4, remarks="pizza"), dose(300, 2.5), dose(600, 20, "Lantus", "basal", None),
+           dose(1500, 6, remarks="felt low after")] + [dose(1600 + 60 * i, 3 + i) for i in range(20)]
+
+def args(history=HISTORY, units=5, remarks="before dinner", iob_units=1.8):
+    return (PATIENT, history, units, remarks, NOW.isoformat(), iob_units)
+
+def body(text: str) -> dict:
+    return json.loads(text.split("\n", 1)[1])
+
+# ─── BUDGET ─────────────────────────────────────────────────
+@pytest.mark.parametrize("budget", [250, 300, 400, 600])
+def test_budget_drops_oldest_rows_first(budget):
+    text, sent, dropped = compact(*args(), now=NOW, budget=budget)
+    assert 0 < sent < len(HISTORY) and sent + dropped == len(HISTORY)
+    assert estimate_tokens(text) <= budget
+    minutes = [row[0] for row in body(text)["logs"]["rows"]]
+    assert minutes == [45, 300, 600, 1500, *(1600 + 60 * i for i in range(20))][:sent]
+
+def test_bigger_budget_sends_more_rows():
+    sent = [compact(*args(), now=NOW, budget=b)[1] for b in (250, 400, 600, 10_000)]
+    assert sent == sorted(sent) and sent[-1] == len(HISTORY)
+
+def test_everything_fits_nothing_dropped():
+    text, sent, dropped = compact(*args(HISTORY[:3]), now=NOW)
+    assert (sent, dropped) == (3, 0) and estimate_tokens(text) <= advisor_prompt.TOKEN_BUDGET
+
+def test_shot_remarks_cut_only_when_no_rows_left():
+    long_note = "had pasta and a dessert, walked for an hour afterwards " * 20
+    text, sent, _ = compact(*args(HISTORY[:2], remarks=long_note), now=NOW, budget=250)
+    assert sent == 0 and estimate_tokens(text) <= 250
+    note = body(text)["shot"]["note"]
+    assert note.endswith("…") and long_note.startswith(note[:-1])
+
+def test_instruction_and_shot_go_past_the_budget():
+    text, sent, _ = compact(*args(), now=NOW, budget=10)
+    assert sent == 0 and text.startswith(advisor_prompt.INSTRUCTION)
+    assert body(text)["shot"] == {"u": 5, "note": ""}
+
+def test_types_only_list_insulins_still_sent():
+    text, sent, _ = compact(*args(), now=NOW, budget=250)
+    assert sent < 3  # the Lantus row is gone
+    assert body(text)["types"] == ["Humalog"]
+
+# ─── SAME FACTS ─────────────────────────────────────────────
+def test_compact_and_verbose_carry_the_same_facts():
+    history = HISTORY[:4]
+    short = body(compact(*args(history), now=NOW, budget=10_000)[0])
+    full = json.loads(verbose(*args(history)).split("\n", 1)[1])
+
+    assert short["shot"] == {"u": full["proposed_shot"]["units"], "note": full["proposed_shot"]["remarks"]}
+    assert short["iob_u"] == full["insulin_on_board_units"]
+    assert datetime.fromisoformat(short["now"]) == datetime.fromisoformat(full["now_local_iso"])
+    assert short["patient"] == {"tz": PATIENT["time_zone"], "basal": PATIENT["basal_type"],
+                                "bolus": PATIENT["bolus_type"]}
+    assert short["logs"]["cols"] == COLUMNS
+
+    rows = [dict(zip(COLUMNS, r)) for r in short["logs"]["rows"]]
+    assert len(rows) == len(full["recent_logs"])
+    for row, log in zip(rows, full["recent_logs"]):
+        at = NOW - timedelta(minutes=row["m"])
+        assert at == datetime.fromisoformat(log["timestamp_utc"])
+        assert short["types"][row["t"]] == log["insulin_type"]
+        assert row["u"] == log["units_taken"]
+        assert (row["purpose"], row["ctx"], row["note"]) == (log["purpose"], log["dose_context"], log["remarks"])
+
+def test_compact_leaves_out_the_name():
+    text = compact(*args(), now=NOW)[0]
+    assert PATIENT["name"] not in text
+    assert PATIENT["name"] in verbose(*args())
+
+def test_compact_is_smaller():
+    assert estimate_tokens(compact(*args(HISTORY[:4]), now=NOW)[0]) < estimate_tokens(verbose(*args(HISTORY[:4])))
@@ -0,0 +1,150 @@
+# test_advisor_response.py
+# advisor_response's strict, incremental reading of the model's answer.
+#
+#   python -m pytest -q test_advisor_response.py
+import pytest
+
+from advisor_response import MIN_WAIT_MINUTES, ParseError, StreamParser, cautious, check, parse
+
+ANSWER = '{"recommendation": "wait", "wait_minutes": 30, "reason": "You took 4 \\"units\\" at 9."}'
+EXPECTED = {"recommendation": "wait", "wait_minutes": 30, "reason": 'You took 4 "units" at 9.'}
+
+def feed(*chunks: str, fenced: bool = True) -> StreamParser:
+    p = StreamParser(fenced)
+    for chunk in chunks:
+        p.feed(chunk)
+    return p
+
+def kind(text: str, fenced: bool = True) -> str:
+    with pytest.raises(ParseError) as e:
+        parse(text, fenced)
+    return e.value.kind
+
+# ─── CHUNKING ───────────────────────────────────────────────
+def test_whole_answer():
+    assert parse(ANSWER) == EXPECTED
+
+@pytest.mark.parametrize("cut", range(1, len(ANSWER)))
+def test_any_split_reads_the_same(cut):
+    p = feed(ANSWER[:cut], ANSWER[cut:])
+    assert p.error is None and p.done
+    assert p.result() == EXPECTED
+
+def test_one_character_at_a_time():
+    assert feed(*ANSWER).result() == EXPECTED
+
+def test_number_split_across_chunks():
+    p = feed('{"recommendation":"wait","wait_minutes":3')
+    assert "wait_minutes" not in p.fields  # "3" may go on
+    p.feed('5,"reason":"r"}')
+    assert p.result()["wait_minutes"] == 35
+
+@pytest.mark.parametrize("cut", range(1, 4))
+def test_literal_split_across_chunks(cut):
+    # true is valid JSON, so it gets as far as the schema check
+    p = feed('{"recommendation":"wait","wait_minutes":' + "true"[:cut], "true"[cut:] + "}")
+    assert p.error is not None and p.error.kind == "schema"
+
+def test_escape_split_across_chunks():
+    p = feed('{"recommendation":"take_now","wait_minutes":0,"reason":"say \\', '"hi\\" \\\\"}')
+    assert p.result()["reason"] == 'say "hi" \\'
+
+def test_bad_scalar_is_invalid_json():
+    assert kind('{"recommendation":"wait","wait_minutes":3x,"reason":"r"}') == "invalid_json"
+
+# ─── FENCES ─────────────────────────────────────────────────
+def test_fenced_answer():
+    assert parse(f"```json\n{ANSWER}\n```") == EXPECTED
+
+def test_fence_split_before_its_newline():
+    assert feed("```js", f"on\n{ANSWER}\n```").result() == EXPECTED
+
+def test_fence_refused_in_schema_mode():
+    assert kind(f"```json\n{ANSWER}\n```", fenced=False) == "invalid_json"
+
+def test_bare_answer_in_schema_mode():
+    assert parse(ANSWER, fenced=False) == EXPECTED
+
+def test_prose_is_invalid_json():
+    assert kind(f"Sure! {ANSWER}") == "invalid_json"
+
+# ─── SCHEMA ─────────────────────────────────────────────────
+def test_missing_reason():
+    assert kind('{"recommendation":"wait","wait_minutes":10}') == "schema"
+
+def test_blank_reason():
+    assert kind('{"recommendation":"wait","wait_minutes":10,"reason":"  "}') == "schema"
+
+def test_unknown_recommendation():
+    assert kind('{"recommendation":"maybe","wait_minutes":10,"reason":"r"}') == "schema"
+
+def test_extra_key():
+    assert kind('{"recommendation":"wait","wait_minutes":10,"reason":"r","dose":4}') == "schema"
+
+def test_nested_value():
+    assert kind('{"recommendation":"wait","wait_minutes":{"min":10},"reason":"r"}') == "schema"
+
+def test_duplicate_key():
+    assert kind('{"recommendation":"wait","recommendation":"take_now","wait_minutes":0,"reason":"r"}') == "schema"
+
+@pytest.mark.parametrize("minutes", ["-5", "12.5", "1e9", "null", '"20"'])
+def test_wait_minutes_out_of_schema(minutes):
+    assert kind(f'{{"recommendation":"wait","wait_minutes":{minutes},"reason":"r"}}') == "schema"
+
+def test_whole_float_minutes_read_as_int():
+    assert parse('{"recommendation":"wait","wait_minutes":20.0,"reason":"r"}')["wait_minutes"] == 20
+
+def test_check_partial_fields():
+    assert check({"recommendation": "wait"}, complete=False) == {"recommendation": "wait"}
+    with pytest.raises(ParseError):
+        check({"recommendation": "wait"})
+
+# ─── TRUNCATION ─────────────────────────────────────────────
+def test_truncated_before_decision():
+    p = feed('{"recommendation":"wait"')
+    assert not p.decided
+    with pytest.raises(ParseError) as e:
+        p.result()
+    assert e.value.kind == "incomplete"
+
+def test_empty_answer():
+    with pytest.raises(ParseError) as e:
+        StreamParser().result()
+    assert e.value.kind == "incomplete"
+
+def test_parse_needs_the_closing_brace():
+    assert kind('{"recommendation":"wait","wait_minutes":10,"reason":"r"') == "incomplete"
+
+def test_stopped_after_decision_uses_stock_reason():
+    p = feed('{"recommendation":"wait","wait_minutes":25,')
+    assert p.decided and not p.done
+    fields = p.result()
+    assert fields["wait_minutes"] == 25 and "25 minutes" in fields["reason"]
+
+def test_stopped_inside_reason_keeps_what_arrived():
+    p = feed('{"recommendation":"take_now","wait_minutes":0,"reason":"Last dose was \\')
+    assert p.result()["reason"] == "Last dose was…"
+
+def test_chunks_after_close_are_ignored():
+    p = feed(ANSWER, "\n```\ntrailing prose")
+    assert p.error is None and p.result() == EXPECTED
+
+# ─── CAUTIOUS ───────────────────────────────────────────────
+def test_wait_zero_becomes_min_wait():
+    fields = parse('{"recommendation":"wait","wait_minutes":0,"reason":"r"}')
+    assert fields["recommendation"] == "wait" and fields["wait_minutes"] == MIN_WAIT_MINUTES
+
+def test_take_now_with_minutes_becomes_wait():
+    fields = parse('{"recommendation":"take_now","wait_minutes":40,"reason":"r"}')
+    assert fields["recommendation"] == "wait" and fields["wait_minutes"] == 40
+
+@pytest.mark.parametrize("fields", [
+    {"recommendation": "take_now", "wait_minutes": 0},
+    {"recommendation": "wait", "wait_minutes": 20},
+])
+def test_consistent_decisions_untouched(fields):
+    assert cautious(dict(fields)) == fields
+
+def test_cautious_applies_to_early_stop():
+    p = feed('{"recommendation":"wait","wait_minutes":0,')
+    assert p.result()["wait_minutes"] == MIN_WAIT_MINUTES
@@ -0,0 +1,100 @@
+# test_iob.py
+# Insulin-on-board curves and the shot-timing cases iob.quick_advice answers
+# without the model.
+#
+#   python -m pytest -q test_iob.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import iob
+
+NOW = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+RAPID = ("rapid", 75, 300)
+LONG = ("long", 0, 1440)
+
+def dose(minutes_ago: float, units: float, insulin_type: str = "Humalog", purpose: str = "bolus") -> dict:
+    return dict(timestamp_utc=(NOW - timedelta(minutes=minutes_ago)).isoformat(),
+                insulin_type=insulin_type, units_taken=units, purpose=purpose)
+
+# ─── CURVES ─────────────────────────────────────────────────
+@pytest.mark.parametrize("minutes, left", [
+    (0, 1.0), (30, 0.925), (75, 0.6726), (150, 0.2681), (240, 0.0329), (300, 0.0),
+])
+def test_rapid_curve_values(minutes, left):
+    assert iob.remaining_fraction(minutes, RAPID) == pytest.approx(left, abs=1e-4)
+
+def test_rapid_curve_only_goes_down():
+    values = [iob.remaining_fraction(m, RAPID) for m in range(0, 301, 5)]
+    assert all(a >= b for a, b in zip(values, values[1:]))
+
+@pytest.mark.parametrize("minutes, left", [(-10, 1.0), (0, 1.0), (360, 0.75), (720, 0.5), (1440, 0.0), (2000, 0.0)])
+def test_long_acting_is_linear(minutes, left):
+    assert iob.remaining_fraction(minutes, LONG) == pytest.approx(left)
+
+@pytest.mark.parametrize("insulin_type, purpose, curve", [
+    ("Fiasp", "bolus", ("rapid", 55, 300)),
+    ("Humalog", "bolus", ("rapid", 75, 300)),
+    ("Humulin R", "bolus", ("rapid", 150, 480)),
+    ("Tresiba", "basal", ("long", 0, 2520)),
+    ("Lantus", "basal", ("long", 0, 1440)),
+    ("something new", "basal", iob.DEFAULT_BASAL),
+    (None, None, iob.DEFAULT_BOLUS),
+])
+def test_curve_for(insulin_type, purpose, curve):
+    assert iob.curve_for(insulin_type, purpose) == curve
+
+def test_insulin_on_board_leaves_out_basal():
+    history = [dose(75, 4), dose(150, 10, "Lantus", "basal"), dose(400, 6)]
+    assert iob.insulin_on_board(history, NOW) == pytest.approx(round(4 * 0.6726, 2), abs=0.01)
+
+def test_insulin_on_board_empty():
+    assert iob.insulin_on_board([], NOW) == 0.0
+
+# ─── QUICK ADVICE ───────────────────────────────────────────
+def test_same_dose_within_duplicate_window_waits():
+    advice = iob.quick_advice([dose(10, 4)], 4, "", NOW)
+    assert advice["recommendation"] == "wait"
+    assert advice["wait_minutes"] >= 5 and advice["wait_minutes"] % 5 == 0
+    # about until half of the earlier dose is used up (~95 min after it for Humalog)
+    assert 70 <= advice["wait_minutes"] + 10 <= 120
+
+def test_different_dose_within_duplicate_window_goes_to_model():
+    assert iob.quick_advice([dose(10, 4)], 10, "", NOW) is None
+
+def test_same_dose_after_duplicate_window_goes_to_model():
+    assert iob.quick_advice([dose(iob.DUPLICATE_MINUTES + 30, 4)], 4, "", NOW) is None
+
+def test_quiet_hours_take_now():
+    advice = iob.quick_advice([dose(10 * 60, 6)], 6, "", NOW)
+    assert advice["recommendation"] == "take_now" and advice["wait_minutes"] == 0
+
+def test_quiet_hours_smaller_dose_take_now():
+    assert iob.quick_advice([dose(10 * 60, 6)], 3, "", NOW)["recommendation"] == "take_now"
+
+def test_quiet_hours_bigger_than_usual_goes_to_model():
+    assert iob.quick_advice([dose(10 * 60, 6)], 80, "", NOW) is None
+
+def test_no_history_goes_to_model():
+    assert iob.quick_advice([], 80, "", NOW) is None
+    assert iob.quick_advice([], 2, "", NOW) is None
+
+def test_long_acting_guard():
+    # a second basal-sized dose 10 h after the last basal could be a repeat
+    history = [dose(10 * 60, 20, "Lantus", "basal")]
+    assert iob.quick_advice(history, 20, "", NOW) is None
+
+def test_long_acting_guard_expires():
+    history = [dose((iob.LONG_ACTING_GUARD_HOURS + 2) * 60, 20, "Lantus", "basal")]
+    assert iob.quick_advice(history, 20, "", NOW)["recommendation"] == "take_now"
+
+def test_recent_dose_goes_to_model():
+    assert iob.quick_advice([dose(2 * 60, 4)], 4, "", NOW) is None
+
+@pytest.mark.parametrize("units, remarks", [(4, "had a big lunch"), (0, ""), (-1, "")])
+def test_remarks_or_non_positive_dose_go_to_model(units, remarks):
+    assert iob.quick_advice([dose(10 * 60, 6)], units, remarks, NOW) is None
+    assert iob.quick_advice([dose(10, units or 4)], units, remarks, NOW) is None
+
+def test_future_rows_from_clock_skew_are_ignored():
+    assert iob.quick_advice([dose(-60, 6), dose(10 * 60, 6)], 6, "", NOW)["recommendation"] == "take_now"
@@ -0,0 +1,177 @@
+# test_rate_limit.py
+# Token bucket refill, AIMD back-off/recovery and the per-number cap, on a
+# fake clock so nothing sleeps and every number is exact.
+#
+#   python -m pytest -q test_rate_limit.py
+import pytest
+
+import rate_limit
+from rate_limit import LOCAL_REFUSAL, NumberCap, RateLimitedTransport, TokenBucket
+from telephony import TelephonyError, Transport
+
+class Clock:
+    """Monotonic time that only moves when told to; sleep() moves it too."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.slept: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class Provider(Transport):
+    """Answers create_call with a sid, or with the errors queued in `fail`."""
+    name = "stub"
+
+    def __init__(self, fail: list | None = None):
+        self.fail = list(fail or [])
+        self.calls: list[str] = []
+
+    def create_call(self, to, twiml, status_callback=None, callback_events=None):
+        self.calls.append(to)
+        if self.fail:
+            raise self.fail.pop(0)
+        return f"CA{len(self.calls)}"
+
+    def fetch_status(self, sid):
+        return "completed", None
+
+# ─── TOKEN BUCKET ───────────────────────────────────────────
+def test_reservations_queue_up():
+    clock = Clock()
+    bucket = TokenBucket(2, clock=clock)
+    assert [bucket.take(clock()) for _ in range(4)] == pytest.approx([0.0, 0.5, 1.0, 1.5])
+
+def test_refill_is_capped_at_burst():
+    clock = Clock()
+    bucket = TokenBucket(2, burst=3, clock=clock)
+    for _ in range(3):
+        assert bucket.take(clock()) == 0.0
+    assert bucket.take(clock()) == pytest.approx(0.5)
+    clock.now += 60  # a long idle spell saves up no more than `burst`
+    assert [bucket.take(clock()) for _ in range(4)] == pytest.approx([0.0, 0.0, 0.0, 0.5])
+
+def test_partial_refill():
+    clock = Clock()
+    bucket = TokenBucket(4, clock=clock)
+    bucket.take(clock())
+    clock.now += 0.125  # half a token back
+    assert bucket.wait_for(clock()) == pytest.approx(0.125)
+    assert bucket.wait_for(clock()) == pytest.approx(0.125)  # looking does not take
+    assert bucket.take(clock()) == pytest.approx(0.125)
+
+def test_throttled_cuts_rate_once_per_burst():
+    clock = Clock()
+    bucket = TokenBucket(10, burst=5, clock=clock)
+    bucket.throttled()
+    assert bucket.rate == pytest.approx(10 * rate_limit.BACKOFF_FACTOR)
+    clock.now += rate_limit.DECREASE_INTERVAL / 2
+    bucket.throttled()  # same burst of 429s
+    assert bucket.rate == pytest.approx(10 * rate_limit.BACKOFF_FACTOR)
+    clock.now += rate_limit.DECREASE_INTERVAL
+    bucket.throttled()
+    assert bucket.rate == pytest.approx(10 * rate_limit.BACKOFF_FACTOR ** 2)
+
+def test_throttled_drops_saved_burst():
+    clock = Clock()
+    bucket = TokenBucket(10, burst=5, clock=clock)
+    bucket.throttled()
+    assert bucket.take(clock()) == pytest.approx(1 / bucket.rate)
+
+def test_throttled_never_below_floor():
+    clock = Clock()
+    bucket = TokenBucket(10, clock=clock)
+    for _ in range(50):
+        clock.now += rate_limit.DECREASE_INTERVAL
+        bucket.throttled()
+    assert bucket.rate == pytest.approx(10 * rate_limit.MIN_RATE_FRACTION)
+
+def test_succeeded_recovers_additively_up_to_ceiling():
+    clock = Clock()
+    bucket = TokenBucket(10, clock=clock)
+    bucket.throttled()
+    cut = bucket.rate
+    bucket.succeeded()
+    assert bucket.rate == pytest.approx(cut + 10 * rate_limit.RECOVER_FRACTION / cut)
+    for _ in range(1000):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+def test_succeeded_at_ceiling_is_a_no_op():
+    bucket = TokenBucket(3, clock=Clock())
+    bucket.succeeded()
+    assert bucket.rate == 3
+
+# ─── PER-NUMBER CAP ─────────────────────────────────────────
+def test_number_cap_sliding_window():
+    cap = NumberCap(calls=2, window=10)
+    cap.record("+1", 0.0)
+    assert cap.wait_for("+1", 1.0) == 0.0
+    cap.record("+1", 1.0)
+    assert cap.wait_for("+1", 2.0) == pytest.approx(8.0)  # until the first call leaves the window
+    assert cap.wait_for("+1", 10.0) == 0.0
+    assert cap.wait_for("+2", 2.0) == 0.0  # other numbers are not affected
+
+def test_number_cap_forgets_idle_numbers():
+    cap = NumberCap(calls=1, window=5)
+    cap.record("+1", 0.0)
+    assert cap.wait_for("+1", 5.0) == 0.0
+    assert "+1" not in cap._recent
+
+# ─── TRANSPORT ──────────────────────────────────────────────
+def limited(provider: Provider, clock: Clock, **kw) -> RateLimitedTransport:
+    kw = dict(dict(calls_per_second=2, burst=1, fetches_per_second=0, per_number_calls=0, max_wait=30), **kw)
+    return RateLimitedTransport(provider, clock=clock, sleep=clock.sleep, **kw)
+
+def test_calls_are_spaced():
+    clock = Clock()
+    t = limited(Provider(), clock)
+    for n in range(3):
+        t.create_call(f"+{n}", "<Response/>")
+    assert clock.slept == pytest.approx([0.5, 0.5])
+
+def test_calls_to_one_number_are_spaced_by_the_cap():
+    clock = Clock()
+    t = limited(Provider(), clock, calls_per_second=0, per_number_calls=2, per_number_window=60, max_wait=120)
+    t.create_call("+1", "")
+    t.create_call("+1", "")
+    t.create_call("+1", "")
+    assert clock.slept == pytest.approx([60.0])
+
+def test_cap_past_max_wait_is_a_local_refusal():
+    clock = Clock()
+    provider = Provider()
+    t = limited(provider, clock, calls_per_second=0, per_number_calls=1, per_number_window=300, max_wait=30)
+    t.create_call("+1", "")
+    with pytest.raises(TelephonyError) as e:
+        t.create_call("+1", "")
+    assert e.value.code == LOCAL_REFUSAL and e.value.retry_after == pytest.approx(300)
+    assert t.refused == 1 and provider.calls == ["+1"]  # never reached the provider
+    assert t.create_call("+2", "")  # other numbers still go through
+
+def test_provider_429_backs_off_and_retries():
+    clock = Clock()
+    provider = Provider([TelephonyError("too many", status=429, code=20429)])
+    t = limited(provider, clock, calls_per_second=10)
+    assert t.create_call("+1", "") == "CA2"
+    assert t.throttled == 1 and t.calls.rate == pytest.approx(10 * rate_limit.BACKOFF_FACTOR + 10 * rate_limit.RECOVER_FRACTION / 7)
+
+def test_provider_429_gives_up_after_retries():
+    clock = Clock()
+    provider = Provider([TelephonyError("too many", status=429)] * (rate_limit.THROTTLE_RETRIES + 1))
+    t = limited(provider, clock)
+    with pytest.raises(TelephonyError):
+        t.create_call("+1", "")
+    assert len(provider.calls) == rate_limit.THROTTLE_RETRIES + 1
+
+def test_other_errors_are_not_retried():
+    clock = Clock()
+    provider = Provider([TelephonyError("bad number", status=400, code=21211, retryable=False)])
+    t = limited(provider, clock)
+    with pytest.raises(TelephonyError):
+        t.create_call("+1", "")
+    assert provider.calls == ["+1"] and t.throttled == 0
@@ -0,0 +1,106 @@
+# test_retry_queue.py
+# Backoff bounds and when a failing reminder goes to the dead-letter table,
+# against a fake connection that records the SQL it is sent.
+#
+#   python -m pytest -q test_retry_queue.py
+import random
+
+import pytest
+
+import retry_queue
+from retry_queue import BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS, MAX_ATTEMPTS, backoff_seconds
+
+class Cursor:
+    def __init__(self, row):
+        self.row = row
+        self.sql: list[str] = []
+
+    def execute(self, sql, params=None):
+        self.sql.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return self.row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class Connection:
+    def __init__(self, row):
+        self.cur = Cursor(row)
+        self.committed = False
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.committed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+@pytest.fixture
+def db(monkeypatch):
+    """db(row) -> the cursor schedule_retry will see, its SELECT answering `row`."""
+    def use(row):
+        c = Connection(row)
+        monkeypatch.setattr(retry_queue, "conn", lambda: c)
+        return c.cur
+    return use
+
+def dead_lettered(cur: Cursor) -> bool:
+    return any(s.startswith("INSERT INTO reminder_dead_letters") for s in cur.sql)
+
+# ─── BACKOFF ────────────────────────────────────────────────
+@pytest.mark.parametrize("attempt", range(1, 12))
+def test_backoff_equal_jitter_bounds(attempt):
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    assert all(ceiling / 2 <= backoff_seconds(attempt) <= ceiling for _ in range(200))
+
+def test_backoff_respects_the_cap():
+    assert max(backoff_seconds(30) for _ in range(200)) <= BACKOFF_MAX_SECONDS
+    assert min(backoff_seconds(30) for _ in range(200)) >= BACKOFF_MAX_SECONDS / 2
+
+def test_backoff_uses_the_whole_upper_half(monkeypatch):
+    monkeypatch.setattr(random, "uniform", lambda a, b: (a, b))
+    assert backoff_seconds(2) == (BACKOFF_BASE_SECONDS, 2 * BACKOFF_BASE_SECONDS)
+
+# ─── DEAD LETTERS ───────────────────────────────────────────
+@pytest.mark.parametrize("earlier", range(MAX_ATTEMPTS - 1))
+def test_retries_before_max_attempts(db, earlier):
+    cur = db((earlier, 7, "Lantus", False))
+    assert retry_queue.schedule_retry(1, "busy") == "retry"
+    assert not dead_lettered(cur)
+    assert any(s.startswith("UPDATE reminders SET attempt_count = %(n)s") for s in cur.sql)
+
+def test_dead_letter_at_max_attempts(db):
+    cur = db((MAX_ATTEMPTS - 1, 7, "Lantus", False))
+    assert retry_queue.schedule_retry(1, "no-answer", "no answer", "CA1") == "dead"
+    assert dead_lettered(cur)
+    assert "UPDATE reminders SET attempt_count = 0 WHERE reminder_id = %s" in cur.sql
+
+def test_not_retryable_dead_letters_at_once(db):
+    cur = db((0, 7, "Lantus", False))
+    assert retry_queue.schedule_retry(1, "failed", "invalid number", retryable=False) == "dead"
+    assert dead_lettered(cur)
+
+def test_switched_off_is_left_alone(db):
+    cur = db((MAX_ATTEMPTS - 1, 7, "Lantus", True))
+    assert retry_queue.schedule_retry(1, "busy") == "off"
+    assert len(cur.sql) == 1  # only the SELECT
+
+def test_deleted_reminder(db):
+    cur = db(None)
+    assert retry_queue.schedule_retry(1, "busy") == "gone"
+    assert len(cur.sql) == 1
+
+@pytest.mark.parametrize("status, outcome", [("busy", "retry"), ("no-answer", "retry"), ("failed", "retry"),
+                                             ("canceled", None), ("completed", None)])
+def test_on_call_finished(db, status, outcome):
+    db((0, 7, "Lantus", False))
+    assert retry_queue.on_call_finished(1, status, None, "CA1") == outcome